@@ -6,17 +6,17 @@ from tkinter import messagebox
 import matplotlib.pyplot as plt
 import numpy as np
 import Graphic
+import Scan_Steps
 import datetime
 import femtoQ.tools as fq
 import scipy.interpolate as interp
 import scipy.signal as sgn
 import scipy.constants as sc
-import serial
 import os
 import time
-import zhinst.utils
-from _horiba_ihr import HoribaIHR320
-import femtoQ.pulse_retrieval as fqpr
+# Driver and retrieval packages (zhinst, _horiba_ihr, femtoQ.pulse_retrieval)
+# are imported in the functions using them so they are only loaded when an
+# experiment needs them.
 
 
 class CreateLayout:
@@ -630,40 +630,14 @@ class FiberCaract:
         return
     
     def Zurich_acquire(self):
-        import time
-        path = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/sample'
-        path2 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/timeconstant'
-        path3 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/order'
-        tc= self.Zurich.info['daq'].getDouble(path2)
-        # print
-        order= self.Zurich.info['daq'].getDouble(path3)
-        if self.wait_var.get() == 1:
-            # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
-            if order == 1:
-                Settling_time = 4.61*tc
-            elif order == 2:
-                Settling_time = 6.64*tc
-            elif order == 3:
-                Settling_time = 8.41*tc
-            elif order == 4:
-                Settling_time = 10.05*tc
-            time.sleep(Settling_time)
-        self.Zurich.info['daq'].subscribe(path)
-        data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-
-
-        try:
-            data = data_set[path]['x']
-            # print(data)
-            # print(len(data))
-        except:
-            pass
-        self.Zurich.info['daq'].unsubscribe(path)
-        return  data
+        # The demodulator stays subscribed during the scan, only the samples
+        # of the averaging window are taken from the stream
+        return Scan_Steps.lockin_acquire(self.Zurich, self.PI, settle=self.wait_var.get() == 1)
 
 
 
     def zurich_Boxcar(device_id, do_plot=False):
+        import zhinst.utils
         apilevel_example = 6  # The API level supported by this example.
         err_msg = "This example can only be ran on UHF Instruments with the BOX option enabled."
         # Call a zhinst utility function that returns:
@@ -939,7 +913,7 @@ class FiberCaract:
         scan_graph.update_graph()
         EOS_graph = self.graph_dict['Signal']
         EOS_graph.axes.set_ylim([-10,10])
-        EOS_graph.axes.set_xlim([0, (max_pos-min_pos)*2/1000/c*1e15])
+        EOS_graph.axes.set_xlim([0, self.PI.stage_calibration.to_delay(max_pos, zero=min_pos)])
         EOS_graph.Line.set_xdata([])
         EOS_graph.Line.set_ydata([])
         if self.plotRefSignal is True:
@@ -952,58 +926,59 @@ class FiberCaract:
         EOS_graph.update_graph()
         self.graph_dict['Spectrum'].update_graph()
             #Steps in wavelength
-        for j in range(len(self.lamda_array)):
-            answer = messagebox.askokcancel(title='Verify Wavelength', message='Are you sure the laser is at ' + str(int(self.lamda_array[j])) + ' nm?', icon=messagebox.WARNING)
-            if not answer:
-                self.running = False
-                return
-            
-            self.PI.set_velocity(return_vel)
-            self.PI.go_2position(move[0])
-            self.PI.set_velocity(self.vel_var)
-            
-            pos = np.zeros(nsteps+1)
-            self.S = np.zeros(nsteps+1)
-            self.t= np.zeros(nsteps+1)
-            
-                # Main scanning and measurements
-            for i in range(nsteps+1):
-                # Move stage to required position
-                self.PI.go_2position(move[i])
-                # Measure real position
-                pos[i] = self.PI.get_position()
-                # Measure signal
-                self.t[i] = (pos[i]-pos[0])*2/1000/c*1e15
-                self.S[i] = np.mean(self.Zurich_acquire())*1000
+        try:
+            for j in range(len(self.lamda_array)):
+                answer = messagebox.askokcancel(title='Verify Wavelength', message='Are you sure the laser is at ' + str(int(self.lamda_array[j])) + ' nm?', icon=messagebox.WARNING)
+                if not answer:
+                    self.running = False
+                    return
+            
+                self.PI.set_velocity(return_vel)
+                self.PI.go_2position(move[0])
+                self.PI.set_velocity(self.vel_var)
+            
+                pos = np.zeros(nsteps+1)
+                self.S = np.zeros(nsteps+1)
+                self.t= np.zeros(nsteps+1)
+            
+                    # Main scanning and measurements
+                for i in range(nsteps+1):
+                    # Move stage to required position, measure real position
+                    # and signal
+                    pos[i], self.S[i] = Scan_Steps.lockin_step(self.PI, self.Zurich_acquire, move[i])
+                    self.t[i] = self.PI.stage_calibration.to_delay(pos[i], zero=pos[0])
                 
-                # Actualise progress bar
-                if progress:
-                    progress['value'] = (i)/(nsteps)
-                    progress.update()
-                # Actualise graph if required
-                if (time.time() - last_gu) > update_time:
-                    scan_graph.Line.set_xdata(iteration[:i])
-                    scan_graph.Line.set_ydata(pos[:i])
-                    scan_graph.update_graph()
-                    EOS_graph.Line.set_xdata(self.t[:i])
-                    EOS_graph.Line.set_ydata(self.S[:i])
-                    EOS_graph.axes.set_ylim([1.2*np.min(self.S),1.2*np.max(self.S)])
-                    EOS_graph.update_graph()
+                    # Actualise progress bar
+                    if progress:
+                        progress['value'] = (i)/(nsteps)
+                        progress.update()
+                    # Actualise graph if required
+                    if (time.time() - last_gu) > update_time:
+                        scan_graph.Line.set_xdata(iteration[:i])
+                        scan_graph.Line.set_ydata(pos[:i])
+                        scan_graph.update_graph()
+                        EOS_graph.Line.set_xdata(self.t[:i])
+                        EOS_graph.Line.set_ydata(self.S[:i])
+                        EOS_graph.axes.set_ylim([1.2*np.min(self.S),1.2*np.max(self.S)])
+                        EOS_graph.update_graph()
                     
-                    last_gu = time.time()
+                        last_gu = time.time()
                     
-                if not self.running:
-                    break
+                    if not self.running:
+                        break
             
             
-            # data = np.array([self.t,self.S])
-            print(self.t,self.S)
-            self.data_array[j,0]=self.t
-            self.data_array[j,1]=self.S
+                # data = np.array([self.t,self.S])
+                print(self.t,self.S)
+                self.data_array[j,0]=self.t
+                self.data_array[j,1]=self.S
 
             
-            if not self.running:
-                    break
+                if not self.running:
+                        break
+        finally:
+            # Releasing the demodulator subscription used during the scan
+            self.Zurich.stop_stream(0)
         if not self.running:
 
             self.PI.set_velocity(return_vel)
@@ -1592,17 +1567,10 @@ class Electro_Optic_Sampling_ZeroDelay:
         
             # Main scanning and measurements
         for i in range(nsteps+1):
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            pos[i] = self.PI.get_position()
-            
-            # Acquire spectrum and plot graph 
-            wl = self.Spectro.spectro.wavelengths()
-            S = self.Spectro.get_intensities()
-            wl_crop = wl[(wl>minwl)&(wl<maxwl)]
-            S_crop = S[(wl>minwl)&(wl<maxwl)]
-            Si[i] = np.trapz(S_crop,wl_crop) 
+            # Move stage to required position, measure real position and
+            # acquire spectrum
+            pos[i], wl, S = Scan_Steps.spectrum_step(self.PI, self.Spectro, move[i])
+            S_crop, Si[i] = Scan_Steps.crop_spectrum(wl, S, minwl, maxwl)
             
             # Actualise progress bar
             if progress:
@@ -1943,17 +1911,11 @@ class CHI3_Sampling_ZeroDelay:
         
             # Main scanning and measurements
         for i in range(nsteps+1):
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            self.pos[i] = self.PI.get_position()
-            
-            # Acquire spectrum and plot graph 
-            wl = self.Spectro.spectro.wavelengths()
-            S = self.Spectro.get_intensities()
+            # Move stage to required position, measure real position and
+            # acquire spectrum
+            self.pos[i], wl, S = Scan_Steps.spectrum_step(self.PI, self.Spectro, move[i])
             self.wl_crop = wl[(wl>minwl)&(wl<maxwl)]
-            S_crop = S[(wl>minwl)&(wl<maxwl)]
-            self.Si[i] = np.trapz(S_crop,self.wl_crop) 
+            S_crop, self.Si[i] = Scan_Steps.crop_spectrum(wl, S, minwl, maxwl)
             
             # Actualise progress bar
             if progress:
@@ -2198,6 +2160,23 @@ class FROG:
         self.autocorr_e = tk.Entry(frame, width = 6, textvariable = self.autocorr_var, state = 'disabled')
         autocorr_lbl.grid(row=23, column=0, sticky='nsw')
         self.autocorr_e.grid(row=23, column=1, sticky='nse')
+
+        # Hardware timed scan : the controller steps the stage with its wave
+        # generator and triggers the spectrometer on every plateau
+        self.hw_var = tk.IntVar()
+        self.dwell_var = tk.DoubleVar()
+        self.dwell_var.set(50)
+        hw_cb = tk.Checkbutton(frame, text='Hardware timed, dwell (ms):', variable=self.hw_var)
+        hw_cb.grid(row=9, column=0, sticky='nsw')
+        dwell_e = tk.Entry(frame, width=6, textvariable=self.dwell_var)
+        dwell_e.grid(row=9, column=1, sticky='nse')
+        # Time left to the stage to settle on each plateau before the trigger
+        settle_lbl = tk.Label(frame, text='Hardware settling (ms):')
+        self.settle_var = tk.DoubleVar()
+        self.settle_var.set(10)
+        settle_e = tk.Entry(frame, width=6, textvariable=self.settle_var)
+        settle_lbl.grid(row=24, column=0, sticky='nsw')
+        settle_e.grid(row=24, column=1, sticky='nse')
         
 
     def adjust_2dgraph(self):#, step=None):
@@ -2349,7 +2328,7 @@ class FROG:
         spectro_graph.Line.set_xdata(wl)
         spectro_graph.Line.set_ydata(S)
         Signal_graph = self.graph_dict['Autocorrelation']
-        Signal_graph.axes.set_xlim([2*min_pos*1e-6/299792458*1e15,2*max_pos*1e-6/299792458*1e15])
+        Signal_graph.axes.set_xlim(self.PI.stage_calibration.to_delay(np.array([min_pos, max_pos]), zero=0))
         Signal_graph.axes.set_ylim([0,1])
         minwl = minwl.get()
         maxwl = maxwl.get()
@@ -2357,19 +2336,36 @@ class FROG:
         self.wl_crop = wl[(wl>minwl)&(wl<maxwl)]
         self.trace = np.zeros((nsteps+1,self.wl_crop.shape[0]))
         
+        hardware = self.hw_var.get() == 1
+        if hardware:
+            # The spectrometer waits for the pulse of each plateau, there is
+            # no exchange with the stage during the scan
+            self.Spectro.set_trigger(4)
+            try:
+                spectra, measured = self.PI.stepped_scan(move, self.dwell_var.get()/1000,
+                                                         acquire=lambda i: self.Spectro.get_intensities(),
+                                                         settle=self.settle_var.get()/1000,
+                                                         integration=inte_time.get()/1000)
+            finally:
+                self.Spectro.set_trigger(0)
+            if len(spectra) != nsteps+1:
+                self.running = False
+            else:
+                # Positions read on every plateau, not the commanded ones
+                pos[:] = measured
+                S_all = np.array(spectra)[:, (wl>minwl)&(wl<maxwl)]
+                self.trace[:] = S_all
+                Si[:] = np.trapz(S_all, self.wl_crop, axis=1)
+                S = spectra[-1]
+
             # Main scanning and measurements
         for i in range(nsteps+1):
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            pos[i] = self.PI.get_position()
-            
-            # Acquire spectrum and plot graph 
-            wl = self.Spectro.spectro.wavelengths()
-            S = self.Spectro.get_intensities()
-            wl_crop = wl[(wl>minwl)&(wl<maxwl)]
-            S_crop = S[(wl>minwl)&(wl<maxwl)]
-            Si[i] = np.trapz(S_crop,wl_crop) 
+            if hardware:
+                break
+            # Move stage to required position, measure real position and
+            # acquire spectrum
+            pos[i], wl, S = Scan_Steps.spectrum_step(self.PI, self.Spectro, move[i])
+            S_crop, Si[i] = Scan_Steps.crop_spectrum(wl, S, minwl, maxwl)
             self.trace[i] = S_crop
             
             # Actualise progress bar
@@ -2385,7 +2381,7 @@ class FROG:
                 spectro_graph.Line.set_xdata(wl)
                 spectro_graph.Line.set_ydata(S)
                 spectro_graph.update_graph()
-                Signal_graph.Line.set_xdata(2*pos[:i]*1e-6/299792458*1e15)
+                Signal_graph.Line.set_xdata(self.PI.stage_calibration.to_delay(pos[:i], zero=0))
                 Signal_graph.Line.set_ydata(Si[:i]/np.max(Si))
                 Signal_graph.update_graph()
                 
@@ -2410,7 +2406,7 @@ class FROG:
             spectro_graph.Line.set_xdata(wl)
             spectro_graph.Line.set_ydata(S)
             spectro_graph.update_graph()
-            Signal_graph.Line.set_xdata(2*pos*1e-6/299792458*1e15)
+            Signal_graph.Line.set_xdata(self.PI.stage_calibration.to_delay(pos, zero=0))
             Signal_graph.Line.set_ydata(Si/np.max(Si))
             Signal_graph.update_graph()
             
@@ -2420,7 +2416,7 @@ class FROG:
         
         # Going back to initial state
         self.running = False
-        self.timeDelay = 2*pos*1e-6/299792458*1e15
+        self.timeDelay = self.PI.stage_calibration.to_delay(pos, zero=0)
         progress['value'] = 0
         progress.update()
         self.stop_button['state'] = 'disabled'
@@ -2820,17 +2816,10 @@ class TwoDSI:
         
             # Main scanning and measurements
         for i in range(nsteps+1):
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            pos[i] = self.PI.get_position()
-            
-            # Acquire spectrum and plot graph 
-            wl = self.Spectro.spectro.wavelengths()
-            S = self.Spectro.get_intensities()
-            wl_crop = wl[(wl>minwl)&(wl<maxwl)]
-            S_crop = S[(wl>minwl)&(wl<maxwl)]
-            Si[i] = np.trapz(S_crop,wl_crop) 
+            # Move stage to required position, measure real position and
+            # acquire spectrum
+            pos[i], wl, S = Scan_Steps.spectrum_step(self.PI, self.Spectro, move[i])
+            S_crop, Si[i] = Scan_Steps.crop_spectrum(wl, S, minwl, maxwl)
             self.shearTrace[i] = S_crop
             
             # Actualise progress bar
@@ -2875,7 +2864,7 @@ class TwoDSI:
             
                 
             self.shearPos = pos
-            self.shearWL = wl_crop
+            self.shearWL = self.wl_crop
             self.adjust_sheargraph()
             self.start_button['state'] = 'normal'
             
@@ -3290,17 +3279,10 @@ class TwoDSI:
         
             # Main scanning and measurements
         for i in range(nsteps+1):
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            pos[i] = self.PI.get_position()
-            
-            # Acquire spectrum and plot graph 
-            wl = self.Spectro.spectro.wavelengths()
-            S = self.Spectro.get_intensities()
-            wl_crop = wl[(wl>minwl)&(wl<maxwl)]
-            S_crop = S[(wl>minwl)&(wl<maxwl)]
-            Si[i] = np.trapz(S_crop,wl_crop) 
+            # Move stage to required position, measure real position and
+            # acquire spectrum
+            pos[i], wl, S = Scan_Steps.spectrum_step(self.PI, self.Spectro, move[i])
+            S_crop, Si[i] = Scan_Steps.crop_spectrum(wl, S, minwl, maxwl)
             self.twoDSITrace[i] = S_crop
             
             # Actualise progress bar
@@ -3345,7 +3327,7 @@ class TwoDSI:
             
                 
             self.twoDSIPos = pos
-            self.twoDSIWL = wl_crop
+            self.twoDSIWL = self.wl_crop
             self.adjust_2dsigraph()
             self.save_button['state'] = 'normal'
             
@@ -3475,6 +3457,42 @@ class Electro_Optic_Sampling:
         self.save_button.grid(row=20, column=0, columnspan=2, sticky='nsew')
         self.wait = tk.Checkbutton(frame,text='Settling wait time', variable=self.wait_var)   
         self.wait.grid(row=10, column=0, columnspan=2, sticky='nsew')
+        # Fly scan : the stage sweeps the range at the velocity set above
+        # while the lock-in records the trace as one grid
+        self.fly_var = tk.IntVar()
+        self.fly_trigger = tk.StringVar()
+        self.fly_trigger.set('continuous')
+        fly = tk.Checkbutton(frame, text='Fly scan, trigger :', variable=self.fly_var)
+        fly.grid(row=17, column=0, sticky='nsw')
+        fly_cb = ttk.Combobox(frame, textvariable=self.fly_trigger, state='readonly', width=10,
+                              values=['continuous', 'hardware', 'edge'])
+        fly_cb.grid(row=17, column=1, sticky='nse')
+
+    def fly_scan(self, min_pos, max_pos, points):
+        """
+        Record the trace during one continuous sweep of the stage with the
+        DataAcquisitionModule of the lock-in.
+
+        Parameters:
+            min_pos/max_pos : Limits of the sweep in mm.
+            points : Number of samples of the grid.
+
+        Returns:
+            Tuple of arrays (position in mm, x in V) sorted by position.
+        """
+        from Zurich_Instrument import FlyScan
+        # With the hardware trigger the output 1 of the stage controller is
+        # wired to the Trig In 1 of the lock-in, the sweep sets it to be high
+        # while the stage moves
+        recorder = FlyScan(self.Zurich, signal='demods/0/sample.x', trigger=self.fly_trigger.get(),
+                           trigger_node='demods/0/sample.TrigIn1')
+        try:
+            pos, S, _ = recorder.sweep(self.PI, min_pos, max_pos, self.vel_var.get(), points)
+        finally:
+            recorder.close()
+        order = np.argsort(pos)
+        return pos[order], S[order]
+
     def save(self):
         timeStamp = datetime.datetime.now().strftime("%Y-%m-%d %Hh%M_%S")
         np.savez(timeStamp+'_EOS_measurement',time = self.t,signal = self.S)
@@ -3531,35 +3549,9 @@ class Electro_Optic_Sampling:
         return
     
     def Zurich_acquire(self):
-        import time
-        path = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/sample'
-        path2 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/timeconstant'
-        path3 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/order'
-        tc= self.Zurich.info['daq'].getDouble(path2)
-        order= self.Zurich.info['daq'].getDouble(path3)
-        if self.wait_var.get() == 1:
-            # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
-            if order == 1:
-                Settling_time = 4.61*tc
-            elif order == 2:
-                Settling_time = 6.64*tc
-            elif order == 3:
-                Settling_time = 8.41*tc
-            elif order == 4:
-                Settling_time = 10.05*tc
-            time.sleep(Settling_time)
-        self.Zurich.info['daq'].subscribe(path)
-        data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-
-
-        try:
-            data = data_set[path]['x']
-#            print(data)
-#            print(len(data))
-        except:
-            pass
-        self.Zurich.info['daq'].unsubscribe(path)
-        return  data
+        # The demodulator stays subscribed during the scan, only the samples
+        # of the averaging window are taken from the stream
+        return Scan_Steps.lockin_acquire(self.Zurich, self.PI, settle=self.wait_var.get() == 1)
     
     def stop_experiment(self):
         self.running = False
@@ -3628,7 +3620,7 @@ class Electro_Optic_Sampling:
         scan_graph.update_graph()
         EOS_graph = self.graph_dict['Signal']
         EOS_graph.axes.set_ylim([-10,10])
-        EOS_graph.axes.set_xlim([0, (max_pos-min_pos)*2/1000/c*1e15])
+        EOS_graph.axes.set_xlim([0, self.PI.stage_calibration.to_delay(max_pos, zero=min_pos)])
         EOS_graph.Line.set_xdata([])
         EOS_graph.Line.set_ydata([])
         if self.plotRefSignal is True:
@@ -3640,33 +3632,51 @@ class Electro_Optic_Sampling:
             self.graph_dict['Spectrum'].LineRef.set_linestyle('--')
         EOS_graph.update_graph()
         self.graph_dict['Spectrum'].update_graph()
+        fly = self.fly_var.get() == 1
+        if fly:
+            # One sweep replaces the stop-and-poll points, the grid has as
+            # many samples as the steps asked
+            pos, self.S = self.fly_scan(min_pos, max_pos, nsteps+1)
+            if not pos.size:
+                messagebox.showinfo(title='Error', message='No data recorded during the fly scan, check the trigger')
+                self.running = False
+                pos = np.zeros(1)
+                self.S = np.zeros(1)
+            self.S = self.S*1000
+            self.t = self.PI.stage_calibration.to_delay(pos, zero=pos[0])
+            nsteps = pos.size - 1
+            iteration = np.linspace(0, nsteps, nsteps+1)
+            move = np.linspace(min_pos, max_pos, nsteps+1)
             # Main scanning and measurements
-        for i in range(nsteps+1):
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            pos[i] = self.PI.get_position()
-            # Measure signal
-            self.t[i] = (pos[i]-pos[0])*2/1000/c*1e15
-            self.S[i] = np.mean(self.Zurich_acquire())*1000
+        try:
+            for i in range(nsteps+1):
+                if fly:
+                    break
+                # Move stage to required position, measure real position
+                # and signal
+                pos[i], self.S[i] = Scan_Steps.lockin_step(self.PI, self.Zurich_acquire, move[i])
+                self.t[i] = self.PI.stage_calibration.to_delay(pos[i], zero=pos[0])
             
-            # Actualise progress bar
-            if progress:
-                progress['value'] = (i)/(nsteps)
-                progress.update()
-            # Actualise graph if required
-            if (time.time() - last_gu) > update_time:
-                scan_graph.Line.set_xdata(iteration[:i])
-                scan_graph.Line.set_ydata(pos[:i])
-                scan_graph.update_graph()
-                EOS_graph.Line.set_xdata(self.t[:i])
-                EOS_graph.Line.set_ydata(self.S[:i])
-                EOS_graph.axes.set_ylim([1.2*np.min(self.S),1.2*np.max(self.S)])
-                EOS_graph.update_graph()
+                # Actualise progress bar
+                if progress:
+                    progress['value'] = (i)/(nsteps)
+                    progress.update()
+                # Actualise graph if required
+                if (time.time() - last_gu) > update_time:
+                    scan_graph.Line.set_xdata(iteration[:i])
+                    scan_graph.Line.set_ydata(pos[:i])
+                    scan_graph.update_graph()
+                    EOS_graph.Line.set_xdata(self.t[:i])
+                    EOS_graph.Line.set_ydata(self.S[:i])
+                    EOS_graph.axes.set_ylim([1.2*np.min(self.S),1.2*np.max(self.S)])
+                    EOS_graph.update_graph()
                 
-                last_gu = time.time()
-            if not self.running:
-                break
+                    last_gu = time.time()
+                if not self.running:
+                    break
+        finally:
+            # Releasing the demodulator subscription used during the scan
+            self.Zurich.stop_stream(0)
         if not self.running:
             return_vel = tk.IntVar()
             return_vel.set(5)
@@ -3912,13 +3922,6 @@ class CHI3_Sampling:
         return
     
     def Zurich_acquire(self):
-        import time
-        path = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/sample'
-        path2 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/timeconstant'
-        path3 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/order'
-        tc= self.Zurich.info['daq'].getDouble(path2)
-        # print
-        order= self.Zurich.info['daq'].getDouble(path3)
         # if self.wait_var.get() == 1:
         #     # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
         #     if order == 1:
@@ -3930,33 +3933,14 @@ class CHI3_Sampling:
         #     elif order == 4:
         #         Settling_time = 10.05*tc
         #     time.sleep(Settling_time)
-        # self.Zurich.info['daq'].subscribe(path)
-        # data_set = self.Zurich.info['daq'].poll(0.01,200,0,True)
-        self.Zurich.info['daq'].subscribe(path)
+        # The demodulator stays subscribed during the scan, only the samples
+        # of the averaging window are taken from the stream
+        duration = 0.01
         if self.wait_var.get() == 1:
-            # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
-            data_set = self.Zurich.info['daq'].poll(1,100,0,True)
-        # else:
-        #     data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-            
+            duration = 1
         if self.wait_var2.get() == 1:
-            # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
-            data_set = self.Zurich.info['daq'].poll(2,100,0,True)
-        # else:
-        #     data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-        if (self.wait_var.get() == 0 & self.wait_var2.get() == 0):
-            # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
-            data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-        
-
-        try:
-            data = data_set[path]['x']
-            # print(data)
-            # print(len(data))
-        except:
-            pass
-        self.Zurich.info['daq'].unsubscribe(path)
-        return  data
+            duration = 2
+        return Scan_Steps.lockin_acquire(self.Zurich, duration=duration)
 
 
     def stop_experiment(self):
@@ -4027,7 +4011,7 @@ class CHI3_Sampling:
         scan_graph.update_graph()
         EOS_graph = self.graph_dict['Signal']
         EOS_graph.axes.set_ylim([-10,10])
-        EOS_graph.axes.set_xlim([0, (max_pos-min_pos)*2/1000/c*1e15])
+        EOS_graph.axes.set_xlim([0, self.PI.stage_calibration.to_delay(max_pos, zero=min_pos)])
         EOS_graph.Line.set_xdata([])
         EOS_graph.Line.set_ydata([])
         if self.plotRefSignal is True:
@@ -4040,32 +4024,33 @@ class CHI3_Sampling:
         EOS_graph.update_graph()
         self.graph_dict['Spectrum'].update_graph()
             # Main scanning and measurements
-        for i in range(nsteps+1):
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            pos[i] = self.PI.get_position()
-            # Measure signal
-            self.t[i] = (pos[i]-pos[0])*2/1000/c*1e15
-            self.S[i] = np.mean(self.Zurich_acquire())*1000
+        try:
+            for i in range(nsteps+1):
+                # Move stage to required position, measure real position
+                # and signal
+                pos[i], self.S[i] = Scan_Steps.lockin_step(self.PI, self.Zurich_acquire, move[i])
+                self.t[i] = self.PI.stage_calibration.to_delay(pos[i], zero=pos[0])
             
-            # Actualise progress bar
-            if progress:
-                progress['value'] = (i)/(nsteps)
-                progress.update()
-            # Actualise graph if required
-            if (time.time() - last_gu) > update_time:
-                scan_graph.Line.set_xdata(iteration[:i])
-                scan_graph.Line.set_ydata(pos[:i])
-                scan_graph.update_graph()
-                EOS_graph.Line.set_xdata(self.t[:i])
-                EOS_graph.Line.set_ydata(self.S[:i])
-                EOS_graph.axes.set_ylim([1.2*np.min(self.S),1.2*np.max(self.S)])
-                EOS_graph.update_graph()
+                # Actualise progress bar
+                if progress:
+                    progress['value'] = (i)/(nsteps)
+                    progress.update()
+                # Actualise graph if required
+                if (time.time() - last_gu) > update_time:
+                    scan_graph.Line.set_xdata(iteration[:i])
+                    scan_graph.Line.set_ydata(pos[:i])
+                    scan_graph.update_graph()
+                    EOS_graph.Line.set_xdata(self.t[:i])
+                    EOS_graph.Line.set_ydata(self.S[:i])
+                    EOS_graph.axes.set_ylim([1.2*np.min(self.S),1.2*np.max(self.S)])
+                    EOS_graph.update_graph()
                 
-                last_gu = time.time()
-            if not self.running:
-                break
+                    last_gu = time.time()
+                if not self.running:
+                    break
+        finally:
+            # Releasing the demodulator subscription used during the scan
+            self.Zurich.stop_stream(0)
         if not self.running:
             return_vel = tk.IntVar()
             return_vel.set(1)
@@ -4151,10 +4136,10 @@ class PumpProbe:
         self.Spectro = mainf.Frame[3].Spectro
         
     def pos_2_delay(self,zero,pos):
-            return  (pos-zero)*2e12/(sc.c)
+            return self.PI.stage_calibration.to_delay(pos, zero=zero)
         
     def delay_2_pos(self,zero,delay):
-            return zero+(delay*sc.c/(2e12))
+            return self.PI.stage_calibration.to_position(delay, zero=zero)
         
     def create_frame(self, frame):
         # Define labels
@@ -4307,7 +4292,7 @@ class PumpProbe:
         inte_e.bind('<Return>', lambda e: self.Spectro.adjust_integration_time(inte_var))
         
         self.start_button = tk.Button(frame, text='Start Experiment', state='disabled', width=18, 
-                                      command=lambda: self.start_experiment(max_pos=self.delay_2_pos(zero_var.get(),max_t_var.get()) , min_pos=self.delay_2_pos(zero_var.get(),min_t_var.get()), zero=zero_var, step=step_t_var.get()*sc.c/(2e12), progress=p_bar, 
+                                      command=lambda: self.start_experiment(max_pos=self.delay_2_pos(zero_var.get(),max_t_var.get()) , min_pos=self.delay_2_pos(zero_var.get(),min_t_var.get()), zero=zero_var, step=self.delay_2_pos(0, step_t_var.get()), progress=p_bar, 
                                                                             update_time=utime_var, inte_time=inte_var, int_period=self.int_period_var))
         self.start_button.grid(row=13, column=0, sticky='nsew')
         
@@ -4798,19 +4783,10 @@ class PumpProbe:
             # Main scanning and measurements
         for i in range(nsteps):
         
-            # Move stage to required position
-            self.PI.go_2position(move[i])
-            # Measure real position
-            self.pos[i] = self.PI.get_position()
-            
-            spectra_pos=[]            
-            
-            start_daq=time.time()
-            while time.time()-start_daq < int_period/1000. :
-                spectra_pos.append(self.Spectro.get_intensities())
-                
-            spectra_pos=np.array(spectra_pos)
-            spectra_pos[spectra_pos==0]=1
+            # Move stage to required position, measure real position and
+            # acquire spectra during the integration period
+            self.pos[i], spectra_pos = Scan_Steps.spectra_step(self.PI, self.Spectro, move[i],
+                                                               int_period/1000.)
             
             self.data_dict['pos_{}'.format(i)] = spectra_pos[:,670:1679]
             self.wl_crop=self.wl[670:1679]
@@ -5131,15 +5107,12 @@ class batchSpectra:
         for ii in range(numFile):
             
             if ii == numFile-1:
-                savSpecArray = np.zeros((lastFileNum, len(wl)))
+                shape = (lastFileNum, len(wl))
             else:
-                savSpecArray = np.zeros((mainFileNum, len(wl)))
-            
-            for jj in range(savSpecArray.shape[0]):
-                savSpecArray[jj,:] = self.Spectro.get_intensities()
+                shape = (mainFileNum, len(wl))
                 
             fileName = 'spectra - ' + str(ii) + '.npy'
-            np.save(folderPath + '/' + fileName, savSpecArray)
+            Scan_Steps.save_spectra(self.Spectro, shape, folderPath + '/' + fileName)
             
             # Actualise progress bar
             if progress:
@@ -5268,6 +5241,7 @@ class iHR320:
                     }
 
             config_path = ''
+            from _horiba_ihr import HoribaIHR320
             self.mono = HoribaIHR320(name,config,config_path)
             messagebox.showinfo(title="Monochromator", message="Horiba iHR320 is connected")
             #messagebox.showinfo(title="Monochromator", message=f"{self.mono._state}")
@@ -5362,19 +5336,10 @@ class Boxcar:
 
     
     def Zurich_acquire(self):
-        path = '/' + '{}'.format(self.Zurich.info['device'])+'/boxcars/0/sample'
-        self.Zurich.info['daq'].subscribe(path)
-        data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-
-        
-        try:
-            data = data_set[path]['value']
-#            print(data)
-#            print(len(data))
-        except:
-            pass
-        self.Zurich.info['daq'].unsubscribe(path)
-        return  data
+        # The boxcar samples are received by the poller thread of the
+        # lock-in, only the samples of the averaging window are taken from
+        # its stream
+        return Scan_Steps.lockin_acquire(self.Zurich, node='boxcars')
     
     def stop_experiment(self):
         self.running = False
@@ -5433,22 +5398,26 @@ class Boxcar:
 #            if not self.running:
 #                break
             
-        while duration<max_pos:
-            if duration>((current_i*max_pos/nsteps)-150e-3):
-                time_tracker.append((time.time_ns()-last_gu)*1e-9)
-                b.append(np.mean(self.Zurich_acquire()))
+        try:
+            while duration<max_pos:
+                if duration>((current_i*max_pos/nsteps)-150e-3):
+                    time_tracker.append((time.time_ns()-last_gu)*1e-9)
+                    b.append(np.mean(self.Zurich_acquire()))
                 
-                if progress:
-                    progress['value'] = current_i/nsteps
-                    progress.update()
-                current_i+=1
+                    if progress:
+                        progress['value'] = current_i/nsteps
+                        progress.update()
+                    current_i+=1
                 
-            if current_i>nsteps:
-                break
+                if current_i>nsteps:
+                    break
             
-            if not self.running:
-                break
-            duration=(time.time_ns()-last_gu)*1e-9
+                if not self.running:
+                    break
+                duration=(time.time_ns()-last_gu)*1e-9
+        finally:
+            # Releasing the boxcar subscription used during the measurement
+            self.Zurich.stop_stream(0, 'boxcars')
             
         self.S = np.asarray(b)
         self.t = np.asarray(time_tracker)
@@ -5523,6 +5492,7 @@ class Horiba_spectrum:
                     }
 
             config_path = ''
+            from _horiba_ihr import HoribaIHR320
             self.mono = HoribaIHR320(name,config,config_path)
             messagebox.showinfo(title="Monochromator", message="Horiba iHR320 is connected")
             #messagebox.showinfo(title="Monochromator", message=f"{self.mono._state}")
@@ -5654,35 +5624,9 @@ class Horiba_spectrum:
         return
     
     def Zurich_acquire(self):
-        import time
-        path = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/sample'
-        path2 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/timeconstant'
-        path3 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/order'
-        tc= self.Zurich.info['daq'].getDouble(path2)
-        order= self.Zurich.info['daq'].getDouble(path3)
-        if self.wait_var.get() == 1:
-            # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
-            if order == 1:
-                Settling_time = 4.61*tc
-            elif order == 2:
-                Settling_time = 6.64*tc
-            elif order == 3:
-                Settling_time = 8.41*tc
-            elif order == 4:
-                Settling_time = 10.05*tc
-            time.sleep(Settling_time)
-        self.Zurich.info['daq'].subscribe(path)
-        data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-
-
-        try:
-            data = data_set[path]['x']
-#            print(data)
-#            print(len(data))
-        except:
-            pass
-        self.Zurich.info['daq'].unsubscribe(path)
-        return  data
+        # The demodulator stays subscribed during the scan, the settling is
+        # counted from the end of the monochromator move
+        return Scan_Steps.lockin_acquire(self.Zurich, settle=self.wait_var.get() == 1)
     
     def stop_experiment(self):
         self.running = False
@@ -5751,32 +5695,36 @@ class Horiba_spectrum:
         EOS_graph.update_graph()
         self.graph_dict['Spectrum'].update_graph()
             # Main scanning and measurements
-        for i in range(nsteps+1):
-            # Move stage to required position
-            self.mono.set_position(move[i])
-            # Measure real position
-            pos[i] = move[i]
-            # Measure signal
-            self.L[i] = pos[i]
-            self.S[i] = np.mean(self.Zurich_acquire())*1000
+        try:
+            for i in range(nsteps+1):
+                # Move stage to required position
+                self.mono.set_position(move[i])
+                # Measure real position
+                pos[i] = move[i]
+                # Measure signal
+                self.L[i] = pos[i]
+                self.S[i] = np.mean(self.Zurich_acquire())*1000
             
-            # Actualise progress bar
-            if progress:
-                progress['value'] = (i)/(nsteps)
-                progress.update()
-            # Actualise graph if required
-            if (time.time() - last_gu) > update_time:
-                scan_graph.Line.set_xdata(iteration[:i])
-                scan_graph.Line.set_ydata(pos[:i])
-                scan_graph.update_graph()
-                EOS_graph.Line.set_xdata(self.L[:i])
-                EOS_graph.Line.set_ydata(self.S[:i])
-                EOS_graph.axes.set_ylim([np.min(self.S),np.max(self.S)])
-                EOS_graph.update_graph()
+                # Actualise progress bar
+                if progress:
+                    progress['value'] = (i)/(nsteps)
+                    progress.update()
+                # Actualise graph if required
+                if (time.time() - last_gu) > update_time:
+                    scan_graph.Line.set_xdata(iteration[:i])
+                    scan_graph.Line.set_ydata(pos[:i])
+                    scan_graph.update_graph()
+                    EOS_graph.Line.set_xdata(self.L[:i])
+                    EOS_graph.Line.set_ydata(self.S[:i])
+                    EOS_graph.axes.set_ylim([np.min(self.S),np.max(self.S)])
+                    EOS_graph.update_graph()
                 
-                last_gu = time.time()
-            if not self.running:
-                break
+                    last_gu = time.time()
+                if not self.running:
+                    break
+        finally:
+            # Releasing the demodulator subscription used during the scan
+            self.Zurich.stop_stream(0)
         if not self.running:
             self.mono.set_position(self.pos_var.get())
         else:
@@ -6348,6 +6296,7 @@ class D_Scan:
         delay = self.window_array                                     # Here delay is actually insertion
         trace = self.trace.copy()
         
+        import femtoQ.pulse_retrieval as fqpr
         pulseRetrieved, pulseFrequencies = fqpr.shgDscan(filename='', inputDelays = delay, inputWavelengths = wavelengths, inputTrace = trace, makeFigures = False)
         
         
@@ -6745,6 +6694,7 @@ class PUMA:
         delay = self.window_array    # Here delay is actually insertion
         trace = self.trace.copy()
         
+        import femtoQ.pulse_retrieval as fqpr
         pulseRetrieved, pulseFrequencies = fqpr.shgDscan(filename='', inputDelays = delay, inputWavelengths = wavelengths, inputTrace = trace, makeFigures = False)
         
         
@@ -7206,40 +7156,14 @@ class BSVTunnel:
         return
     
     def Zurich_acquire(self):
-        import time
-        path = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/sample'
-        path2 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/timeconstant'
-        path3 = '/' + '{}'.format(self.Zurich.info['device'])+'/demods/0/order'
-        tc= self.Zurich.info['daq'].getDouble(path2)
-        # print
-        order= self.Zurich.info['daq'].getDouble(path3)
-        if self.wait_var.get() == 1:
-            # Times for 99% settling. Source : https://www.zhinst.com/americas/resources/principles-lock-detection
-            if order == 1:
-                Settling_time = 4.61*tc
-            elif order == 2:
-                Settling_time = 6.64*tc
-            elif order == 3:
-                Settling_time = 8.41*tc
-            elif order == 4:
-                Settling_time = 10.05*tc
-            time.sleep(Settling_time)
-        self.Zurich.info['daq'].subscribe(path)
-        data_set = self.Zurich.info['daq'].poll(0.01,100,0,True)
-
-
-        try:
-            data = data_set[path]['x']
-            # print(data)
-            # print(len(data))
-        except:
-            pass
-        self.Zurich.info['daq'].unsubscribe(path)
-        return  data
+        # The demodulator stays subscribed during the scan, only the samples
+        # of the averaging window are taken from the stream
+        return Scan_Steps.lockin_acquire(self.Zurich, self.PI, settle=self.wait_var.get() == 1)
 
 
 
     def zurich_Boxcar(device_id, do_plot=False):
+        import zhinst.utils
         apilevel_example = 6  # The API level supported by this example.
         err_msg = "This example can only be ran on UHF Instruments with the BOX option enabled."
         # Call a zhinst utility function that returns:
@@ -7506,7 +7430,7 @@ class BSVTunnel:
         scan_graph.update_graph()
         EOS_graph = self.graph_dict['Signal']
         EOS_graph.axes.set_ylim([-10,10])
-        EOS_graph.axes.set_xlim([0, (max_pos-min_pos)*2/1000/c*1e15])
+        EOS_graph.axes.set_xlim([0, self.PI.stage_calibration.to_delay(max_pos, zero=min_pos)])
         EOS_graph.Line.set_xdata([])
         EOS_graph.Line.set_ydata([])
         if self.plotRefSignal is True:
@@ -76,8 +76,7 @@ class MainFrame(tk.Tk):
 
     def closing_procedure(self):
         if self.Frame[1]:
-            # Do something to close the zurich
-            pass
+            self.Frame[1].Zurich.disconnect()
         if self.Frame[2].Linstage.device:
             self.Frame[2].Linstage.device.CloseConnection()
         if self.Frame[2].Mono.arduino:
@@ -934,13 +933,29 @@ class ZurichFrame(tk.Frame):
                     persi_var = tk.StringVar()
                     persi_var.set('disable')
                     persi = tk.Checkbutton(self, text='Persistance', onvalue='enable', offvalue='disable',
-                                           variable=persi_var)
+                                           variable=persi_var,
+                                           command=lambda: graph.class_.set_persistence(persi_var))
                     persi.grid(row=3, column=10, sticky='nsew')
                     bw_var = tk.StringVar()
                     bw_var.set('disable')
                     bw = tk.Checkbutton(self, text='BW Limit', onvalue='enable', offvalue='disable',
                                         variable=bw_var)
                     bw.grid(row=3, column=11, sticky='nsew')
+                    # Averaging of the displayed shots and segmented recording
+                    ave_label = tk.Label(self, text='Averages')
+                    ave_label.grid(row=4, column=10, sticky='nw')
+                    ave_var = tk.IntVar()
+                    ave_var.set(1)
+                    ave_entry = tk.Entry(self, width=8, textvariable=ave_var)
+                    ave_entry.grid(row=4, column=11, sticky='nsew')
+                    ave_entry.bind('<Return>', lambda e: graph.class_.set_averaging(ave_var))
+                    seg_label = tk.Label(self, text='Segments')
+                    seg_label.grid(row=5, column=10, sticky='nw')
+                    seg_var = tk.IntVar()
+                    seg_var.set(1)
+                    seg_entry = tk.Entry(self, width=8, textvariable=seg_var)
+                    seg_entry.grid(row=5, column=11, sticky='nsew')
+                    seg_entry.bind('<Return>', lambda e: graph.class_.set_segments(0, seg_var))
 
                     s4 = ttk.Separator(self, orient='vertical')
                     s4.grid(row=0, column=13, rowspan=4, sticky='nsew', padx=2)
@@ -1575,7 +1590,12 @@ class Mono_Physics(tk.Frame):
         go_var = tk.DoubleVar()
         go_e = tk.Entry(phs_control, width=8, textvariable=go_var)
         go_e.grid(row=2, column=7, sticky='nsew', padx=2, pady=2)
-        go_e.bind('<Return>', lambda e: self.Linstage.go_2position(go_var))
+        go_e.bind('<Return>', lambda e: self.track_move(self.Linstage.move_to_async(go_var), cur_var))
+        cur = tk.Label(phs_control, text='Current:')
+        cur.grid(row=5, column=6, sticky='nw')
+        cur_var = tk.StringVar()
+        cur_lbl = tk.Label(phs_control, textvariable=cur_var, width=8)
+        cur_lbl.grid(row=5, column=7, sticky='nsew', padx=2, pady=2)
         inc = tk.Label(phs_control, text='Increment:')
         inc.grid(row=3, column=6, sticky='nw')
         inc_var = tk.DoubleVar()
@@ -1594,6 +1614,24 @@ class Mono_Physics(tk.Frame):
             self.grid_columnconfigure(i, weight=1)
         self.grid_rowconfigure(0, weight=1)
 
+    def track_move(self, motion, variable, period=200):
+        """
+        Display the position of the stage while a move started with
+        move_to_async is running, the GUI stays responsive meanwhile.
+
+        Parameters:
+            motion: Future returned by move_to_async.
+            variable: tkinter StringVar displaying the position.
+            period: Time between two refresh in ms.
+        """
+        if not self.Linstage.device:
+            return
+        variable.set('{:.4f}'.format(self.Linstage.get_position()))
+        if not motion.done():
+            self.after(period, lambda: self.track_move(motion, variable, period))
+        elif motion.exception() is not None:
+            messagebox.showinfo(title='Error', message='The move failed : {}'.format(motion.exception()))
+
     def frame_switch(self, new, textbox):
         new = new.current()
         textbox.configure(state='normal')
@@ -1937,13 +1975,19 @@ class Experiment(ttk.LabelFrame):
         def frame_switch(list_, new):
             for frame in list_:
                 list_[frame].containing_frame.grid_forget()
-            list_[new].containing_frame.grid(column=0, row=0, sticky='nsew')
+            self.get_layout(new).containing_frame.grid(column=0, row=0, sticky='nsew')
 
         experiment_name = ttk.Combobox(self, textvariable='', state='readonly')
         experiment_name.grid(row=0, column=0, sticky='nsew')
         values = []
         self.parent = parent
+        # Layouts are only built the first time an experiment is selected,
+        # layout_specs keeps what is needed to build them and experiment_dict
+        # the ones already built.
+        self.layout_specs = {}
         self.experiment_dict = {}
+        # Number of state changes of every tool, replayed on new layouts
+        self.tool_updates = {}
 
         experiment_name.bind('<<ComboboxSelected>>', lambda e: frame_switch(self.experiment_dict, experiment_name.get()))
 
@@ -1953,9 +1997,8 @@ class Experiment(ttk.LabelFrame):
             if type(name) == str:
                 values.append(name)
                 experiment_name['value'] = tuple(values)
-                self.experiment_dict[name] = Experiment_file.CreateLayout(mainf=self.mainf, window=self,
-                                                                          tools_names=option, graph_names=graph,
-                                                                          function_class=function_)
+                self.layout_specs[name] = {'function_class': function_, 'tools_names': option,
+                                           'graph_names': graph}
 
         self.config(labelwidget=experiment_name, width=100, height=100)
         ##########
@@ -2042,6 +2085,35 @@ class Experiment(ttk.LabelFrame):
                 self.grid_columnconfigure(i, weight=1)
                 self.grid_rowconfigure(j, weight=1)
 
+    def get_layout(self, name):
+        """
+        Return the layout of the experiment name, creating it with its
+        graphics the first time it is requested.
+
+        Parameters:
+            name : Name of the experiment as displayed in the combobox.
+        """
+        if name not in self.experiment_dict:
+            layout = Experiment_file.CreateLayout(mainf=self.mainf, window=self, **self.layout_specs[name])
+            # Bringing the new layout to the current state of the devices
+            for tool, updates in self.tool_updates.items():
+                if updates % 2 and tool in layout.state_dict:
+                    layout.update_options(tool)
+            self.experiment_dict[name] = layout
+        return self.experiment_dict[name]
+
+    def update_options(self, tool):
+        """
+        Change the state of a device in every experiment, the layouts that
+        are not created yet will get it when they are created.
+
+        Parameters:
+            tool : Name of the tool as used in CreateLayout.update_options.
+        """
+        self.tool_updates[tool] = self.tool_updates.get(tool, 0) + 1
+        for experiment in self.experiment_dict:
+            self.experiment_dict[experiment].update_options(tool)
+
 if __name__ == '__main__':
     app = MainFrame()
     app.mainloop()
@@ -54,9 +54,7 @@ class MonoChrom:
         if self.arduino:
             messagebox.showinfo(title='Error', message='The monochromator is connected')
         if exp_dependencie:
-            experiments = self.mainf.Frame[4].experiment_dict
-            for experiment in experiments:
-                experiments[experiment].update_options('Monochrom')
+            self.mainf.Frame[4].update_options('Monochrom')
 
     def roll_dial(self, Nbr_nm):
         print(Nbr_nm)
@@ -43,9 +43,7 @@ class MonoChrom:
     def connect(self, exp_dependencies: bool = False):
         self.arduino.connecter()
         if exp_dependencies:
-            experiments = self.mainf.Frame[4].experiment_dict
-            for experiment in experiments:
-                experiments[experiment].update_options("Monochrom")
+            self.mainf.Frame[4].update_options("Monochrom")
 
     def déconnecter(self):
         self.roll_dial(self.longueur_de_calibration)
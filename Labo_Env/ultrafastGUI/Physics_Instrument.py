@@ -1,6 +1,9 @@
 "Python Pipython wrapper for the GUI interface"
 from tkinter import messagebox
 from multiprocessing import Process
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from pathlib import Path
+import json
 import time
 import numpy as np
 import serial
@@ -8,6 +11,128 @@ import SMC100CC
 from math import floor
 
 
+# Speed of light in m/s
+C = 299792458
+# Length of the position units in m
+UNITS = {'mm': 1e-3, 'um': 1e-6, 'nm': 1e-9}
+# Folder of the calibration files, one <device name>.json per stage
+CALIBRATION_FOLDER = Path(__file__).resolve().parent / 'calibrations'
+# Calibrations used when the folder has no file for the device. The E-816
+# piezo takes [-250, 250] um positions, its [0, 100] range is scaled by the
+# 15.1608 effective maximum of the damaged piezo.
+DEFAULT_CALIBRATIONS = {
+    'E-816': {'units': 'um', 'passes': 2, 'zero': 0.0,
+              'command': [250/5*15.1608/100, 15.1608/500], 'range': [-250, 250]},
+}
+
+
+class StageCalibration:
+    """
+    Conversion between the positions of a stage, the commands of its
+    controller and the optical delay. Every method accepts numbers or numpy
+    arrays so whole scans are converted at once.
+
+    The calibration files are json dictionaries with the keys :
+        units : Units of the positions, 'mm', 'um' or 'nm'.
+        passes : Number of times the beam travels the displacement, 2 for a
+        retroreflector.
+        zero : Position of the zero delay.
+        command : Coefficients, lowest degree first, of the polynomial giving
+        the command sent to the controller from the position. It accounts
+        for the nonlinearity of the stage, [0, 1] when the controller works
+        in the units of the positions.
+        range : Positions between which the polynomial is inverted.
+
+    Attributes:
+        units/passes/zero/command/range : See above.
+    """
+    def __init__(self, units='mm', passes=2, zero=0.0, command=(0.0, 1.0), range=(-1e3, 1e3)):
+        self.units = units
+        self.passes = passes
+        self.zero = zero
+        self.command = np.polynomial.Polynomial(command)
+        self.range = tuple(range)
+        self._inverse = None
+
+    @classmethod
+    def load(cls, dev_name=None, path=None):
+        """
+        Return the calibration of a device, read from path or from the file
+        of the device in CALIBRATION_FOLDER, the default one otherwise.
+
+        Parameters:
+            dev_name : Name of the device, ie 'E-816'.
+            path : json file to read instead of the one of the device.
+        """
+        if path is None and dev_name:
+            path = CALIBRATION_FOLDER / '{}.json'.format(dev_name)
+            if not path.exists():
+                path = None
+        if path is not None:
+            with open(path) as file:
+                return cls(**json.load(file))
+        return cls(**DEFAULT_CALIBRATIONS.get(dev_name, {}))
+
+    def save(self, path):
+        """Write the calibration in a json file readable by load."""
+        with open(path, 'w') as file:
+            json.dump({'units': self.units, 'passes': self.passes, 'zero': self.zero,
+                       'command': self.command.coef.tolist(), 'range': list(self.range)},
+                      file, indent=2)
+
+    @staticmethod
+    def _output(value, like):
+        # Numbers give numbers, arrays give arrays
+        return float(value) if np.ndim(like) == 0 else value
+
+    def to_command(self, position):
+        """Return the controller command of the positions."""
+        return self._output(self.command(np.asarray(position, dtype=float)), position)
+
+    def from_command(self, command):
+        """Return the positions of the controller commands."""
+        values = np.asarray(command, dtype=float)
+        if self.command.degree() <= 1:
+            offset, slope = (list(self.command.coef) + [0.0])[:2]
+            position = (values - offset)/slope
+        else:
+            if self._inverse is None:
+                # The polynomial is monotonic on the range, it is inverted
+                # by interpolation on a fine grid
+                grid = np.linspace(self.range[0], self.range[1], 4097)
+                self._inverse = (self.command(grid), grid)
+            commands, grid = self._inverse
+            order = np.argsort(commands)
+            position = np.interp(values, commands[order], grid[order])
+        return self._output(position, command)
+
+    def to_delay(self, position, zero=None):
+        """
+        Return the delays in fs of the positions.
+
+        Parameters:
+            position : Position or array of positions.
+            zero : Position of the zero delay, the one of the calibration by
+            default.
+        """
+        zero = self.zero if zero is None else zero
+        delay = (np.asarray(position, dtype=float) - zero)*UNITS[self.units]*self.passes/C*1e15
+        return self._output(delay, position)
+
+    def to_position(self, delay, zero=None):
+        """
+        Return the positions of the delays in fs.
+
+        Parameters:
+            delay : Delay or array of delays in fs.
+            zero : Position of the zero delay, the one of the calibration by
+            default.
+        """
+        zero = self.zero if zero is None else zero
+        position = zero + np.asarray(delay, dtype=float)*1e-15*C/(self.passes*UNITS[self.units])
+        return self._output(position, delay)
+
+
 class LinearStage:
     """
     This class is used to wrap the pipython package from Physick Instrument to
@@ -26,6 +151,15 @@ class LinearStage:
         It need an update to allow many axis stages that would allow dual
         axis mouvement.
         dev_name : This is a string representing the Device.
+        on_target_time : time.perf_counter() value when the stage last
+        reported being on target, used to time the settling of the
+        measurements done after a move.
+        motion : Future of the last move started with move_to_async.
+        stage_calibration : StageCalibration of the device, converts the
+        positions to controller commands and delays.
+        mover : Single thread executing the moves one after the other.
+        simulation : Stage_Simulation.SimulationServer of the simulated
+        stage, None with a real device.
 
     """
 
@@ -44,6 +178,11 @@ class LinearStage:
         self.device = None
         self.axes = None
         self.dev_name = None
+        self.on_target_time = None
+        self.motion = None
+        self.mover = None
+        self.simulation = None
+        self.stage_calibration = StageCalibration()
 
     def connect_identification(self, dev_name=None, dev_ip=None, exp_dependencie=False):
         """
@@ -81,6 +220,11 @@ class LinearStage:
             pass
         # Looking if the devices has adapted function
         dev_list = ['C-891', 'C-863.11', 'E-816','C-863.12','SMC100']
+        if dev_name in ('SIM-PI', 'SIM-SMC100'):
+            self.connect_simulation(dev_name)
+            if self.mainf:
+                self.mainf.Frame[4].update_options('Physics_Linear_Stage')
+            return
         if dev_name not in dev_list:
             messagebox.showinfo(title='Error', message='This device is not in the device list please make sure it is' +
                                                        'compatible with the pipython software. If so add it to the list'
@@ -88,6 +232,7 @@ class LinearStage:
             return
         # Follow the right procedure assigned to a specific device
         if dev_name:
+            self.stage_calibration = StageCalibration.load(dev_name)
 
             if dev_name==dev_list[4]:
                 # Case controller is SMC100CC
@@ -153,12 +298,43 @@ class LinearStage:
 
         # Verifying if the device needs to be sent to experiment window
         if self.mainf:
-            experiments = self.mainf.Frame[4].experiment_dict
-            for experiment in experiments:
-                experiments[experiment].update_options('Physics_Linear_Stage')
+            self.mainf.Frame[4].update_options('Physics_Linear_Stage')
 
 
 
+    def connect_simulation(self, dev_name='SIM-PI', controller=None):
+        """
+        Connect a simulated stage served on a local socket by
+        Stage_Simulation, through the same communication code as the real
+        controllers.
+
+        Parameters:
+            dev_name: 'SIM-PI' for a GCS controller or 'SIM-SMC100'.
+            controller: SimulatedPIController or SimulatedSMC100 to serve,
+            ie with the latencies of a benchmark, a new one with the default
+            StageModel by default.
+        """
+        from Stage_Simulation import (SimulatedPIController, SimulatedSMC100,
+                                      SimulationServer)
+        if self.simulation is not None:
+            self.simulation.close()
+        if dev_name == 'SIM-SMC100':
+            self.simulation = SimulationServer(controller or SimulatedSMC100()).start()
+            self.dev_name = 'SMC100'
+            self.stage_calibration = StageCalibration.load(self.dev_name)
+            self.device = SMC100CC.SMC100(1, self.simulation.url)
+            self.initialize()
+        else:
+            from pipython import GCSDevice
+            from pipython.pidevice.interfaces.pisocket import PISocket
+            self.simulation = SimulationServer(controller or SimulatedPIController()).start()
+            self.dev_name = dev_name
+            self.stage_calibration = StageCalibration.load(self.dev_name)
+            self.device = GCSDevice(gateway=PISocket(self.simulation.host, self.simulation.port))
+            self.axes = self.device.axes[0]
+        if self.mainf:
+            messagebox.showinfo(title='Physics Instrument', message='Simulated device {} is connected.'.format(dev_name))
+
     def initialize(self):
         if self.dev_name=='SMC100':
             if (not self.device):
@@ -226,8 +402,10 @@ class LinearStage:
             pos = min_pos
             for step in range(nsteps):
                 pos += steps
-                self.device.MOV(self.axes, pos)
-                pitools.waitontarget(self.device)
+                # The controller error is queried once per step instead of after every command
+                with self.device.deferrederrcheck():
+                    self.device.MOV(self.axes, pos)
+                    pitools.waitontarget(self.device)
                 time.sleep(wtime/1000)
             if self.device.qPOS(self.axes) != max_pos:
                 self.device.MOV(self.axes, max_pos)
@@ -235,40 +413,199 @@ class LinearStage:
     def go_2position(self, position=None):
         """
         This function allows the user to move the stage that is connected to
-        you computer on the axis taken of self.axis.
+        you computer on the axis taken of self.axis. It returns when the
+        stage is on target.
 
         Parameters:
             position: This is the position you want to order your stage to
             go to.
         """
-        
-        if self.dev_name=='SMC100':
-            if (not self.device) or (position is None):
-                return
-            self.device.move_absolute_mm(position)
-        
+        if (not self.device) or (position is None):
+            return
+        self.move_to_async(position).result()
+
+    def move_to_async(self, position=None):
+        """
+        Start a move of the stage and return without waiting for it. The moves
+        are executed one after the other by a single thread so a scan can
+        acquire or process the previous point meanwhile.
+
+        Parameters:
+            position: Position to go to, a number or a tkinter variable.
+
+        Returns:
+            concurrent.futures.Future done when the stage is on target. Its
+            exception is the one raised by the controller, if any.
+        """
+        if (not self.device) or (position is None):
+            done = Future()
+            done.set_result(None)
+            return done
+        try:
+            position = position.get()
+        except AttributeError:
+            pass
+        target = self.device_position(position)
+        if self.mover is None:
+            self.mover = ThreadPoolExecutor(max_workers=1, thread_name_prefix='LinearStage')
+        self.motion = self.mover.submit(self._move, target)
+        return self.motion
+
+    def _move(self, target):
+        # Executed by the mover thread
+        if self.dev_name == 'SMC100':
+            self.device.move_absolute_mm(target)
         else:
             import pipython.pitools as pitools
-    
-            if (not self.device) or (position is None):
-                return
-            import pipython.pitools as pitools
-    
-            try:
-                position = position.get()
-            except:
-                pass
-            if self.dev_name == 'E-816':
-                # Convert [-250,250] um input position to MOV() units for piezo
-                position = (position + 250)/5 # -> Convert to [0,100] range
-    
-                correctedMax = 15.1608
-    
-                position = position * correctedMax / 100 # -> Convert to effective values for damaged piezo
-    
-    
-            self.device.MOV(self.axes, position)
-            pitools.waitontarget(self.device)
+            self.device.MOV(self.axes, target)
+            # Sleeps during the predicted duration of the move, then polls
+            # qONT quickly instead of every 100 ms
+            pitools.waitontargetpredicted(self.device, self.axes)
+        self.on_target_time = time.perf_counter()
+
+    def device_position(self, position):
+        """
+        Convert positions of the GUI in the units of the controller with the
+        calibration of the stage.
+
+        Parameters:
+            position: Position or array of positions, in mm or in um in
+            [-250, 250] for the E-816.
+        """
+        return self.stage_calibration.to_command(position)
+
+    def stepped_scan(self, positions, dwell, acquire=None, settle=0.01, integration=0.0, line=1,
+                     wavegen=1, table=1, max_points=8192, bunchsize=50):
+        """
+        Scan the positions with the wave generator of a PI controller. The
+        whole staircase is uploaded as a wave table, the controller holds
+        every position dwell seconds and pulses the trigger output line
+        settle seconds after the start of each plateau, once the stage is on
+        target, so the steps are timed by the controller without any round
+        trip with the computer.
+
+        Parameters:
+            positions: Positions of the scan in the units of go_2position.
+            dwell: Time spent on each position in seconds, it must be longer
+            than settle plus integration.
+            acquire: Function called with the index of every plateau once the
+            wave generator runs, ie to read the spectrum triggered by the
+            pulse. The values it returns are returned.
+            settle: Time in seconds between the output of a new target and
+            the trigger pulse, for the stage to settle on it.
+            integration: Duration in seconds of the acquisition triggered.
+            line: Digital output line wired to the trigger of the detector.
+            wavegen/table: Wave generator and wave table used.
+            max_points: Number of points of a wave table of the controller.
+            bunchsize: Number of points sent per WAV command.
+
+        Returns:
+            Tuple of the list of the values returned by acquire and the array
+            of the positions measured on every plateau, read when acquire
+            returned. The positions are empty without acquire and both are
+            empty when the scan could not be done.
+        """
+        if not self.device or self.dev_name == 'SMC100' or not self.device.HasWAV_PNT():
+            messagebox.showinfo(title='Error', message='Stepped scans need a PI controller with a wave generator')
+            return [], np.zeros(0)
+        import pipython.pitools as pitools
+        from pipython import GCSError
+        targets = [self.device_position(position) for position in positions]
+        try:
+            # Servo update time
+            cycle = float(self.device.qSPA(self.axes, 0x0E000200)[self.axes][0x0E000200])
+        except GCSError:
+            cycle = 5e-5
+        # Each wave point lasts rate servo cycles, the table must fit in the
+        # memory of the controller
+        rate = max(1, int(np.ceil(dwell*len(targets)/(cycle*max_points))))
+        plateau = max(1, int(round(dwell/(cycle*rate))))
+        # The pulse is sent once the stage settled, the acquisition must end
+        # before the next target is output
+        settle_points = int(np.ceil(settle/(cycle*rate)))
+        integration_points = int(np.ceil(integration/(cycle*rate)))
+        if settle_points + integration_points >= plateau:
+            messagebox.showinfo(title='Error', message='The dwell time must be longer than the settling time ' +
+                                                       'plus the integration time')
+            return [], np.zeros(0)
+        wave = np.repeat(targets, plateau).tolist()
+
+        self.go_2position(positions[0])
+        pitools.writewavepoints(self.device, table, wave, bunchsize)
+        self.device.WTR(wavegen, rate, 0)
+        self.device.WSL(wavegen, table)
+        self.device.WGC(wavegen, 1)
+        self.device.WOS(wavegen, 0)
+        # Generator trigger mode, one pulse per plateau once the stage settled
+        self.device.TWC()
+        self.device.TWS([line]*len(targets), [k*plateau + settle_points + 1 for k in range(len(targets))],
+                        [1]*len(targets))
+        self.device.CTO(line, 3, 4)
+        self.device.WGO(wavegen, 1)
+        results = []
+        measured = []
+        try:
+            if acquire:
+                for i in range(len(targets)):
+                    results.append(acquire(i))
+                    # The stage is still on the plateau of the acquisition
+                    measured.append(self.get_position())
+            pitools.waitonwavegen(self.device, wavegen, timeout=60 + 2*dwell*len(targets),
+                                  polldelay=min(0.1, dwell))
+        finally:
+            self.device.WGO(wavegen, 0)
+        self.on_target_time = time.perf_counter()
+        return results, np.array(measured)
+
+    def motion_trigger(self, line=1, enable=True):
+        """
+        Configure the trigger output line of a PI controller to be high while
+        the axis is in motion, so a detector wired to it starts recording
+        when a move starts.
+
+        Parameters:
+            line: Digital output line wired to the trigger of the detector.
+            enable: False to switch the trigger output off.
+        """
+        if not self.device or self.dev_name in ('SMC100', 'E-816'):
+            raise ValueError('The trigger output needs a PI controller with a motion trigger')
+        if enable:
+            # Trigger mode 6 "In Motion" on the axis of the stage
+            self.device.CTO(line, 2, self.axes)
+            self.device.CTO(line, 3, 6)
+        self.device.TRO(line, enable)
+
+    def is_moving(self):
+        """
+        Return True while a move started with move_to_async is not done, or
+        when the controller reports the axis as moving.
+        """
+        if self.motion is not None and not self.motion.done():
+            return True
+        if not self.device:
+            return False
+        if self.dev_name == 'SMC100':
+            return self.device.get_status()[1] in (SMC100CC.STATE_MOVING, SMC100CC.STATE_HOMING)
+        return not all(self.device.qONT(self.axes).values())
+
+    def wait(self, timeout=None):
+        """
+        Wait for the last move started to be done.
+
+        Parameters:
+            timeout: Maximum time to wait in seconds, None to wait until the
+            end of the move.
+
+        Returns:
+            True if the stage is on target, False if the timeout expired.
+        """
+        if self.motion is None:
+            return True
+        try:
+            self.motion.result(timeout)
+        except TimeoutError:
+            return False
+        return True
 
     def get_position(self):
         """
@@ -283,17 +620,9 @@ class LinearStage:
             position = self.device.qPOS(self.axes)[self.axes]
             if (not self.device) or (position is None):
                 return
-    
-    
-            if self.dev_name == 'E-816':
-                # Convert qPOS() values to [-250,250] um range for piezo
-    
-                correctedMax = 15.1608
-    
-                position = position * 100 / correctedMax # -> Convert to [0,100] range
-    
-    
-                position = position*5 - 250 # -> Convert to [-250,250] range
+
+        # Units of the GUI, ie [-250,250] um range for the E-816 piezo
+        position = self.stage_calibration.from_command(position)
 
         return position
 
@@ -333,8 +662,8 @@ class LinearStage:
                 pass
             position2 += increment
             position.set(position2)
-            self.device.MOV(self.axes, position2)
-            pitools.waitontarget(self.device)
+            self.device.MOV(self.axes, self.device_position(position2))
+            pitools.waitontargetpredicted(self.device, self.axes)
 
 
     def change_speed(self, factor=None):
@@ -353,6 +682,9 @@ class LinearStage:
         # 0 (the minimum) = 250
         # 1 : 500 ...
         self.device.VEL(self.axes, factor*10)
+        if self.dev_name != 'SMC100':
+            import pipython.pitools as pitools
+            pitools.clearmotionprofile(self.device, self.axes)
 
     def set_velocity(self, vel=None):
         """
@@ -360,12 +692,17 @@ class LinearStage:
         with precision.
 
         Parameters:
-            vel: This is a tkinter DoubleVar that indicate the new speed of
-            the device.
+            vel: This is a tkinter DoubleVar (or a number) that indicate the
+            new speed of the device.
         """
-        if not self.device or not vel:
+        if not self.device or vel is None:
+            return
+        try:
+            vel = vel.get()
+        except AttributeError:
+            pass
+        if not vel:
             return
-        vel = vel.get()
 
         if self.dev_name =='SMC100':
             if vel<0 or vel>20:
@@ -375,7 +712,9 @@ class LinearStage:
         elif self.dev_name == 'E-816':
             pass
         else:
+            import pipython.pitools as pitools
             self.device.VEL(self.axes, vel)
+            pitools.clearmotionprofile(self.device, self.axes)
 
 
     def calibration(self, dev_name):
@@ -7,22 +7,45 @@ Created on Tue Jun 23 10:21:03 2020
 
 #!/usr/bin/env python
 import serial
+import threading
 import time
+from collections import deque
 
 from math import floor
 
 # never wait for more than this e.g. during wait_states
 MAX_WAIT_TIME_SEC = 600
 
+# minimum time between two TS? queries of wait_states
+POLL_PERIOD_SEC = 0.02
+
+# fraction of the predicted duration of a move slept by wait_states before
+# polling the state
+PREDICTION_EARLINESS = 0.9
+
+# commands after which the cached position and state are unknown
+MOTION_COMMANDS = ('PA', 'PR', 'OR', 'ST', 'RS', 'PW', 'ZX', 'MM', 'JR')
+
+# commands after which the cached velocity and acceleration are unknown
+CONFIGURATION_COMMANDS = ('RS', 'PW', 'ZX')
+
 # time to wait after sending a command. This number has been arrived at by
 # trial and error
 COMMAND_WAIT_TIME_SEC = 0.12
 
+# Bytes allowed in a reply, the line terminator excluded
+VALID_REPLY_BYTES = bytes(range(33, 127))
+
 # States from page 65 of the manual
 STATE_NOT_REFERENCED_FROM_RESET = '0A'
 STATE_NOT_REFERENCED_FROM_CONFIGURATION = '0C'
 STATE_READY_FROM_HOMING = '32'
 STATE_READY_FROM_MOVING = '33'
+STATE_READY_FROM_DISABLE = '34'
+READY_STATES = (STATE_READY_FROM_HOMING, STATE_READY_FROM_MOVING, STATE_READY_FROM_DISABLE)
+
+STATE_HOMING = '1E'
+STATE_MOVING = '28'
 
 STATE_CONFIGURATION = '14'
 
@@ -51,6 +74,166 @@ class SMC100InvalidResponseException(Exception):
     s = 'Invalid response to %s: %s'%(cmd, resp)
     super(SMC100InvalidResponseException, self).__init__(s)
 
+class SMC100Port(object):
+  """
+  Serial link shared by the SMC100 controllers of a RS-232 daisy chain.
+  Commands of the different controllers are written one line at a time and
+  the replies are sorted by the address that prefixes them, so the
+  controllers can be driven from different threads, ie to move two stages
+  together.
+  A link is opened once per port with open() and closed when the last
+  controller using it calls release().
+  """
+
+  _links = {}
+  _links_lock = threading.Lock()
+
+  @classmethod
+  def open(cls, port):
+    """
+    Returns the link of port, opened by the first call.
+    """
+    with cls._links_lock:
+      link = cls._links.get(port)
+      if link is None:
+        link = cls._links[port] = cls(port)
+      link.users += 1
+      return link
+
+  def __init__(self, port):
+    self.port = port
+    self.users = 0
+
+    # serial_for_url also opens urls like socket://localhost:5000, ie the
+    # SimulationServer of Stage_Simulation
+    self.serial = serial.serial_for_url(
+        port,
+        baudrate = 57600,
+        bytesize = 8,
+        stopbits = 1,
+        parity = 'N',
+        xonxoff = True,
+        timeout = 0.50)
+
+    self._write_lock = threading.Lock()
+    # Only one thread reads the port at a time, it files the lines of the
+    # other controllers in _replies
+    self._read_lock = threading.Lock()
+    # Bytes received but not sorted yet
+    self._rxbuf = bytearray()
+    # {address: deque of the lines received and not read yet}
+    self._replies = {}
+
+  @property
+  def timeout(self):
+    return self.serial.timeout
+
+  def release(self):
+    """
+    Closes the port once no controller uses it anymore.
+    """
+    with SMC100Port._links_lock:
+      self.users -= 1
+      if self.users <= 0:
+        if SMC100Port._links.get(self.port) is self:
+          del SMC100Port._links[self.port]
+        self.serial.close()
+
+  def write(self, data):
+    """
+    Writes data, a whole command line, without mixing it with the commands
+    of the other threads.
+    """
+    with self._write_lock:
+      self.serial.write(data)
+
+  def _queue(self, address):
+    return self._replies.setdefault(address, deque())
+
+  def _sort(self, line):
+    # Files the line under the address that prefixes it
+    digits = len(line) - len(line.lstrip(b'0123456789'))
+    self._queue(line[:digits].decode('ascii')).append(line)
+
+  def read_until(self, terminator=b'\n', timeout=None):
+    """
+    Returns the bytes received up to terminator, which is removed from the
+    buffer but not returned. The bytes already waiting in the port are read
+    in a single call, and the ones following the terminator are kept for the
+    next call. The caller must hold the read lock.
+    If nothing is received for timeout seconds, the timeout of the port by
+    default, SMC100ReadTimeOutException is raised and the bytes received are
+    kept.
+    """
+    if timeout is None:
+      timeout = self.serial.timeout
+    deadline = None if timeout is None else time.time() + timeout
+    start = 0
+    while True:
+      end = self._rxbuf.find(terminator, start)
+      if end >= 0:
+        data = bytes(self._rxbuf[:end])
+        del self._rxbuf[:end + len(terminator)]
+        return data
+      # Only the new bytes can complete the terminator
+      start = max(0, len(self._rxbuf) - len(terminator) + 1)
+      if deadline is not None and time.time() > deadline:
+        raise SMC100ReadTimeOutException()
+      # Blocks for the first byte at most the timeout of the port, then
+      # takes all the bytes waiting
+      received = self.serial.read(max(1, self.serial.in_waiting))
+      if received:
+        self._rxbuf += received
+        if deadline is not None:
+          deadline = time.time() + timeout
+      elif deadline is None:
+        raise SMC100ReadTimeOutException()
+
+  def readline(self, address, timeout=None):
+    """
+    Returns the next line received from the controller at address, without
+    the line terminator. The lines of the other controllers read meanwhile
+    are kept for them.
+    Raises SMC100ReadTimeOutException if no line of address is received
+    within timeout seconds, the timeout of the port by default.
+    """
+    if timeout is None:
+      timeout = self.serial.timeout
+    replies = self._queue(address)
+    deadline = time.time() + timeout
+    while True:
+      if replies:
+        return replies.popleft()
+      remaining = deadline - time.time()
+      if remaining <= 0 or not self._read_lock.acquire(timeout=remaining):
+        raise SMC100ReadTimeOutException()
+      try:
+        # Another thread may have filed our line while we waited for the lock
+        if not replies:
+          self._sort(self.read_until(b'\n', max(deadline - time.time(), 0)).rstrip(b'\r'))
+      finally:
+        self._read_lock.release()
+
+  def discard(self, address):
+    """
+    Drops the lines of address not read yet, ie the late reply of a command
+    that timed out, and returns them. The bytes waiting in the port are sorted
+    first when no other thread is reading.
+    """
+    if self._read_lock.acquire(False):
+      try:
+        if self.serial.in_waiting:
+          self._rxbuf += self.serial.read(self.serial.in_waiting)
+        while b'\n' in self._rxbuf:
+          self._sort(self.read_until(b'\n').rstrip(b'\r'))
+      finally:
+        self._read_lock.release()
+    replies = self._queue(address)
+    dropped = []
+    while replies:
+      dropped.append(replies.popleft())
+    return dropped
+
 class SMC100(object):
   """
   Class to interface with Newport's SMC100 controller.
@@ -89,6 +272,8 @@ class SMC100(object):
     If the controller has previously been configured, it will suffice to simply
     call home() to take the controller out of not referenced mode. For a brand
     new controller, call reset_and_configure().
+    The controllers of a daisy chain share the port, ie SMC100(2, 'COM4')
+    after SMC100(1, 'COM4') uses the same SMC100Port.
     """
 
     super(SMC100, self).__init__()
@@ -103,16 +288,25 @@ class SMC100(object):
 
     self._last_sendcmd_time = 0
 
+    # Last known state of the controller, None when unknown:
+    #   velocity/acceleration : last commanded or read values,
+    #   state : last state read with TS?,
+    #   position : position read while the stage was in a ready state.
+    # The motion commands sent by sendcmd forget the position and the state,
+    # the configuration commands forget everything.
+    self.cache = dict.fromkeys(('velocity', 'acceleration', 'state', 'position'))
+
+    # Predicted and measured durations in seconds of the last move
+    self.last_move_prediction = None
+    self.last_move_time = None
+
+    # A command and its reply are exchanged under the lock, so the position
+    # can be read while another thread waits for the end of a move
+    self._lock = threading.RLock()
+
     #print('Connecting to SMC100 on %s'%(port))
 
-    self._port = serial.Serial(
-        port = port,
-        baudrate = 57600,
-        bytesize = 8,
-        stopbits = 1,
-        parity = 'N',
-        xonxoff = True,
-        timeout = 0.50)
+    self._port = SMC100Port.open(port)
 
     self._smcID = str(smcID)
 
@@ -181,17 +375,36 @@ class SMC100(object):
     Executes TS? and returns the the error code as integer and state as string
     as specified on pages 64 - 65 of the manual.
     """
-    self._sleepfunc(0.5)
+    return self._status()
+
+  def _status(self):
     resp = self.sendcmd('TS', '?', expect_response=True, retry=20)
     errors = int(resp[0:4], 16)
     state = resp[4:]
 
     assert len(state) == 2
+    self.cache['state'] = state
     return errors, state
 
-  def get_position_mm(self):
-    self._sleepfunc(0.5)
+  def is_idle(self):
+    """
+    Returns True when the last state read is a ready state and no motion
+    command has been sent since. Moves done from the front panel or by
+    another program are not seen.
+    """
+    return self.cache['state'] in READY_STATES
+
+  def get_position_mm(self, cached=True):
+    """
+    Returns the position in mm. While the stage is idle the position read
+    after the end of the last move is returned without querying TP, unless
+    cached is False.
+    """
+    if cached and self.is_idle() and self.cache['position'] is not None:
+      return self.cache['position']
     dist_mm = float(self.sendcmd('TP', '?', expect_response=True, retry=20))
+    if self.is_idle():
+      self.cache['position'] = dist_mm
     return dist_mm
 
   def get_position_um(self):
@@ -202,15 +415,14 @@ class SMC100(object):
     Moves the stage relatively to the current position by the given distance given in mm
     If waitStop is True then this method returns when the move is completed.
     """
-    self._sleepfunc(0.5)
+    expected = self.predict_move_time(dist_mm) if waitStop else None
     self.sendcmd('PR', dist_mm, expect_response=False)
     if waitStop:
       # If we were previously homed, then something like PR0 will have no
       # effect and we end up waiting forever for ready from moving because
       # we never left ready from homing. This is why STATE_READY_FROM_HOMING
       # is included.
-      self.wait_states((STATE_READY_FROM_MOVING, STATE_READY_FROM_HOMING))
-    self._sleepfunc(1)
+      self.wait_states((STATE_READY_FROM_MOVING, STATE_READY_FROM_HOMING), expected=expected)
 
 
 
@@ -228,15 +440,16 @@ class SMC100(object):
     Moves the stage to the given absolute position given in mm.
     If waitStop is True then this method returns when the move is completed.
     """
-    self._sleepfunc(0.5)
+    expected = None
+    if waitStop:
+      expected = self.predict_move_time(position_mm - self.get_position_mm())
     self.sendcmd('PA', position_mm, expect_response=False)
     if waitStop:
       # If we were previously homed, then something like PR0 will have no
       # effect and we end up waiting forever for ready from moving because
       # we never left ready from homing. This is why STATE_READY_FROM_HOMING
       # is included.
-      self.wait_states((STATE_READY_FROM_MOVING, STATE_READY_FROM_HOMING))
-    self._sleepfunc(1)
+      self.wait_states((STATE_READY_FROM_MOVING, STATE_READY_FROM_HOMING), expected=expected)
 
   def move_absolute_um(self, position_um, **kwargs):
     """
@@ -248,12 +461,58 @@ class SMC100(object):
     return self.move_absolute_mm(pos_mm, **kwargs)
 
   def set_speed(self, speed):
-    self._sleepfunc(0.5)
+    """
+    Sets the velocity in mm/s, nothing is sent if it is already the velocity
+    of the controller.
+    """
+    if self.cache['velocity'] == float(speed):
+      return
     self.sendcmd('VA', speed, expect_response=False)
+    self.cache['velocity'] = float(speed)
     return
 
+  def set_acceleration(self, acceleration):
+    """
+    Sets the acceleration in mm/s^2, nothing is sent if it is already the
+    acceleration of the controller.
+    """
+    if self.cache['acceleration'] == float(acceleration):
+      return
+    self.sendcmd('AC', acceleration, expect_response=False)
+    self.cache['acceleration'] = float(acceleration)
+
+  def motion_profile(self):
+    """
+    Returns the (velocity, acceleration) of the stage in mm/s and mm/s^2.
+    They are read with VA? and AC? only when they are not in the cache.
+    """
+    if self.cache['velocity'] is None:
+      self.cache['velocity'] = float(self.sendcmd('VA', '?', retry=20))
+    if self.cache['acceleration'] is None:
+      self.cache['acceleration'] = float(self.sendcmd('AC', '?', retry=20))
+    return self.cache['velocity'], self.cache['acceleration']
 
-  def wait_states(self, targetstates, ignore_disabled_states=False):
+  def predict_move_time(self, dist_mm):
+    """
+    Returns the time in seconds needed to move by dist_mm with the
+    trapezoidal velocity profile of the controller, the acceleration and the
+    deceleration being equal. None if the profile cannot be read.
+    """
+    try:
+      velocity, acceleration = self.motion_profile()
+    except (SMC100ReadTimeOutException, SMC100InvalidResponseException, ValueError):
+      return None
+    dist_mm = abs(dist_mm)
+    if velocity <= 0 or acceleration <= 0:
+      return None
+    if dist_mm < velocity**2/acceleration:
+      # The velocity is not reached, triangular profile
+      return 2*(dist_mm/acceleration)**0.5
+    return dist_mm/velocity + velocity/acceleration
+
+
+  def wait_states(self, targetstates, ignore_disabled_states=False, expected=None,
+                  poll_period=POLL_PERIOD_SEC):
     """
     Waits for the controller to enter one of the the specified target state.
     Controller state is determined via the TS command.
@@ -268,21 +527,35 @@ class SMC100(object):
     UNLESS you were waiting for that state. This is because if we wait for
     READY_FROM_MOVING, and the stage gets stuck we transition into
     DISABLE_FROM_MOVING and then STAY THERE FOREVER.
+    If expected is the predicted duration of a move in seconds, most of it is
+    slept before the first query. The state is queried at most once every
+    poll_period seconds, the time spent waiting is kept in last_move_time
+    and the prediction in last_move_prediction.
     The state encountered is returned.
     """
     starttime = time.time()
     done = False
     self._emit('waiting for states %s'%(str(targetstates)))
+    self.last_move_prediction = expected
+    if expected:
+      self._sleepfunc(PREDICTION_EARLINESS*expected)
+    nextpoll = time.time()
     while not done:
       waittime = time.time() - starttime
       if waittime > MAX_WAIT_TIME_SEC:
         raise SMC100WaitTimedOutException()
 
+      self._sleepfunc(max(0, nextpoll - time.time()))
+      nextpoll = time.time() + poll_period
       try:
-        errors, state = self.get_status()
+        errors, state = self._status()
         state=str(state)
         if state in targetstates:
-          self._emit('in state %s'%(state))
+          self.last_move_time = time.time() - starttime
+          if expected:
+            self._emit('in state %s after %.3f s, %.3f s predicted'%(state, self.last_move_time, expected))
+          else:
+            self._emit('in state %s'%(state))
           return state
         elif not ignore_disabled_states:
           disabledstates = [
@@ -319,89 +592,73 @@ class SMC100(object):
     if self._port is None:
       return
 
-    if argument is None:
-      argument = ''
-
-    prefix = self._smcID + command
-    tosend = prefix + str(argument)
-
-    # prevent certain commands from being retried automatically
-    no_retry_commands = ['PR', 'OR','RS']
-    if command in no_retry_commands:
-      retry = False
-
-    while self._port is not None:
-      if expect_response:
-        self._port.flushInput()
-
-      self._port.flushOutput()
-
-      self._port.write(str.encode(tosend))
-      self._port.write(b'\r\n')
-
-      self._port.flush()
-
-      if not self._silent:
-        self._emit('sent', tosend)
-
-      if expect_response:
-        try:
-          response = self._readline()
-          if response.startswith(prefix):
-            return response[len(prefix):]
-          else:
-            raise SMC100InvalidResponseException(command, response)
-        except Exception as ex:
-          if not retry or retry <=0:
-            raise ex
-          else:
-            if type(retry) == int:
-              retry -= 1
-            continue
-      else:
-        # we only need to delay when we are not waiting for a response
-        now = time.time()
-        dt = now - self._last_sendcmd_time
-        dt = COMMAND_WAIT_TIME_SEC - dt
-        if dt > 0:
-          self._sleepfunc(dt)
+    with self._lock:
+      if argument is None:
+        argument = ''
+
+      prefix = self._smcID + command
+      tosend = prefix + str(argument)
+
+      if command in MOTION_COMMANDS:
+        self.cache['state'] = self.cache['position'] = None
+      if command in CONFIGURATION_COMMANDS:
+        self.cache['velocity'] = self.cache['acceleration'] = None
+
+      # prevent certain commands from being retried automatically
+      no_retry_commands = ['PR', 'OR','RS']
+      if command in no_retry_commands:
+        retry = False
+
+      while self._port is not None:
+        # Nothing is pending between two exchanges, lines left over are the
+        # late reply of a command that timed out and are discarded. The
+        # output is never flushed, it only holds the commands not sent yet.
+        if expect_response:
+          for line in self._port.discard(self._smcID):
+            self._emit('discarding', repr(line))
+
+        self._port.write(str.encode(tosend) + b'\r\n')
+
+        if not self._silent:
+          self._emit('sent', tosend)
+
+        if expect_response:
+          try:
+            response = self._readline()
+            if response.startswith(prefix):
+              return response[len(prefix):]
+            else:
+              raise SMC100InvalidResponseException(command, response)
+          except Exception as ex:
+            if not retry or retry <=0:
+              raise ex
+            else:
+              if type(retry) == int:
+                retry -= 1
+              continue
+        else:
+          # we only need to delay when we are not waiting for a response
+          now = time.time()
+          dt = now - self._last_sendcmd_time
+          dt = COMMAND_WAIT_TIME_SEC - dt
+          if dt > 0:
+            self._sleepfunc(dt)
         
-        self._last_sendcmd_time = now
-        return None
+          self._last_sendcmd_time = now
+          return None
 
   def _readline(self):
     """
     Returns a line, that is reads until \r\n.
-    OK, so you are probably wondering why I wrote this. Why not just use
-    self._port.readline()?
-    I am glad you asked.
-    With python < 2.6, pySerial uses serial.FileLike, that provides a readline
-    that accepts the max number of chars to read, and the end of line
-    character.
-    With python >= 2.6, pySerial uses io.RawIOBase, whose readline only
-    accepts the max number of chars to read. io.RawIOBase does support the
-    idea of a end of line character, but it is an attribute on the instance,
-    which makes sense... except pySerial doesn't pass the newline= keyword
-    argument along to the underlying class, and so you can't actually change
-    it.
+    The reply of this controller is taken from the shared port and then
+    checked at once: the controller only sends printable ASCII characters,
+    anything else means the RS232 link is corrupted.
     """
-    done = False
-    line = str()
-    while done == False:
-      c = self._port.read()
-      #print('c=',c)
-      #print('decoded c=',c.decode('utf-8'))
-      # ignore \r since it is part of the line terminator
-      if len(c) == 0:
-        raise SMC100ReadTimeOutException()
-      elif c == b'\r':
-        continue
-      elif c == b'\n':
-        done = True
-      elif ord(c) > 32 and ord(c) < 127:
-        line += str(c.decode('utf-8'))
-      else:
-        raise SMC100RS232CorruptionException(c)
+    line = self._port.readline(self._smcID)
+    corrupted = line.translate(None, VALID_REPLY_BYTES)
+    if corrupted:
+      raise SMC100RS232CorruptionException(corrupted[:1])
+    line = line.decode('ascii')
 
     self._emit('read', line)
 
@@ -420,7 +677,7 @@ class SMC100(object):
 
   def close(self):
     if self._port:
-      self._port.close()
+      self._port.release()
       self._port = None
 
   def __del__(self):
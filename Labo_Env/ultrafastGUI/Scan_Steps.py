@@ -0,0 +1,168 @@
+"""
+Steps of the scans of Experiment_file, without the tkinter widgets and the
+graphics. The experiments call them at every point of their scans and the
+benchmark recipes call the same functions, with a benchmark.runner.PhaseTimer
+instead of NO_TIMER, to measure the time spent in each phase of a step:
+
+    move : go_2position of the stage.
+    position : get_position of the stage.
+    acquire : Spectra or lock-in samples.
+    process : Processing of the data of the step.
+    io : Writing of the data files.
+
+The stage is a Physics_Instrument.LinearStage, the spectrometer a
+Spectrometer.Spectro and the lock-in a Zurich_Instrument.Zurich.
+"""
+import time
+from contextlib import contextmanager
+import numpy as np
+
+trapz = getattr(np, 'trapezoid', None) or np.trapz
+
+
+class NoTimer:
+    """Timer of the experiments, the phases are not measured."""
+    @contextmanager
+    def phase(self, name):
+        yield
+
+
+NO_TIMER = NoTimer()
+
+
+def measure_position(stage, target, timer=NO_TIMER):
+    """
+    Move the stage to target and return the position measured once it is on
+    target.
+
+    Parameters:
+        stage : LinearStage of the scan.
+        target : Position to go to.
+        timer : Object with a phase(name) context manager.
+    """
+    with timer.phase('move'):
+        stage.go_2position(target)
+    with timer.phase('position'):
+        return stage.get_position()
+
+
+def spectrum_step(stage, spectro, target, timer=NO_TIMER):
+    """
+    Step of FROG and TwoDSI, return the position measured, the wavelengths
+    and the spectrum acquired at target.
+
+    Parameters:
+        stage : LinearStage of the scan.
+        spectro : Spectro acquiring the spectrum.
+        target : Position to go to.
+        timer : Object with a phase(name) context manager.
+    """
+    position = measure_position(stage, target, timer)
+    with timer.phase('acquire'):
+        wl = spectro.spectro.wavelengths()
+        S = spectro.get_intensities()
+    return position, wl, S
+
+
+def crop_spectrum(wl, S, minwl, maxwl, timer=NO_TIMER):
+    """
+    Return the part of the spectrum S between minwl and maxwl and its
+    integral over the wavelengths.
+
+    Parameters:
+        wl : Wavelengths of the spectrum.
+        S : Spectrum.
+        minwl/maxwl : Limits of the part kept, excluded.
+        timer : Object with a phase(name) context manager.
+    """
+    with timer.phase('process'):
+        keep = (wl > minwl) & (wl < maxwl)
+        S_crop = S[keep]
+        return S_crop, trapz(S_crop, wl[keep])
+
+
+def spectra_step(stage, spectro, target, period, timer=NO_TIMER):
+    """
+    Step of PumpProbe, return the position measured and the spectra
+    acquired at target during period seconds. The zeros of the spectra are
+    replaced by 1 for the logarithm of the differential transmission.
+
+    Parameters:
+        stage : LinearStage of the scan.
+        spectro : Spectro acquiring the spectra.
+        target : Position to go to.
+        period : Acquisition time in seconds, at least one spectrum is taken.
+        timer : Object with a phase(name) context manager.
+    """
+    position = measure_position(stage, target, timer)
+    with timer.phase('acquire'):
+        spectra = []
+        start = time.time()
+        while not spectra or time.time() - start < period:
+            spectra.append(spectro.get_intensities())
+    with timer.phase('process'):
+        spectra = np.array(spectra)
+        spectra[spectra == 0] = 1
+    return position, spectra
+
+
+def save_spectra(spectro, shape, path, timer=NO_TIMER):
+    """
+    Step of batchSpectra, acquire shape[0] spectra and save them in the
+    numpy file path.
+
+    Parameters:
+        spectro : Spectro acquiring the spectra.
+        shape : (number of spectra, number of pixels) of the array saved.
+        path : File written with np.save.
+        timer : Object with a phase(name) context manager.
+    """
+    spectra = np.zeros(shape)
+    for jj in range(shape[0]):
+        with timer.phase('acquire'):
+            spectra[jj, :] = spectro.get_intensities()
+    with timer.phase('io'):
+        np.save(path, spectra)
+
+
+def lockin_acquire(zurich, stage=None, settle=False, duration=0.01, index=0, node='demods'):
+    """
+    Zurich_acquire of the lock-in experiments, return the x values of the
+    demodulator index, or the values of the boxcar index, measured during
+    duration seconds from its persistent stream.
+
+    Parameters:
+        zurich : Zurich lock-in.
+        stage : LinearStage of the scan, the settling is counted from the
+        time it reached its target. From now without stage.
+        settle : True to start the window once the filter settled (99%),
+        the samples measured meanwhile are dropped from the stream instead
+        of sleeping, so the settling overlaps the position readout.
+        duration : Length of the window in seconds.
+        index : Number of the demodulator or boxcar.
+        node : 'demods' or 'boxcars'.
+    """
+    start = None
+    if settle:
+        since = stage.on_target_time if stage is not None else None
+        start = zurich.settled_start(since, index)
+    return zurich.acquire(duration, index, start=start, node=node)
+
+
+def lockin_step(stage, acquire, target, timer=NO_TIMER):
+    """
+    Step of the lock-in scans (EOS, CHI3, FiberCaract), return the position
+    measured and the mean signal acquired at target in mV.
+
+    Parameters:
+        stage : LinearStage of the scan.
+        acquire : Function returning the demodulator samples in V, ie the
+        Zurich_acquire method of the experiment.
+        target : Position to go to.
+        timer : Object with a phase(name) context manager.
+    """
+    position = measure_position(stage, target, timer)
+    with timer.phase('acquire'):
+        data = acquire()
+    with timer.phase('process'):
+        return position, np.mean(data)*1000
@@ -105,14 +105,10 @@ class Spectro:
         messagebox.showinfo(title='Spectrometer', message='Spectrometer is connected.')
         # Update of the Experimental window
         if self.mainf:
-            experiments = self.mainf.Frame[4].experiment_dict
-            for experiment in experiments:
-                experiments[experiment].update_options('Spectrometer')
+            self.mainf.Frame[4].update_options('Spectrometer')
 
         if exp_dependencie:
-            experiments = self.mainf.Frame[4].experiment_dict
-            for experiment in experiments:
-                experiments[experiment].update_options('Spectrometer')
+            self.mainf.Frame[4].update_options('Spectrometer')
 
     def adjust_wavelength_range(self):
         """
@@ -0,0 +1,610 @@
+"""
+Local stand-in for the translation stages and their controllers.
+
+StageModel computes the motion of a stage from its velocity, acceleration and
+deceleration (trapezoidal velocity profile), with the settling time needed to
+be on target, the backlash of the mechanics and the noise of the position
+readout. SimulatedPIController answers the GCS 2.0 commands used by
+Physics_Instrument.LinearStage and pipython (MOV, POS?, ONT?, TMN?, TMX?,
+VEL, ...) and SimulatedSMC100 answers the ASCII protocol of the Newport
+SMC100. SimulationServer serves one of them on a local TCP socket, so the
+real communication code is used without the hardware:
+
+    server = SimulationServer(SimulatedPIController(StageModel())).start()
+    gcs = GCSDevice(gateway=PISocket(server.host, server.port))
+
+    server = SimulationServer(SimulatedSMC100(StageModel())).start()
+    smc = SMC100CC.SMC100(1, server.url)
+
+The stages can also be selected by connecting to the devices 'SIM-PI' and
+'SIM-SMC100' in the Physics_Instrument window.
+"""
+import socketserver
+import threading
+import time
+import numpy as np
+
+
+def _sleep(duration):
+    if duration > 0:
+        time.sleep(duration)
+
+
+class StageModel:
+    """
+    Motion of a single axis stage. The time is taken from time.perf_counter()
+    so the position follows the wall clock like the real stage, nothing runs
+    in the background.
+
+    A move starts at rest from the current position of the motor: a new
+    target given during a move restarts the profile from where the motor is.
+    The load follows the motor with a play of backlash, so it lags by the
+    backlash after every reversal of direction. At the end of the profile
+    the load rings around the target with an exponentially decaying error and
+    is on target settle_time after the end of the profile.
+
+    Attributes:
+        velocity/acceleration/deceleration : Motion profile in units/s,
+        units/s^2 and units/s^2.
+        limits : (minimum, maximum) positions of the travel range.
+        settle_time : Time in s between the end of the profile and on target.
+        overshoot : Error of the load in units at the end of the profile.
+        backlash : Play between the motor and the load in units.
+        noise : Standard deviation of the position readout in units.
+        last_duration : Duration in s of the last move, settling included.
+        moves : Number of moves done since the creation of the object.
+    """
+    def __init__(self, position=0.0, velocity=10.0, acceleration=50.0, deceleration=None,
+                 limits=(-12.5, 12.5), settle_time=0.01, overshoot=0.0, backlash=0.0, noise=0.0):
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.deceleration = deceleration or acceleration
+        self.limits = tuple(limits)
+        self.settle_time = settle_time
+        self.overshoot = overshoot
+        self.backlash = backlash
+        self.noise = noise
+        self.last_duration = 0.0
+        self.moves = 0
+        self._lock = threading.Lock()
+        # Motion in progress: start time, motor start, load at the start,
+        # direction and (t_acc, t_flat, t_dec, peak velocity)
+        self._t0 = time.perf_counter()
+        self._start = float(position)
+        self._target = float(position)
+        self._load0 = float(position)
+        self._direction = 1
+        self._profile = (0.0, 0.0, 0.0, 0.0)
+
+    def profile(self, distance):
+        """
+        Return (t_acc, t_flat, t_dec, peak velocity) of a move of distance
+        units, triangular when the velocity cannot be reached.
+        """
+        distance = abs(distance)
+        v, a, d = self.velocity, self.acceleration, self.deceleration
+        if distance == 0 or v <= 0 or a <= 0 or d <= 0:
+            return 0.0, 0.0, 0.0, 0.0
+        ramps = v**2/(2*a) + v**2/(2*d)
+        if distance < ramps:
+            v = np.sqrt(2*distance*a*d/(a + d))
+            return v/a, 0.0, v/d, v
+        return v/a, (distance - ramps)/v, v/d, v
+
+    def duration(self, distance):
+        """Return the time in s needed to move by distance and settle."""
+        t_acc, t_flat, t_dec, _ = self.profile(distance)
+        return t_acc + t_flat + t_dec + (self.settle_time if distance else 0.0)
+
+    def _travelled(self, elapsed):
+        # Distance covered by the motor elapsed s after the start of the move
+        t_acc, t_flat, t_dec, v = self._profile
+        if elapsed <= 0:
+            return 0.0
+        if elapsed < t_acc:
+            return 0.5*self.acceleration*elapsed**2
+        covered = 0.5*v*t_acc
+        if elapsed < t_acc + t_flat:
+            return covered + v*(elapsed - t_acc)
+        covered += v*t_flat
+        remaining = min(elapsed - t_acc - t_flat, t_dec)
+        return covered + v*remaining - 0.5*self.deceleration*remaining**2
+
+    def _end(self):
+        t_acc, t_flat, t_dec, _ = self._profile
+        return self._t0 + t_acc + t_flat + t_dec
+
+    def _motor(self, now):
+        if now >= self._end():
+            return self._target
+        return self._start + self._direction*self._travelled(now - self._t0)
+
+    def _load(self, now):
+        motor = self._motor(now)
+        play = self.backlash/2
+        if self._direction > 0:
+            return max(self._load0, motor - play)
+        return min(self._load0, motor + play)
+
+    def move(self, target):
+        """
+        Start a move to target and return its duration in s, settling
+        included. The target is clipped to the travel range.
+        """
+        target = min(max(float(target), self.limits[0]), self.limits[1])
+        with self._lock:
+            now = time.perf_counter()
+            motor = self._motor(now)
+            self._load0 = self._load(now)
+            if target != motor:
+                self._direction = 1 if target > motor else -1
+            self._start = motor
+            self._target = target
+            self._t0 = now
+            self._profile = self.profile(target - motor)
+            self.last_duration = self.duration(target - motor)
+            self.moves += 1
+            return self.last_duration
+
+    def stop(self):
+        """Stop the motor where it is."""
+        with self._lock:
+            now = time.perf_counter()
+            self._load0 = self._load(now)
+            self._start = self._target = self._motor(now)
+            self._t0 = now
+            self._profile = (0.0, 0.0, 0.0, 0.0)
+
+    def position(self):
+        """Return the measured position of the load."""
+        with self._lock:
+            now = time.perf_counter()
+            position = self._load(now)
+            end = self._end()
+            if now >= end and self.overshoot and self._profile[3]:
+                # Damped ringing after the end of the profile
+                tau = max(self.settle_time, 1e-6)/5
+                elapsed = now - end
+                position += (self._direction*self.overshoot*np.exp(-elapsed/tau)
+                             *np.cos(2*np.pi*elapsed/(2*tau)))
+        if self.noise:
+            position += np.random.normal(0.0, self.noise)
+        return position
+
+    def target(self):
+        """Return the target of the last move."""
+        return self._target
+
+    def is_moving(self):
+        """Return True while the motor follows the profile."""
+        return time.perf_counter() < self._end()
+
+    def on_target(self):
+        """Return True once the load has settled at the end of the move."""
+        settle = self.settle_time if self._profile[3] else 0.0
+        return time.perf_counter() >= self._end() + settle
+
+
+class SimulatedPIController:
+    """
+    GCS 2.0 controller with one stage per axis. Errors are kept until they
+    are read with ERR?, like on the controllers, and the commands that are
+    not implemented give the error 2 (unknown command).
+
+    Attributes:
+        stages : Dictionary of {axis: StageModel}.
+        idn : Answer to *IDN?.
+        servo/referenced/eax : Dictionaries of {axis: bool}.
+        trigger_config : Dictionary of {(line, parameter): value} set by CTO.
+        trigger_output : Dictionary of {line: bool} set by TRO.
+        error : Current error code.
+        latency : Time in s taken by every answer.
+        commands : Number of commands received.
+    """
+    HELP = {
+        '*IDN?': 'Get Device Identification', 'CSV?': 'Get Current Syntax Version',
+        'ERR?': 'Get Error Number', 'HLP?': 'Get List Of Available Commands',
+        'SAI?': 'Get List Of Current Axis Identifiers', 'MOV': 'Set Target Position',
+        'MOV?': 'Get Target Position', 'MVR': 'Set Target Relative To Current Position',
+        'POS?': 'Get Real Position', 'ONT?': 'Get On Target State',
+        'TMN?': 'Get Minimum Commandable Position', 'TMX?': 'Get Maximum Commandable Position',
+        'VEL': 'Set Closed-Loop Velocity', 'VEL?': 'Get Closed-Loop Velocity',
+        'ACC': 'Set Closed-Loop Acceleration', 'ACC?': 'Get Closed-Loop Acceleration',
+        'DEC': 'Set Closed-Loop Deceleration', 'DEC?': 'Get Closed-Loop Deceleration',
+        'SVO': 'Set Servo Mode', 'SVO?': 'Get Servo Mode', 'EAX': 'Enable Axis',
+        'EAX?': 'Get Enable State Of Axis', 'FRF': 'Fast Reference Move To Reference Switch',
+        'FRF?': 'Get Referencing Result', 'HLT': 'Halt Motion Smoothly', 'STP': 'Stop All Axes',
+        'CTO': 'Set Configuration Of Trigger Output', 'TRO': 'Set Trigger Output State',
+        '#5': 'Request Motion Status', '#7': 'Request Controller Ready Status', '#24': 'Stop All Axes',
+    }
+
+    def __init__(self, stages=None, idn='Physik Instrumente, C-863.11, 0000000000, 0.0.0 (simulated)',
+                 latency=0.0):
+        """
+        Constructor for the SimulatedPIController class.
+
+        Parameters:
+            stages : StageModel of the axis '1' or dictionary of {axis:
+            StageModel}, one StageModel with the default values by default.
+            idn : Answer to *IDN?.
+            latency : Time in s taken by every answer.
+        """
+        if stages is None:
+            stages = StageModel()
+        if isinstance(stages, StageModel):
+            stages = {'1': stages}
+        self.stages = {str(axis): stage for axis, stage in stages.items()}
+        self.idn = idn
+        self.latency = latency
+        self.servo = {axis: True for axis in self.stages}
+        self.referenced = {axis: True for axis in self.stages}
+        self.eax = {axis: True for axis in self.stages}
+        self.trigger_config = {}
+        self.trigger_output = {}
+        self.error = 0
+        self.commands = 0
+
+    def _seterror(self, code):
+        # The first error is kept until ERR? is sent
+        if not self.error:
+            self.error = code
+
+    def _axes(self, args):
+        axes = args or list(self.stages)
+        unknown = [axis for axis in axes if axis not in self.stages]
+        if unknown:
+            self._seterror(15)
+            return []
+        return axes
+
+    def _pairs(self, args):
+        if len(args) % 2 or not args:
+            self._seterror(1)
+            return []
+        pairs = list(zip(args[::2], args[1::2]))
+        if any(axis not in self.stages for axis, _ in pairs):
+            self._seterror(15)
+            return []
+        return pairs
+
+    @staticmethod
+    def _answer(items):
+        # Multi-line answers end every line but the last with a space
+        return ' \n'.join(items) + '\n'
+
+    def _query(self, args, getter):
+        return self._answer(['{}={}'.format(axis, getter(axis)) for axis in self._axes(args)])
+
+    def _move(self, pairs, relative=False):
+        for axis, value in pairs:
+            stage = self.stages[axis]
+            if not self.servo[axis] or not self.referenced[axis]:
+                self._seterror(5)
+                return
+            target = float(value) + (stage.target() if relative else 0.0)
+            if not stage.limits[0] <= target <= stage.limits[1]:
+                self._seterror(7)
+                return
+        for axis, value in pairs:
+            stage = self.stages[axis]
+            stage.move(float(value) + (stage.target() if relative else 0.0))
+
+    def _setprofile(self, pairs, attribute):
+        for axis, value in pairs:
+            setattr(self.stages[axis], attribute, float(value))
+
+    def handle(self, line):
+        """
+        Execute one command and return the answer as string, None for the
+        commands without answer.
+        """
+        self.commands += 1
+        _sleep(self.latency)
+        if line in ('\x05', '\x07', '\x18'):
+            if line == '\x05':
+                moving = sum(1 << i for i, stage in enumerate(self.stages.values()) if stage.is_moving())
+                return '{:x}\n'.format(moving)
+            if line == '\x07':
+                return '\xb1\n' if not any(stage.is_moving() for stage in self.stages.values()) else '\xb0\n'
+            for stage in self.stages.values():
+                stage.stop()
+            self._seterror(10)
+            return None
+        tokens = line.split()
+        if not tokens:
+            return None
+        command, args = tokens[0].upper(), tokens[1:]
+        stages = self.stages
+        if command == '*IDN?':
+            return self.idn + '\n'
+        if command == 'CSV?':
+            return '2.0\n'
+        if command == 'ERR?':
+            error, self.error = self.error, 0
+            return '{}\n'.format(error)
+        if command == 'HLP?':
+            return self._answer(['The following commands are valid:'] +
+                                ['{} - {}'.format(name, text) for name, text in self.HELP.items()] +
+                                ['end of help'])
+        if command == 'SAI?':
+            return self._answer(list(stages))
+        if command in ('MOV', 'MVR'):
+            self._move(self._pairs(args), relative=command == 'MVR')
+        elif command == 'MOV?':
+            return self._query(args, lambda axis: stages[axis].target())
+        elif command == 'POS?':
+            return self._query(args, lambda axis: stages[axis].position())
+        elif command == 'ONT?':
+            return self._query(args, lambda axis: int(stages[axis].on_target()))
+        elif command == 'TMN?':
+            return self._query(args, lambda axis: stages[axis].limits[0])
+        elif command == 'TMX?':
+            return self._query(args, lambda axis: stages[axis].limits[1])
+        elif command in ('VEL', 'ACC', 'DEC'):
+            self._setprofile(self._pairs(args), {'VEL': 'velocity', 'ACC': 'acceleration',
+                                                 'DEC': 'deceleration'}[command])
+        elif command in ('VEL?', 'ACC?', 'DEC?'):
+            attribute = {'VEL?': 'velocity', 'ACC?': 'acceleration', 'DEC?': 'deceleration'}[command]
+            return self._query(args, lambda axis: getattr(stages[axis], attribute))
+        elif command in ('SVO', 'EAX'):
+            states = self.servo if command == 'SVO' else self.eax
+            for axis, value in self._pairs(args):
+                states[axis] = bool(int(value))
+        elif command in ('SVO?', 'EAX?'):
+            states = self.servo if command == 'SVO?' else self.eax
+            return self._query(args, lambda axis: int(states[axis]))
+        elif command == 'FRF':
+            for axis in self._axes(args):
+                stages[axis].move(0.0)
+                self.referenced[axis] = True
+        elif command == 'FRF?':
+            return self._query(args, lambda axis: int(self.referenced[axis]))
+        elif command == 'HLT':
+            for axis in self._axes(args):
+                stages[axis].stop()
+        elif command == 'STP':
+            for stage in stages.values():
+                stage.stop()
+            self._seterror(10)
+        elif command == 'CTO':
+            if len(args) % 3:
+                self._seterror(1)
+            for i in range(0, len(args) - len(args) % 3, 3):
+                self.trigger_config[(args[i], int(args[i + 1]))] = args[i + 2]
+        elif command == 'TRO':
+            if len(args) % 2 or not args:
+                self._seterror(1)
+            for line, value in zip(args[::2], args[1::2]):
+                self.trigger_output[line] = bool(int(value))
+        else:
+            self._seterror(2)
+        return None
+
+
+class SimulatedSMC100:
+    """
+    Newport SMC100 controllers, one stage per address, with the states of
+    the controller (not referenced, configuration, homing, moving, ready).
+    The stages start in the NOT REFERENCED FROM RESET state, like after a
+    power up, and home to the position 0.
+
+    Attributes:
+        stages : Dictionary of {address: StageModel}.
+        states : Dictionary of {address: state}, see SMC100CC.
+        errors : Dictionary of {address: command error letter, '@' if none}.
+        stage_id : Answer to ID?.
+        latency : Time in s taken by every answer.
+        commands : Number of commands received.
+    """
+    def __init__(self, stages=None, stage_id='TRB25CC_SIMULATED', latency=0.0):
+        """
+        Constructor for the SimulatedSMC100 class.
+
+        Parameters:
+            stages : StageModel of the address 1 or dictionary of {address:
+            StageModel}, one StageModel with the default values by default.
+            stage_id : Answer to ID?.
+            latency : Time in s taken by every answer.
+        """
+        if stages is None:
+            stages = StageModel(velocity=2.0, acceleration=8.0)
+        if isinstance(stages, StageModel):
+            stages = {1: stages}
+        self.stages = {int(address): stage for address, stage in stages.items()}
+        self.states = {address: '0A' for address in self.stages}
+        self.errors = {address: '@' for address in self.stages}
+        self.stage_id = stage_id
+        self.latency = latency
+        self.commands = 0
+
+    def state(self, address):
+        """Return the state of the controller at address."""
+        state = self.states[address]
+        if state in ('1E', '28') and not self.stages[address].is_moving():
+            state = self.states[address] = '32' if state == '1E' else '33'
+        return state
+
+    def handle(self, line):
+        """
+        Execute one command and return the answer as string, None for the
+        commands without answer.
+        """
+        self.commands += 1
+        _sleep(self.latency)
+        line = line.strip()
+        digits = len(line) - len(line.lstrip('0123456789'))
+        if not digits or int(line[:digits]) not in self.stages:
+            # Not for one of these controllers
+            return None
+        address = int(line[:digits])
+        command, argument = line[digits:digits + 2].upper(), line[digits + 2:]
+        stage = self.stages[address]
+        state = self.state(address)
+        prefix = '{}{}'.format(address, command)
+        ready = state in ('32', '33', '34')
+
+        if argument == '?':
+            answers = {
+                'TS': lambda: '0000' + state,
+                'TP': lambda: '{:.6f}'.format(stage.position()),
+                'TH': lambda: '{:.6f}'.format(stage.target()),
+                'VA': lambda: '{:g}'.format(stage.velocity),
+                'AC': lambda: '{:g}'.format(stage.acceleration),
+                'SL': lambda: '{:g}'.format(stage.limits[0]),
+                'SR': lambda: '{:g}'.format(stage.limits[1]),
+                'ID': lambda: self.stage_id,
+                'TE': lambda: self.errors[address],
+            }
+            if command not in answers:
+                self.errors[address] = 'A'
+                return None
+            answer = answers[command]()
+            if command == 'TE':
+                self.errors[address] = '@'
+            return '{}{}\r\n'.format(prefix, answer)
+
+        try:
+            value = float(argument) if argument else None
+        except ValueError:
+            self.errors[address] = 'A'
+            return None
+        if command == 'RS':
+            stage.stop()
+            self.states[address] = '0A'
+        elif command == 'PW':
+            if value == 1 and state in ('0A', '0C'):
+                self.states[address] = '14'
+            elif value == 0 and state == '14':
+                self.states[address] = '0C'
+            else:
+                self.errors[address] = 'D'
+        elif command == 'ZX':
+            pass
+        elif command == 'OR':
+            if state in ('0A', '0C'):
+                stage.move(0.0)
+                self.states[address] = '1E'
+            else:
+                self.errors[address] = 'D'
+        elif command in ('PA', 'PR'):
+            if not ready or value is None:
+                self.errors[address] = 'D' if not ready else 'A'
+            else:
+                target = value + (stage.target() if command == 'PR' else 0.0)
+                if not stage.limits[0] <= target <= stage.limits[1]:
+                    self.errors[address] = 'C'
+                else:
+                    stage.move(target)
+                    self.states[address] = '28'
+        elif command in ('VA', 'AC') and value is not None:
+            if value <= 0:
+                self.errors[address] = 'C'
+            elif command == 'VA':
+                stage.velocity = value
+            else:
+                stage.acceleration = stage.deceleration = value
+        elif command == 'ST':
+            stage.stop()
+            if state in ('1E', '28'):
+                self.states[address] = '33' if state == '28' else '0A'
+        else:
+            self.errors[address] = 'A'
+        return None
+
+
+class _SimulationHandler(socketserver.BaseRequestHandler):
+    """Split the received bytes in commands and send back the answers."""
+    def handle(self):
+        controller = self.server.controller
+        line = bytearray()
+        while True:
+            try:
+                received = self.request.recv(4096)
+            except OSError:
+                return
+            if not received:
+                return
+            # The answers to the commands received together are sent together, as a controller
+            # does, instead of one small segment after the other held back by Nagle's algorithm
+            answers = []
+            for byte in received:
+                if byte == 0x0A:
+                    command, line = line.decode(self.server.codepage), bytearray()
+                elif byte == 0x0D:
+                    continue
+                elif byte < 0x20 and not line:
+                    # Single character commands of GCS, ie #5 and #7
+                    command = chr(byte)
+                else:
+                    line.append(byte)
+                    continue
+                with self.server.lock:
+                    answer = controller.handle(command)
+                if answer:
+                    answers.append(answer)
+            if answers:
+                self.request.sendall(''.join(answers).encode(self.server.codepage))
+
+
+class SimulationServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server of a simulated controller. It listens on host and on a free
+    port by default, every connection is handled by its own thread and the
+    commands are executed one at a time.
+
+    Attributes:
+        controller : Object with a handle(line) method returning the answer.
+        lock : Lock held during the execution of a command.
+        codepage : Encoding of the commands and answers.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, controller, host='localhost', port=0, codepage='cp1252'):
+        """
+        Constructor for the SimulationServer class.
+
+        Parameters:
+            controller : SimulatedPIController, SimulatedSMC100 or any object
+            with a handle(line) method.
+            host/port : Address to listen to, port 0 takes a free port.
+            codepage : Encoding of the commands and answers.
+        """
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _SimulationHandler)
+        self.controller = controller
+        self.lock = threading.Lock()
+        self.codepage = codepage
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        """Url of the server for serial.serial_for_url, ie SMC100CC.SMC100."""
+        return 'socket://{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        """Serve in a background thread and return the server."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.serve_forever, name='SimulationServer', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stop serving and close the socket."""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
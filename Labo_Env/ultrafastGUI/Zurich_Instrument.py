@@ -1,10 +1,174 @@
+import tkinter as tk
 from tkinter import messagebox
+from contextlib import contextmanager
+from fnmatch import fnmatch
 import Graphic
 import re
 import numpy as np
+import threading
 import time
 
 
+# Multiple of the time constant needed by the demodulator filter to settle at
+# 99% of its final value for each filter order.
+# Source : https://www.zhinst.com/americas/resources/principles-lock-detection
+SETTLING_FACTORS = {1: 4.61, 2: 6.64, 3: 8.41, 4: 10.05, 5: 11.6, 6: 13.1, 7: 14.5, 8: 15.9}
+
+# Shortest poll done by the poller thread in seconds, it polls up to the end
+# of the acquisition windows waited for instead of its usual length
+MIN_POLL_LENGTH = 0.001
+
+
+# Fields of the samples kept by the streams of each kind of node
+STREAM_FIELDS = {'demods': ('x', 'y'), 'boxcars': ('value',)}
+
+
+class DemodStream:
+    """
+    Ring buffer of the samples of one demodulator or boxcar. It is filled by
+    the poller thread of the Zurich class so the node stays subscribed during
+    a whole scan and the scan only asks for the samples measured in a time
+    window after each move.
+
+    Attributes:
+        path : Node of the samples, ie /dev1234/demods/0/sample.
+        clockbase : Clock of the device used to convert the timestamps.
+        fields : Names of the arrays of the samples kept, ('x', 'y') for a
+        demodulator and ('value',) for a boxcar.
+        capacity : Number of samples kept in the buffer.
+        offset : Estimate of host time - device time in seconds. Host times
+        are given by time.perf_counter().
+        count : Total number of samples received.
+    """
+    def __init__(self, path, clockbase, fields=STREAM_FIELDS['demods'], capacity=2**19):
+        self.path = path
+        self.clockbase = clockbase
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        # Device time in seconds, kept sorted in the ring
+        self.time = np.zeros(capacity)
+        self.values = {field: np.zeros(capacity) for field in self.fields}
+        self.count = 0
+        self.offset = None
+        self.condition = threading.Condition()
+
+    def append(self, sample, received):
+        """
+        Add the data returned by poll for this path to the buffer.
+
+        Parameters:
+            sample : Dictionary with the timestamp array and the arrays of the
+            fields.
+            received : time.perf_counter() when the poll returned.
+        """
+        device_time = np.asarray(sample['timestamp'], dtype=np.float64)/self.clockbase
+        if not device_time.size:
+            return
+        values = {field: np.asarray(sample[field]) for field in self.fields}
+        if device_time.size > self.capacity:
+            device_time = device_time[-self.capacity:]
+            values = {field: value[-self.capacity:] for field, value in values.items()}
+        with self.condition:
+            # The transfer delay is always positive, the smallest difference
+            # between the reception and the last sample is the best estimate
+            offset = received - device_time[-1]
+            if self.offset is None or offset < self.offset:
+                self.offset = offset
+            index = (self.count + np.arange(device_time.size)) % self.capacity
+            self.time[index] = device_time
+            for field, value in values.items():
+                self.values[field][index] = value
+            self.count += device_time.size
+            self.condition.notify_all()
+
+    def _segments(self):
+        # Parts of the ring in chronological order
+        if self.count <= self.capacity:
+            return [slice(0, self.count)]
+        start = self.count % self.capacity
+        return [slice(start, self.capacity), slice(0, start)]
+
+    def latest_time(self):
+        """Return the host time of the last sample received or None."""
+        with self.condition:
+            if not self.count:
+                return None
+            return self.time[(self.count - 1) % self.capacity] + self.offset
+
+    def samples_between(self, t0, t1, timeout=1.0):
+        """
+        Return the samples measured between the host times t0 and t1, waiting
+        for them to be received if needed.
+
+        Parameters:
+            t0/t1 : Limits of the window in time.perf_counter() seconds.
+            timeout : Time to wait after t1 before returning what was
+            received.
+
+        Returns:
+            Tuple of arrays (host time, field...) of the samples in the
+            window, ie (host time, x, y) for a demodulator.
+        """
+        deadline = max(t1, time.perf_counter()) + timeout
+        with self.condition:
+            while True:
+                latest = None
+                if self.count:
+                    latest = self.time[(self.count - 1) % self.capacity] + self.offset
+                remaining = deadline - time.perf_counter()
+                if (latest is not None and latest >= t1) or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if latest is None:
+                return (np.zeros(0),) + tuple(np.zeros(0) for _ in self.fields)
+            start = t0 - self.offset
+            stop = t1 - self.offset
+            parts = []
+            for segment in self._segments():
+                device_time = self.time[segment]
+                first = np.searchsorted(device_time, start, 'left')
+                last = np.searchsorted(device_time, stop, 'right')
+                index = np.arange(segment.start + first, segment.start + last)
+                parts.append(index)
+            index = np.concatenate(parts)
+            return ((self.time[index] + self.offset,) +
+                    tuple(self.values[field][index] for field in self.fields))
+
+
+class PathBuffer:
+    """
+    Double buffer of the data polled for one displayed path. The poller
+    thread writes in the back buffer and the GUI swaps it out to draw it, so
+    drawing never waits for a poll and a poll never waits for a drawing.
+
+    Attributes:
+        back : Data received since the last swap, None if nothing new. Lists
+        of shots (scopes, boxcars) are accumulated up to max_shots, other
+        data replaces the previous one.
+        max_shots : Number of shots kept between two swaps.
+    """
+    def __init__(self, max_shots=16):
+        self.back = None
+        self.max_shots = max_shots
+        self.lock = threading.Lock()
+
+    def write(self, value):
+        with self.lock:
+            if isinstance(value, list):
+                if self.back is None:
+                    self.back = []
+                self.back.extend(value)
+                del self.back[:-self.max_shots]
+            else:
+                self.back = value
+
+    def swap(self):
+        """Return the data received since the last swap or None."""
+        with self.lock:
+            front, self.back = self.back, None
+        return front
+
+
 class Zurich:
     def __init__(self, mainf=None):
         self.mainf = mainf
@@ -15,15 +179,40 @@ class Zurich:
         self.subscribed = {}
         self.node_branch = None
         self.state = {}
-        self.in_use = False
-        self.subscribing = False
         poll_length = 0.1 # Time of the aquisition in second
         poll_timeout = 500 # [ms]
         poll_flags = 0
         poll_return_dict = True # This is how the data is returned
         self.poll_set = [poll_length, poll_timeout, poll_flags, poll_return_dict]
+        # Background poller feeding the displays and the demodulator streams,
+        # it polls short windows so the data arrives with a low latency
+        self.stream_poll_set = [0.01, 10, poll_flags, poll_return_dict]
+        self.streams = {}
+        # Host times of the ends of the windows waited for by acquire
+        self.deadlines = []
+        self.buffers = {}
+        self.poller = None
+        self.polling = False
+        self.lock = threading.RLock()
+        # Mirror of the device nodes. nodes holds values read from the device
+        # (or refreshed by subscription for the watched nodes), written the
+        # last values sent so identical writes are skipped and
+        # pending_settings the writes waiting for the end of a transaction.
+        self.nodes = {}
+        self.written = {}
+        self.watched = set()
+        self.pending_settings = {}
+        self.batching = 0
 
     def connect_device(self, devicename, required_options=None, required_err_msg='', exp_dependencie=False):
+        if devicename.lower().startswith('sim'):
+            # Work without the instrument, see Zurich_Simulation
+            from Zurich_Simulation import SimulatedDAQServer
+            daq = SimulatedDAQServer()
+            self.attach(daq, daq.device, daq.props, daq.default_mixer_channel)
+            messagebox.showinfo(message='Simulated device {} is connected'.format(daq.device),
+                                title='Information')
+            return
         import zhinst.utils as utils
         import zhinst.ziPython as ziPython
 
@@ -81,34 +270,76 @@ class Zurich:
             daq = ziPython.ziDAQServer(props['serveraddress'], props['serverport'], apilevel)
             messagebox.showinfo(message='Zurich Instrument device {} is connected'.format(device_id),
                                 title='Information')
-            self.info = {'daq': daq, 'device': device_id, 'prop': props}
-            self.default = utils.default_output_mixer_channel(self.info['prop'])
-            self.node_branch = daq.listNodes('/%s/' % device_id, 0)
-            reset_settings = [
-                ['/%s/demods/*/enable' % device_id, 0],
-                ['/%s/demods/*/trigger' % device_id, 0],
-                ['/%s/sigout/*/enables/*' % device_id, 0],
-                ['/%s/scopes/*/enable' % device_id, 0]
-            ]
-
-            daq.set(reset_settings)
-            daq.sync()
-
-            if self.mainf:
-                experiments = self.mainf.Frame[4].experiment_dict
-                for experiment in experiments:
-                    experiments[experiment].update_options('Zurich')
+            self.attach(daq, device_id, props, utils.default_output_mixer_channel(props))
 
-    # This function has a lot to work on it should work properly but it is really only a patched up function
-    def update_settings(self, value=None, type_=None, setting_line=None):
+    def attach(self, daq, device_id, props, default=0):
+        """
+        Use daq as the data server of the device and put the device in its
+        initial state. connect_device calls it once the server is found, it
+        can also be given a Zurich_Simulation.SimulatedDAQServer.
+
+        Parameters:
+            daq : ziDAQServer (or object with the same methods) connected.
+            device_id : Name of the device, ie dev1234.
+            props : Dictionary of the discovery properties of the device.
+            default : Output mixer channel of the device.
+        """
+        if self.info:
+            self.disconnect()
+        self.info = {'daq': daq, 'device': device_id, 'prop': props}
+        self.default = default
+        self.node_branch = daq.listNodes('/%s/' % device_id, 0)
+        reset_settings = [
+            ['/%s/demods/*/enable' % device_id, 0],
+            ['/%s/demods/*/trigger' % device_id, 0],
+            ['/%s/sigout/*/enables/*' % device_id, 0],
+            ['/%s/scopes/*/enable' % device_id, 0]
+        ]
+
+        self.set_nodes(reset_settings)
+
+        if self.mainf:
+            self.mainf.Frame[4].update_options('Zurich')
 
+    def disconnect(self):
+        """
+        Stop the poller, unsubscribe the displays, the streams and the watched
+        nodes and forget the cached nodes of the device.
+        """
+        if not self.info:
+            return
+        self.stop_poller()
+        with self.lock:
+            if self.subscribed or self.streams or self.watched:
+                self.info['daq'].unsubscribe('*')
+            self.subscribed = {}
+            self.buffers = {}
+            self.streams = {}
+            self.deadlines = []
+            self.watched = set()
+            self.pending_settings = {}
+            self.written = {}
+            self.invalidate_nodes()
+            self.info = None
+
+    def update_settings(self, value=None, type_=None, setting_line=None):
+        """
+        Write the setting of a widget on the device, the default demodulator
+        parameters written when a demodulator is enabled are sent with it in
+        a single set and sync.
+        """
         if not self.info:
             messagebox.showinfo(title='Error', message='There is no device connected yet, please connect the device ' +
                                 'before changing any device settings.')
             return
+        with self.transaction():
+            self._update_settings(value, type_, setting_line)
+
+    # This function has a lot to work on it should work properly but it is really only a patched up function
+    def _update_settings(self, value, type_, setting_line):
 
         if 'oscs' in setting_line:
-            state = self.info['daq'].getInt('/{}{}'.format(self.info['device'], setting_line))
+            state = self.get_node('/{}{}'.format(self.info['device'], setting_line), int)
             if state == 1:
                 messagebox.showinfo(title='Error', message='This option is unavailable until the external reference' +
                                     'is unconnected.')
@@ -173,8 +404,8 @@ class Zurich:
                     print(setting)
                 elif type_ == 'combobox_external':
                     selected = value.current()
-                    state = self.info['daq'].getInt('/{}{}/enable'.format(self.info['device'], setting_line))
-                    mode = self.info['daq'].getInt('/{}{}/automode'.format(self.info['device'], setting_line))
+                    state = self.get_node('/{}{}/enable'.format(self.info['device'], setting_line), int)
+                    mode = self.get_node('/{}{}/automode'.format(self.info['device'], setting_line), int)
                     if selected == 0:
                         setting = ['/{}{}/enable'.format(self.info['device'], setting_line), 0]
                     elif selected == 1:
@@ -207,11 +438,16 @@ class Zurich:
                     # I have to find a way to get the input amplitude or output... I am not sure just yet
                     setting.append(['/{}{}/{}'.format(self.info['device'], setting_line[2][1], self.default), 2])
 
-        setting = [setting]
-        print(setting)
-        # This sets the item in the Zurich server
-        self.info['daq'].set(setting)
-        self.info['daq'].sync()
+        if not setting:
+            return
+        # setting is either a [path, value] pair, a list of pairs or a pair
+        # followed by other pairs for the outputs
+        if type(setting[0]) == list:
+            settings = setting
+        else:
+            settings = [setting[:2]] + setting[2:]
+        # This sets the item in the Zurich server, unchanged values are skipped
+        self.set_nodes(settings)
 
     def default_demod(self, path, variable):
         value = None
@@ -234,8 +470,7 @@ class Zurich:
                   ['/%s/demods/%s/timeconstant' % (self.info['device'], index), utils.bw2tc(100, 1)],
                   ['/%s/demods/%s/oscselect' % (self.info['device'], index), 0],
                   ['/%s/demods/%d/harmonic' % (self.info['device'], 0), 1]]
-        self.info['daq'].set(basics)
-        self.info['daq'].sync()
+        self.set_nodes(basics)
         self.paths['/{}/demods/{}/sample'.format(self.info['device'], index)] = True
 
     def add_subscribed(self, path, child_class, graph_class):
@@ -245,43 +480,532 @@ class Zurich:
             return
         if not path:
             return
-        while self.in_use:
-            time.sleep(0.1)
-        for element in self.paths:
-            if self.paths[element]:
-                if path in element:
-                    self.subscribing = True
-                    self.info['daq'].subscribe(element)
-                    self.subscribed[element] = [child_class, graph_class]
-        self.subscribing = False
+        with self.lock:
+            for element in self.paths:
+                if self.paths[element]:
+                    if path in element:
+                        self.info['daq'].subscribe(element)
+                        self.subscribed[element] = [child_class, graph_class]
+                        if element not in self.buffers:
+                            self.buffers[element] = PathBuffer()
+        if self.subscribed:
+            self.start_poller()
 
     def unsubscribed_path(self, path):
         # Same input as the add_subscribed
         if not self.info:
             return
-        for element in self.paths:
-            if self.paths[element]:
-                if path in element:
-                    self.subscribing = True
-                    self.info['daq'].unsubscribe(element)
-                    del self.subscribed[element]
-        self.subscribing = False
+        with self.lock:
+            for element in self.paths:
+                if self.paths[element]:
+                    if path in element and element in self.subscribed:
+                        # A demodulator stream still needs the subscription
+                        if element not in self.streams:
+                            self.info['daq'].unsubscribe(element)
+                        del self.subscribed[element]
+                        self.buffers.pop(element, None)
+            last = not self.poller_needed()
+        if last:
+            self.stop_poller()
 
-    def measure(self):
+    def demod_stream(self, index=0, node='demods'):
+        """
+        Return the DemodStream of the demodulator (or boxcar) index,
+        subscribing it and starting the poller thread the first time it is
+        requested.
+
+        Parameters:
+            index : Number of the demodulator or boxcar.
+            node : 'demods' or 'boxcars'.
+        """
+        path = '/{}/{}/{}/sample'.format(self.info['device'], node, index)
+        with self.lock:
+            if path not in self.streams:
+                clockbase = float(self.get_node('/{}/clockbase'.format(self.info['device']), int))
+                self.streams[path] = DemodStream(path, clockbase, STREAM_FIELDS[node])
+                if path not in self.subscribed:
+                    self.info['daq'].subscribe(path)
+        self.start_poller()
+        return self.streams[path]
+
+    def stop_stream(self, index=0, node='demods'):
+        """
+        Unsubscribe the stream of the demodulator (or boxcar) index, the
+        poller is stopped with the last stream.
 
-        if self.in_use:
+        Parameters:
+            index : Number of the demodulator or boxcar.
+            node : 'demods' or 'boxcars'.
+        """
+        if not self.info:
             return
-        subscribed = self.subscribed
-        data_set = self.info['daq'].poll(self.poll_set[0], self.poll_set[1], self.poll_set[2], self.poll_set[3])
-        self.in_use = True
-        # Ici pour le bug de superposition
+        path = '/{}/{}/{}/sample'.format(self.info['device'], node, index)
+        with self.lock:
+            if path not in self.streams:
+                return
+            del self.streams[path]
+            if path not in self.subscribed:
+                self.info['daq'].unsubscribe(path)
+            last = not self.poller_needed()
+        if last:
+            self.stop_poller()
+
+    def acquire(self, duration, index=0, start=None, node='demods'):
+        """
+        Return the x values of the demodulator index, or the values of the
+        boxcar index, measured during duration seconds from start.
+
+        Parameters:
+            duration : Length of the window in seconds.
+            index : Number of the demodulator or boxcar.
+            start : Beginning of the window in time.perf_counter() seconds,
+            now by default.
+            node : 'demods' or 'boxcars'.
+        """
+        stream = self.demod_stream(index, node)
+        if start is None:
+            start = time.perf_counter()
+        end = start + duration
+        # The poller shortens its polls to return as soon as the window is
+        # covered instead of up to a whole poll length after it
+        with self.lock:
+            self.deadlines.append(end)
         try:
-            for path in subscribed:
-                subscribed[path][0].extract_data(data=data_set, path=path)
-                subscribed[path][1].update_graph()
-        except:
-            print("Size change")
-        self.in_use = False
+            return stream.samples_between(start, end)[1]
+        finally:
+            with self.lock:
+                self.deadlines.remove(end)
+
+    def settling_time(self, index=0):
+        """
+        Return the 99% settling time in seconds of the filter of the
+        demodulator index.
+
+        Parameters:
+            index : Number of the demodulator.
+        """
+        device = self.info['device']
+        tc = self.get_node('/{}/demods/{}/timeconstant'.format(device, index))
+        order = self.get_node('/{}/demods/{}/order'.format(device, index), int)
+        return SETTLING_FACTORS.get(order, SETTLING_FACTORS[8])*tc
+
+    def settled_start(self, since=None, index=0):
+        """
+        Return the host time at which the demodulator index has settled after
+        a change of the signal at since. Scans use it as the start of the
+        acquisition window so the samples taken during the settling are
+        dropped from the stream instead of sleeping.
+
+        Parameters:
+            since : time.perf_counter() value of the change, ie when the
+            stage reported being on target, now by default.
+            index : Number of the demodulator.
+        """
+        if since is None:
+            since = time.perf_counter()
+        return since + self.settling_time(index)
+
+    def get_node(self, path, type_=float, refresh=False):
+        """
+        Return the value of a node, read from the device only when it is not
+        known yet, was written since the last read or refresh is asked.
+
+        Parameters:
+            path : Full path of the node, ie /dev1234/demods/0/order.
+            type_ : int to read the node with getInt, float for getDouble.
+            refresh : Read the device even if the value is known.
+        """
+        path = path.lower()
+        with self.lock:
+            if refresh or path not in self.nodes:
+                if type_ == int:
+                    self.nodes[path] = self.info['daq'].getInt(path)
+                else:
+                    self.nodes[path] = self.info['daq'].getDouble(path)
+            return self.nodes[path]
+
+    def set_nodes(self, settings):
+        """
+        Write settings on the device with a single set and sync. Values equal
+        to the last ones written are skipped and, inside a transaction, the
+        writes are only sent when it ends.
+
+        Parameters:
+            settings : List of [path, value] pairs, the paths can contain
+            wildcards.
+        """
+        with self.lock:
+            for path, value in settings:
+                path = path.lower()
+                if '*' not in path and path not in self.pending_settings and self.written.get(path) == value:
+                    continue
+                self.pending_settings[path] = value
+            if not self.batching:
+                self.commit()
+
+    def commit(self):
+        """Send the pending settings with one set followed by one sync."""
+        with self.lock:
+            if not self.pending_settings:
+                return
+            settings = [[path, value] for path, value in self.pending_settings.items()]
+            self.pending_settings = {}
+            self.info['daq'].set(settings)
+            self.info['daq'].sync()
+            for path, value in settings:
+                # The device can round what it is given, the written nodes are
+                # read again the next time they are needed
+                if '*' in path:
+                    for node in [node for node in self.written if fnmatch(node, path)]:
+                        del self.written[node]
+                    for node in [node for node in self.nodes if fnmatch(node, path)]:
+                        del self.nodes[node]
+                else:
+                    self.written[path] = value
+                    self.nodes.pop(path, None)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group the set_nodes calls done in the with block in a single set and
+        sync. The pending settings are dropped if the block raises.
+        """
+        with self.lock:
+            self.batching += 1
+        try:
+            yield self
+        except Exception:
+            with self.lock:
+                self.batching -= 1
+                if not self.batching:
+                    self.pending_settings = {}
+            raise
+        else:
+            with self.lock:
+                self.batching -= 1
+                if not self.batching:
+                    self.commit()
+
+    def watch_nodes(self, paths):
+        """
+        Subscribe setting nodes so their cached value follows the changes
+        made by the device itself (ie an oscillator following an external
+        reference) without reading them again.
+
+        Parameters:
+            paths : List of full node paths.
+        """
+        with self.lock:
+            for path in paths:
+                path = path.lower()
+                if path not in self.watched:
+                    self.watched.add(path)
+                    self.info['daq'].subscribe(path)
+        self.start_poller()
+
+    def unwatch_nodes(self, paths):
+        """
+        Stop following nodes given to watch_nodes, they are read from the
+        device again the next time they are needed.
+
+        Parameters:
+            paths : List of full node paths.
+        """
+        with self.lock:
+            for path in paths:
+                path = path.lower()
+                if path in self.watched:
+                    self.watched.discard(path)
+                    if path not in self.subscribed and path not in self.streams:
+                        self.info['daq'].unsubscribe(path)
+                    self.nodes.pop(path, None)
+            last = not self.poller_needed()
+        if last:
+            self.stop_poller()
+
+    def invalidate_nodes(self, prefix=''):
+        """Forget the cached values of the nodes starting with prefix."""
+        prefix = prefix.lower()
+        with self.lock:
+            for node in [node for node in self.nodes if node.startswith(prefix)]:
+                del self.nodes[node]
+
+    def _update_watched(self, data_set):
+        # Watched setting nodes are returned by poll with their new values
+        for path in self.watched:
+            if path in data_set and len(data_set[path]['value']):
+                self.nodes[path] = data_set[path]['value'][-1]
+
+    def poller_needed(self):
+        """Return True while a display, a stream or a watched node needs data."""
+        return bool(self.subscribed or self.streams or self.watched)
+
+    def start_poller(self):
+        if self.poller is not None and self.poller.is_alive():
+            return
+        self.polling = True
+        self.poller = threading.Thread(target=self._poll_loop, name='Zurich poller', daemon=True)
+        self.poller.start()
+
+    def stop_poller(self):
+        self.polling = False
+        if self.poller is not None and self.poller is not threading.current_thread():
+            self.poller.join()
+        self.poller = None
+
+    def _poll_loop(self):
+        # Only this thread polls the daq while it runs. The data of the
+        # streams goes to their ring buffer, the data of the displays to
+        # their double buffer.
+        while self.polling:
+            poll_set = list(self.stream_poll_set)
+            with self.lock:
+                deadline = min(self.deadlines) if self.deadlines else None
+            if deadline is not None:
+                poll_set[0] = min(poll_set[0], max(deadline - time.perf_counter(), MIN_POLL_LENGTH))
+            try:
+                data_set = self.info['daq'].poll(*poll_set)
+            except RuntimeError as error:
+                print('Zurich poller: {}'.format(error))
+                time.sleep(0.1)
+                continue
+            received = time.perf_counter()
+            with self.lock:
+                self._update_watched(data_set)
+                for path in data_set:
+                    if path in self.streams:
+                        self.streams[path].append(data_set[path], received)
+                    if path in self.buffers:
+                        self.buffers[path].write(data_set[path])
+
+    def measure(self):
+        # Called from the GUI, it only draws what the poller thread received
+        # since the last call and never waits on the data server
+        with self.lock:
+            subscribed = list(self.subscribed.items())
+            buffers = dict(self.buffers)
+        for path, (child_class, graph_class) in subscribed:
+            data = buffers[path].swap() if path in buffers else None
+            if data is None:
+                continue
+            try:
+                child_class.extract_data(data={path: data}, path=path)
+                graph_class.update_graph()
+            except Exception as error:
+                # Keep refreshing the other displays
+                print('Zurich display of {} failed: {}'.format(path, error))
+
+
+class FlyScan:
+    """
+    Records a continuous stage sweep as one grid with the DataAcquisitionModule
+    of the data server instead of stopping and polling at every position. The
+    positions of the stage are read during the motion and matched to the
+    samples of the grid by their timestamp. The recording can be started by
+    the stage itself (trigger output of the controller wired to a trigger
+    input of the lock-in, configured by the sweep to be high while the stage
+    moves) or as soon as the module is armed.
+
+    Attributes:
+        zurich : Zurich object of the connected device.
+        signal : Node recorded relative to the device, ie demods/0/sample.x.
+        trigger : Key of TRIGGER_TYPES.
+        trigger_node : Node relative to the device used by the trigger.
+        trigger_line : Output line of the stage controller wired to the
+        trigger input of the lock-in.
+        level : Level of the edge trigger, or bits of the digital trigger.
+        holdoff : Time in seconds before the trigger can be rearmed.
+        module : dataAcquisitionModule of the data server, None until armed.
+        duration : Length of the grid in seconds.
+    """
+    # Values of the type parameter of the module
+    TRIGGER_TYPES = {'continuous': 0, 'edge': 1, 'digital': 2, 'hardware': 6}
+    # Mode 4 keeps the exact samples of the demodulator without interpolation
+    GRID_EXACT = 4
+
+    def __init__(self, zurich=None, signal='demods/0/sample.x', trigger='continuous',
+                 trigger_node='demods/0/sample.TrigIn1', level=0.5, holdoff=0.0, trigger_line=1):
+        if trigger not in self.TRIGGER_TYPES:
+            raise ValueError('Unknown trigger {!r}, choose among {}'.format(
+                trigger, ', '.join(self.TRIGGER_TYPES)))
+        self.zurich = zurich
+        self.signal = signal
+        self.trigger = trigger
+        self.trigger_node = trigger_node
+        self.level = level
+        self.holdoff = holdoff
+        self.trigger_line = trigger_line
+        self.module = None
+        self.duration = 0
+
+    def path(self, node):
+        return '/{}/{}'.format(self.zurich.info['device'], node.strip('/')).lower()
+
+    def clock_offset(self, tries=5):
+        """
+        Return host time - device time in seconds. The estimate of the
+        demodulator stream is used when it runs, otherwise the clock of the
+        device is read a few times and the fastest round trip is kept.
+
+        Parameters:
+            tries : Number of reads of the device clock.
+        """
+        stream = self.zurich.streams.get(re.sub(r'(sample)\..*$', r'\1', self.path(self.signal)))
+        if stream is not None and stream.offset is not None:
+            return stream.offset
+        daq = self.zurich.info['daq']
+        clockbase = float(self.zurich.get_node('/{}/clockbase'.format(self.zurich.info['device']), int))
+        best = None
+        for _ in range(tries):
+            before = time.perf_counter()
+            ticks = daq.getInt('/{}/status/time'.format(self.zurich.info['device']))
+            after = time.perf_counter()
+            if best is None or after - before < best[0]:
+                best = (after - before, (before + after)/2 - ticks/clockbase)
+        return best[1]
+
+    def arm(self, duration, points):
+        """
+        Configure the module for one grid and start it. In continuous mode the
+        recording starts right away, otherwise at the first trigger.
+
+        Parameters:
+            duration : Length of the recording in seconds.
+            points : Number of columns of the grid.
+        """
+        daq = self.zurich.info['daq']
+        if self.module is None:
+            self.module = daq.dataAcquisitionModule()
+        module = self.module
+        module.set('device', self.zurich.info['device'])
+        module.set('type', self.TRIGGER_TYPES[self.trigger])
+        if self.trigger != 'continuous':
+            module.set('triggernode', self.path(self.trigger_node))
+            module.set('edge', 1)
+            if self.trigger == 'digital':
+                module.set('bits', int(self.level))
+                module.set('bitmask', int(self.level))
+            else:
+                module.set('level', self.level)
+            module.set('holdoff/time', self.holdoff)
+        module.set('grid/mode', self.GRID_EXACT)
+        module.set('grid/rows', 1)
+        module.set('grid/cols', int(points))
+        module.set('duration', duration)
+        module.set('count', 1)
+        module.set('endless', 0)
+        module.unsubscribe('*')
+        module.subscribe(self.path(self.signal))
+        module.execute()
+        self.duration = duration
+
+    def read(self, timeout=5.0):
+        """
+        Wait for the grid to be completed and return it.
+
+        Parameters:
+            timeout : Time in seconds to wait after the duration of the grid.
+
+        Returns:
+            Tuple of arrays (device time in seconds, value). They are empty
+            when the grid was not completed in time, ie no trigger came.
+        """
+        module = self.module
+        deadline = time.perf_counter() + self.duration + timeout
+        while not module.finished():
+            if time.perf_counter() > deadline:
+                module.finish()
+                return np.zeros(0), np.zeros(0)
+            time.sleep(0.05)
+        data = module.read(True)
+        clockbase = float(self.zurich.get_node('/{}/clockbase'.format(self.zurich.info['device']), int))
+        chunks = data.get(self.path(self.signal), [])
+        if not chunks:
+            return np.zeros(0), np.zeros(0)
+        values = np.concatenate([np.ravel(chunk['value']) for chunk in chunks])
+        ticks = np.concatenate([np.ravel(chunk['timestamp']) for chunk in chunks])
+        keep = np.isfinite(values)
+        return ticks[keep].astype(np.float64)/clockbase, values[keep]
+
+    def close(self):
+        if self.module is not None:
+            self.module.finish()
+            self.module.clear()
+            self.module = None
+
+    def sweep(self, stage, start, stop, velocity, points, margin=0.2, track_period=0.005):
+        """
+        Move the stage from start to stop at constant velocity while the grid
+        is recorded, and return the samples with the position of the stage at
+        the time they were measured.
+
+        Parameters:
+            stage : LinearStage (or object with go_2position, get_position,
+            set_velocity and, unless the trigger is continuous,
+            motion_trigger) doing the sweep.
+            start/stop : Limits of the sweep in mm.
+            velocity : Velocity of the sweep in mm/s.
+            points : Number of columns of the grid.
+            margin : Time in seconds added to the travel time for the
+            acceleration of the stage.
+            track_period : Time in seconds between two reads of the position
+            during the motion.
+
+        Returns:
+            Tuple of arrays (position, value, host time) of the samples
+            measured while the stage was moving.
+        """
+        stage.go_2position(start)
+        stage.set_velocity(velocity)
+        triggered = self.trigger != 'continuous'
+        if triggered:
+            # The controller raises its output when the sweep starts
+            stage.motion_trigger(self.trigger_line)
+        try:
+            return self._sweep(stage, start, stop, velocity, points, margin, track_period)
+        finally:
+            if triggered:
+                stage.motion_trigger(self.trigger_line, enable=False)
+
+    def _sweep(self, stage, start, stop, velocity, points, margin, track_period):
+        # Sweep with the trigger output of the stage configured
+        self.arm(abs(stop - start)/velocity + margin, points)
+        offset = self.clock_offset()
+
+        # The move blocks until the stage is on target, the positions are read
+        # meanwhile with the host time of the middle of each query
+        failure = []
+
+        def move():
+            try:
+                stage.go_2position(stop)
+            except Exception as error:
+                failure.append(error)
+        mover = threading.Thread(target=move, name='Fly scan move', daemon=True)
+        before = time.perf_counter()
+        track_pos = [stage.get_position()]
+        begin = time.perf_counter()
+        track_time = [(before + begin)/2]
+        mover.start()
+        while mover.is_alive():
+            before = time.perf_counter()
+            position = stage.get_position()
+            track_time.append((before + time.perf_counter())/2)
+            track_pos.append(position)
+            # Bounded rate of the queries so the on target polling of the
+            # move is not delayed, the wait ends with the move
+            mover.join(max(0.0, track_period - (time.perf_counter() - before)))
+        if failure:
+            raise failure[0]
+        track_time.append(time.perf_counter())
+        track_pos.append(stage.get_position())
+
+        device_time, value = self.read()
+        host_time = device_time + offset
+        inside = (host_time >= track_time[0]) & (host_time <= track_time[-1])
+        host_time = host_time[inside]
+        position = np.interp(host_time, track_time, track_pos)
+        return position, value[inside], host_time
 
 
 class Scope:
@@ -295,6 +1019,15 @@ class Scope:
         self.axes = axes
         self.fig = fig
         self.zurich = zurich
+        # Time axis in us for every (dt, length) received
+        self.time_axes = {}
+        # Display options, the averaging over shots is done here on the
+        # computer, the device only provides the segmented recording
+        self.averages = 1
+        self.persistence = False
+        self.persistence_lines = []
+        self.segments = 1
+        self.history = None
 
     def enable_scope(self, scope, variable):
         if not self.zurich.info:
@@ -316,8 +1049,7 @@ class Scope:
         # This assigned path is now allowed to be plotted. The Zurich instrument can now subscribe a designed path
 
         self.zurich.paths[self.path.format(device, scope)] = True
-        self.zurich.info['daq'].set(setting)
-        self.zurich.info['daq'].sync()
+        self.zurich.set_nodes(setting)
 
     def enable_trigger(self, scope, trigger, variable_):
         if not self.zurich.info:
@@ -357,8 +1089,48 @@ class Scope:
         # I need to learn more about the external ref format
         Trig_Settings.append(['/{}/extrefs/{}/enable' .format(device, 0), 1])
 
-        self.zurich.info['daq'].set(Trig_Settings)
-        self.zurich.info['daq'].sync()
+        self.zurich.set_nodes(Trig_Settings)
+
+    def time_axis(self, dt, length):
+        """Return the time axis in us of a shot, computed once per (dt, length)."""
+        key = (dt, length)
+        if key not in self.time_axes:
+            self.time_axes[key] = 1e6*np.linspace(0, dt*length, length)
+        return self.time_axes[key]
+
+    def set_averaging(self, variable):
+        """Set the number of shots averaged for the display from a tkinter variable."""
+        try:
+            self.averages = max(1, int(variable.get()))
+        except (ValueError, tk.TclError):
+            variable.set(self.averages)
+
+    def set_persistence(self, variable):
+        """Display the previous shots in the background when variable is 'enable'."""
+        self.persistence = variable.get() == 'enable'
+        if not self.persistence:
+            for line in self.persistence_lines:
+                line.remove()
+            self.persistence_lines = []
+
+    def set_segments(self, scope, variable):
+        """
+        Record variable segments per shot with the segmented mode of the
+        scope, every segment is then handled as a shot. 1 disables it.
+        """
+        if not self.zurich.info:
+            messagebox.showinfo(title='Error', message='There is no device connected')
+            return
+        try:
+            count = max(1, int(variable.get()))
+        except (ValueError, tk.TclError):
+            variable.set(self.segments)
+            return
+        device = self.zurich.info['device']
+        self.zurich.set_nodes([['/{}/scopes/{}/segments/enable'.format(device, scope), int(count > 1)],
+                               ['/{}/scopes/{}/segments/count'.format(device, scope), count]])
+        self.segments = count
+        self.history = None
 
     def extract_data(self, data, path):
         if not(self.zurich.paths[path]):
@@ -368,19 +1140,42 @@ class Scope:
         except KeyError:
             print('we avoided trouble')
             return
-        # This takes the wave data stored in the daq and push them into the  it in the assigned figure
-        scope_data = data[path]
-        for index, shot in enumerate(scope_data):
-            Nb_Smple = shot['totalsamples']
-            time = np.linspace(0, shot['dt'] * Nb_Smple, Nb_Smple)
-            # Scope Input channel is 0 but we can add up to 3 if im correct
-            wave = shot['channeloffset'][0] + shot['channelscaling'][0] * shot['wave'][:, 0]
-            self.axes.set_ylim([min(wave) - abs(min(wave) * 15 / 100), max(wave) + max(wave) * 15 / 100])
-            self.axes.set_xlim(
-                [min(1e6 * time) - abs(min(1e6 * time) * 15 / 100), max(1e6 * time) + max(1e6 * time) * 15 / 100])
-            if (not shot['flags']) and (len(wave) == Nb_Smple):
-                self.line.set_xdata(1e6 * time)
-                self.line.set_ydata(wave)
+        # Only the complete shots with the length of the last one are kept
+        shots = [shot for shot in scope_data
+                 if (not shot['flags']) and len(shot['wave']) == shot['totalsamples']]
+        if not shots:
+            return
+        length = shots[-1]['totalsamples']
+        shots = [shot for shot in shots if shot['totalsamples'] == length]
+        # Scope Input channel is 0 but we can add up to 3 if im correct
+        offsets = np.array([shot['channeloffset'][0] for shot in shots])[:, np.newaxis]
+        scalings = np.array([shot['channelscaling'][0] for shot in shots])[:, np.newaxis]
+        waves = offsets + scalings*np.stack([shot['wave'][:, 0] for shot in shots])
+        if self.segments > 1 and length % self.segments == 0:
+            length = length//self.segments
+            waves = waves.reshape(-1, length)
+        time = self.time_axis(shots[-1]['dt'], length)
+        # Shots kept for the averaging and the persistence
+        keep = max(self.averages, 10 if self.persistence else 1)
+        if self.history is None or self.history.shape[1] != length:
+            self.history = waves[-keep:]
+        else:
+            self.history = np.concatenate((self.history, waves))[-keep:]
+        wave = self.history[-self.averages:].mean(axis=0)
+        shown = wave
+        if self.persistence:
+            previous = self.history[:-1]
+            while len(self.persistence_lines) < len(previous):
+                self.persistence_lines.append(self.axes.plot([], [], color=self.line.get_color(), alpha=0.2)[0])
+            for line, old in zip(self.persistence_lines, previous):
+                line.set_xdata(time)
+                line.set_ydata(old)
+            shown = self.history
+        ymin, ymax = np.min(shown), np.max(shown)
+        self.axes.set_ylim([ymin - abs(ymin * 15 / 100), ymax + ymax * 15 / 100])
+        self.axes.set_xlim([time[0] - abs(time[0] * 15 / 100), time[-1] + time[-1] * 15 / 100])
+        self.line.set_xdata(time)
+        self.line.set_ydata(wave)
 
 
 class Plotter:
@@ -533,8 +1328,13 @@ class Boxcar:
                         ['/%s/boxcars/%d/periods' % (device, boxcar_index), 1],
                         ['/%s/boxcars/%d/enable' % (device, boxcar_index), value],
                         ]
-        self.zurich.info['daq'].set(BOX_Settings)
-        self.zurich.info['daq'].sync()
+        self.zurich.set_nodes(BOX_Settings)
+        # The frequency is used for every frame, follow it by subscription
+        # while the boxcar is enabled
+        if value:
+            self.zurich.watch_nodes(['/{}/oscs/{}/freq'.format(device, 0)])
+        else:
+            self.zurich.unwatch_nodes(['/{}/oscs/{}/freq'.format(device, 0)])
         self.zurich.paths[self.path1.format(device, inputpwa_index)] = True
         self.zurich.paths[self.path2.format(device, boxcar_index)] = True
 
@@ -543,7 +1343,7 @@ class Boxcar:
             messagebox.showinfo(title='Error', message='There is no device connected')
             return
         if not self.frequency:
-            self.frequency = self.zurich.info['daq'].getDouble('/{}/oscs/{}/freq'.format(self.zurich.info['device'], 0))
+            self.frequency = self.zurich.get_node('/{}/oscs/{}/freq'.format(self.zurich.info['device'], 0))
         current = variable.current()
         if current == 0:
             self.line_list[0].x = self.line_list[0].x/self.xfactor
@@ -561,7 +1361,7 @@ class Boxcar:
             self.line_list[1].x = self.line_list[1].x*self.xfactor
 
     def refresh(self, path):
-        frequency_set = self.zurich.info['daq'].getDouble('/{}/oscs/{}/freq'.format(self.zurich.info['device'], 0))
+        frequency_set = self.zurich.get_node('/{}/oscs/{}/freq'.format(self.zurich.info['device'], 0))
         factor2 = 360/(2*np.pi*self.xfactor)
         self.window_start = min(self.line_list[0].x, self.line_list[1].x)*factor2
         self.window_length = abs(self.line_list[0].x - self.line_list[1].x)*factor2
@@ -569,15 +1369,14 @@ class Boxcar:
         self.zurich.info['daq'].unsubscribe(path)
         boxwindow = [['/%s/boxcars/%d/windowstart' % (self.zurich.info['device'], 0), self.window_start],
                      ['/%s/boxcars/%d/windowsize' % (self.zurich.info['device'], 0), self.window_length]]
-        self.zurich.info['daq'].set(boxwindow)
-        self.zurich.info['daq'].sync()
+        self.zurich.set_nodes(boxwindow)
         self.zurich.info['daq'].subscribe(path)
 
     def extract_data(self, data=None, path=None):
         if not(self.zurich.paths[path]):
             return
 
-        frequency = self.zurich.info['daq'].getDouble('/{}/oscs/{}/freq'.format(self.zurich.info['device'], 0))
+        frequency = self.zurich.get_node('/{}/oscs/{}/freq'.format(self.zurich.info['device'], 0))
         if self.ugraph == 'time':
             if (not (self.window_start != (min(self.line_list[0].x,
                                               self.line_list[1].x)*frequency/self.xfactor)*360/(2*np.pi)) or not (
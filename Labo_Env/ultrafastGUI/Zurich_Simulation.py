@@ -0,0 +1,322 @@
+"""
+Local stand-in for the Zurich Instruments data server.
+
+SimulatedDAQServer implements the part of the zhinst ziDAQServer API used by
+Zurich_Instrument and the experiments (set, sync, getInt, getDouble,
+subscribe, unsubscribe, poll, listNodes and dataAcquisitionModule) and
+generates demodulator, scope and boxcar data in real time. It can be given to
+Zurich.attach, or selected by connecting to the device 'simulated', to work
+on the program and run the benchmarks without the instrument.
+"""
+from fnmatch import fnmatch
+import time
+import numpy as np
+
+
+def _sleep(duration):
+    if duration > 0:
+        time.sleep(duration)
+
+
+class SimulatedDAQServer:
+    """
+    Simulated data server with one UHFLI. The device time starts at the
+    creation of the object and follows time.perf_counter(), so the data
+    returned by poll is continuous from one poll to the next like the data
+    of a subscribed node.
+
+    Attributes:
+        device : Name of the simulated device, ie dev0000.
+        props : Dictionary of the discovery properties of the device.
+        default_mixer_channel : Output mixer channel of the device type.
+        nodes : Dictionary of {lower case node path: value}.
+        subscribed : Dictionary of {path: device time of the last data sent}.
+        sample_rate : Default rate of the demodulators in Sa/s.
+        noise : Standard deviation of the noise added to the signals in V.
+        latency : Time in seconds taken by every node access.
+        subscribe_latency : Time in seconds taken by subscribe/unsubscribe.
+        poll_overhead : Time in seconds added to the length of every poll.
+        scope_rate : Number of scope shots per second.
+        signal : Function of the host time (time.perf_counter()) returning
+        the complex value measured by the demodulators, a constant by default.
+        clockbase : Clock of the device in Hz.
+        calls : Number of calls made to the server.
+    """
+    def __init__(self, device='dev0000', sample_rate=1717.0, noise=1e-4, latency=0.0,
+                 subscribe_latency=0.0, poll_overhead=0.0, scope_rate=10.0, signal=None):
+        self.device = device.lower()
+        self.props = {'deviceid': self.device, 'devicetype': 'UHFLI', 'options': ['BOX', 'DIG'],
+                      'serveraddress': 'localhost', 'serverport': 8004, 'apilevel': 6,
+                      'discoverable': True}
+        self.default_mixer_channel = 3
+        self.sample_rate = sample_rate
+        self.noise = noise
+        self.latency = latency
+        self.subscribe_latency = subscribe_latency
+        self.poll_overhead = poll_overhead
+        self.scope_rate = scope_rate
+        self.signal = signal if signal is not None else (lambda t: 1e-3 + 0j)
+        self.clockbase = 1.8e9
+        self.start = time.perf_counter()
+        self.calls = 0
+        self.subscribed = {}
+        self.emitted_values = {}
+        self.nodes = {}
+        prefix = '/' + self.device
+        self.nodes[prefix + '/clockbase'] = int(self.clockbase)
+        self.nodes[prefix + '/oscs/0/freq'] = 1e5
+        for index in range(8):
+            demod = '{}/demods/{}/'.format(prefix, index)
+            self.nodes.update({demod + 'enable': 0, demod + 'rate': sample_rate,
+                               demod + 'timeconstant': 1e-3, demod + 'order': 3,
+                               demod + 'oscselect': 0, demod + 'adcselect': 0,
+                               demod + 'harmonic': 1, demod + 'phaseshift': 0.0,
+                               demod + 'trigger': 0})
+        for index in range(2):
+            scope = '{}/scopes/{}/'.format(prefix, index)
+            self.nodes.update({scope + 'enable': 0, scope + 'length': 4096, scope + 'time': 0,
+                               scope + 'channel': 1, scope + 'segments/enable': 0,
+                               scope + 'segments/count': 1, scope + 'trigenable': 0})
+            box = '{}/boxcars/{}/'.format(prefix, index)
+            self.nodes.update({box + 'enable': 0, box + 'windowstart': 0.0,
+                               box + 'windowsize': 1e-7, box + 'periods': 1})
+            pwa = '{}/inputpwas/{}/'.format(prefix, index)
+            self.nodes.update({pwa + 'enable': 0, pwa + 'mode': 1, pwa + 'shift': 0.0})
+            self.nodes['{}/sigouts/{}/on'.format(prefix, index)] = 0
+            self.nodes['{}/sigins/{}/range'.format(prefix, index)] = 1.0
+
+    # Time
+    def device_time(self):
+        """Return the time of the device in seconds."""
+        return time.perf_counter() - self.start
+
+    def host_time(self, device_time):
+        """Convert device times in seconds to time.perf_counter() values."""
+        return device_time + self.start
+
+    def _access(self, duration):
+        self.calls += 1
+        _sleep(duration)
+
+    # Nodes
+    def getDouble(self, path):
+        self._access(self.latency)
+        return float(self.nodes.get(path.lower(), 0.0))
+
+    def getInt(self, path):
+        self._access(self.latency)
+        path = path.lower()
+        if path == '/{}/status/time'.format(self.device):
+            return int(self.device_time()*self.clockbase)
+        return int(self.nodes.get(path, 0))
+
+    def set(self, settings):
+        self._access(self.latency)
+        for path, value in settings:
+            path = path.lower()
+            if '*' in path:
+                for node in [node for node in self.nodes if fnmatch(node, path)]:
+                    self.nodes[node] = value
+            else:
+                self.nodes[path] = value
+
+    def sync(self):
+        self._access(self.latency)
+
+    def listNodes(self, path, flags=0):
+        path = path.lower()
+        return sorted(node.upper() for node in self.nodes if node.startswith(path))
+
+    def subscribe(self, path):
+        self._access(self.subscribe_latency)
+        path = path.lower()
+        # The server only sends what is measured after the subscription
+        self.subscribed[path] = self.device_time()
+        self.emitted_values.pop(path, None)
+
+    def unsubscribe(self, path):
+        self._access(self.subscribe_latency)
+        path = path.lower()
+        for element in list(self.subscribed):
+            if fnmatch(element, path):
+                del self.subscribed[element]
+
+    # Data
+    def demod_values(self, device_time, index=0):
+        """
+        Return the complex values of the demodulator index at the device
+        times given, the signal plus noise.
+        """
+        signal = np.broadcast_to(np.asarray(self.signal(self.host_time(device_time)), dtype=complex),
+                                 device_time.shape)
+        noise = self.noise*(np.random.randn(device_time.size) + 1j*np.random.randn(device_time.size))
+        return signal + noise
+
+    def _times(self, path, rate, now):
+        # Sample times between the last data sent and now at the given rate
+        last = self.subscribed[path]
+        count = int((now - last)*rate)
+        if count <= 0:
+            return np.zeros(0)
+        times = last + np.arange(1, count + 1)/rate
+        self.subscribed[path] = times[-1]
+        return times
+
+    def _demod(self, path, index, now):
+        rate = float(self.nodes.get('/{}/demods/{}/rate'.format(self.device, index), self.sample_rate))
+        times = self._times(path, rate, now)
+        if not times.size:
+            return None
+        values = self.demod_values(times, index)
+        frequency = float(self.nodes.get('/{}/oscs/0/freq'.format(self.device), 0.0))
+        return {'timestamp': (times*self.clockbase).astype(np.uint64),
+                'x': values.real, 'y': values.imag,
+                'frequency': np.full(times.size, frequency),
+                'phase': np.zeros(times.size),
+                'dio': np.zeros(times.size, dtype=np.uint32),
+                'trigger': np.zeros(times.size, dtype=np.uint32),
+                'auxin0': np.zeros(times.size), 'auxin1': np.zeros(times.size)}
+
+    def _scope(self, path, index, now):
+        times = self._times(path, self.scope_rate, now)
+        if not times.size:
+            return None
+        scope = '/{}/scopes/{}/'.format(self.device, index)
+        length = int(self.nodes.get(scope + 'length', 4096))
+        if int(self.nodes.get(scope + 'segments/enable', 0)):
+            length *= max(1, int(self.nodes.get(scope + 'segments/count', 1)))
+        dt = 2**int(self.nodes.get(scope + 'time', 0))/self.clockbase
+        frequency = float(self.nodes.get('/{}/oscs/0/freq'.format(self.device), 1e5))
+        amplitude = np.abs(self.demod_values(times))
+        axis = np.arange(length)*dt
+        shots = []
+        for shot_time, shot_amplitude in zip(times[-16:], amplitude[-16:]):
+            wave = shot_amplitude*np.sin(2*np.pi*frequency*axis) + self.noise*np.random.randn(length)
+            shots.append({'timestamp': int(shot_time*self.clockbase), 'wave': wave[:, np.newaxis],
+                          'totalsamples': length, 'dt': dt, 'flags': 0,
+                          'channeloffset': [0.0], 'channelscaling': [1.0]})
+        return shots
+
+    def _boxcar(self, path, index, kind, now):
+        if kind == 'wave':
+            # One averaged pulse shape per poll
+            self.subscribed[path] = now
+            phase = np.linspace(0, 2*np.pi, 1024, endpoint=False)
+            amplitude = np.abs(self.demod_values(np.array([now]))[0])
+            x = amplitude*np.exp(-((phase - np.pi)/0.2)**2) + self.noise*np.random.randn(phase.size)
+            return [{'timestamp': int(now*self.clockbase), 'x': x, 'y': np.zeros(phase.size),
+                     'binphase': phase}]
+        times = self._times(path, self.sample_rate, now)
+        if not times.size:
+            return None
+        if kind == 'periods':
+            values = np.full(times.size, float(self.nodes.get('/{}/boxcars/{}/periods'.format(self.device, index), 1)))
+        else:
+            values = np.abs(self.demod_values(times, index))
+        return {'timestamp': (times*self.clockbase).astype(np.uint64), 'value': values}
+
+    def _node_value(self, path, now):
+        # Nodes are sent when their value changes
+        if path not in self.nodes:
+            return None
+        value = self.nodes[path]
+        if path in self.emitted_values and self.emitted_values[path] == value:
+            return None
+        self.emitted_values[path] = value
+        return {'timestamp': np.array([int(now*self.clockbase)], dtype=np.uint64),
+                'value': np.array([value])}
+
+    def poll(self, length, timeout=0, flags=0, flat=True):
+        """
+        Wait length seconds and return the data measured on the subscribed
+        paths since the last poll, as a flat dictionary of {path: data}.
+        """
+        self._access(length + self.poll_overhead)
+        now = self.device_time()
+        data = {}
+        for path in list(self.subscribed):
+            parts = path.strip('/').split('/')
+            if len(parts) == 4 and parts[1] == 'demods' and parts[3] == 'sample':
+                value = self._demod(path, int(parts[2]), now)
+            elif len(parts) == 4 and parts[1] == 'scopes' and parts[3] == 'wave':
+                value = self._scope(path, int(parts[2]), now)
+            elif len(parts) == 4 and parts[1] in ('boxcars', 'inputpwas'):
+                kind = 'wave' if parts[1] == 'inputpwas' else parts[3]
+                value = self._boxcar(path, int(parts[2]), kind, now)
+            else:
+                value = self._node_value(path, now)
+            if value is not None:
+                data[path] = value
+        return data
+
+    def dataAcquisitionModule(self):
+        return SimulatedDataAcquisitionModule(self)
+
+
+class SimulatedDataAcquisitionModule:
+    """
+    Simulated DataAcquisitionModule recording one grid of demodulator
+    samples. The triggers are considered to happen as soon as the module is
+    executed.
+
+    Attributes:
+        daq : SimulatedDAQServer of the module.
+        parameters : Dictionary of the parameters set.
+        signals : List of the subscribed paths, ie /dev0000/demods/0/sample.x.
+        started : Device time of the execution, None before.
+    """
+    def __init__(self, daq):
+        self.daq = daq
+        self.parameters = {'grid/cols': 100, 'grid/rows': 1, 'duration': 0.1}
+        self.signals = []
+        self.started = None
+
+    def set(self, name, value):
+        self.parameters[name] = value
+
+    def get(self, name):
+        return self.parameters.get(name)
+
+    def subscribe(self, path):
+        self.signals.append(path.lower())
+
+    def unsubscribe(self, path):
+        self.signals = [signal for signal in self.signals if not fnmatch(signal, path.lower())]
+
+    def execute(self):
+        self.started = self.daq.device_time()
+
+    def progress(self):
+        if self.started is None:
+            return 0.0
+        return min(1.0, (self.daq.device_time() - self.started)/self.parameters['duration'])
+
+    def finished(self):
+        return self.started is None or self.progress() >= 1.0
+
+    def finish(self):
+        pass
+
+    def clear(self):
+        self.started = None
+        self.signals = []
+
+    def read(self, flat=True):
+        if self.started is None:
+            return {}
+        rows = int(self.parameters['grid/rows'])
+        cols = int(self.parameters['grid/cols'])
+        duration = float(self.parameters['duration'])
+        # Only the part of the grid already measured is filled
+        times = self.started + np.arange(rows*cols).reshape(rows, cols)*duration/cols
+        measured = times <= self.daq.device_time()
+        data = {}
+        for signal in self.signals:
+            node, _, component = signal.rpartition('.')
+            index = int(node.split('/')[3])
+            values = self.daq.demod_values(times.ravel(), index).reshape(rows, cols)
+            value = {'x': values.real, 'y': values.imag, 'r': np.abs(values),
+                     'theta': np.angle(values)}.get(component, values.real)
+            value = np.where(measured, value, np.nan)
+            data[signal] = [{'value': value, 'timestamp': (times*self.daq.clockbase).astype(np.uint64)}]
+        return data
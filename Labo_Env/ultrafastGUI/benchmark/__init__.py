@@ -0,0 +1,14 @@
+"""
+Scan-throughput benchmark suite for the ultrafastGUI experiments.
+
+The recipes in this package run the steps of the FROG, TwoDSI, PumpProbe,
+Electro Optic Sampling and batchSpectra scans, shared with the experiments in
+Scan_Steps, against the LinearStage on a simulated controller and simulated
+instruments so the acquisition overhead can be measured without hardware. Run it from the ultrafastGUI folder with:
+
+    python -m benchmark --help
+"""
+from benchmark.simulated import (DEFAULT_LATENCIES, SimulatedSpectrometer, SimulatedZurich,
+                                 close_stage, connect_stage)
+from benchmark.runner import PhaseTimer, peak_rss, run_recipe, save_results
+from benchmark.recipes import RECIPES
@@ -0,0 +1,64 @@
+"""
+Command line interface of the benchmark suite.
+
+Example, from the ultrafastGUI folder:
+    python -m benchmark frog eos --steps 200 --latency integration_time=0.002
+"""
+import argparse
+
+from benchmark.simulated import DEFAULT_LATENCIES
+from benchmark.runner import run_recipe, save_results
+from benchmark.recipes import RECIPES
+
+
+def parse_latency(text):
+    """Parse a name=value latency override."""
+    name, _, value = text.partition('=')
+    if name not in DEFAULT_LATENCIES:
+        raise argparse.ArgumentTypeError('Unknown latency {!r}, choose among {}'
+                                         .format(name, ', '.join(DEFAULT_LATENCIES)))
+    try:
+        return name, float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Latency {!r} needs a number'.format(name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark',
+                                     description='Scan-throughput benchmark with simulated instruments.')
+    parser.add_argument('recipes', nargs='*', metavar='recipe',
+                        help='Recipes to run among {}, all of them by default.'.format(', '.join(RECIPES)))
+    parser.add_argument('--steps', type=int, default=100,
+                        help='Number of scan points (or spectra) per recipe.')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of repetitions of every recipe.')
+    parser.add_argument('--latency', type=parse_latency, action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='Override one of the simulated latencies (s): ' +
+                             ', '.join(DEFAULT_LATENCIES))
+    parser.add_argument('--output', default=None,
+                        help='Json file for the results, benchmark_<commit>_<time>.json by default.')
+    parser.add_argument('--no-save', action='store_true', help='Only print the results.')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.recipes if name not in RECIPES]
+    if unknown:
+        parser.error('unknown recipe(s): {}'.format(', '.join(unknown)))
+
+    latencies = dict(args.latency)
+    results = []
+    for name in args.recipes or list(RECIPES):
+        result = run_recipe(name, steps=args.steps, latencies=latencies, repeat=args.repeat)
+        results.append(result)
+        rss = result['peak_rss_bytes']
+        print('{:<13} {:8.1f} steps/s   dead time {:5.1%}   peak RSS {}'.format(
+            name, result['steps_per_s'], result['dead_time_fraction'],
+            '{:.1f} MB'.format(rss/2**20) if rss else 'n/a'))
+        for phase, timing in result['phases'].items():
+            print('    {:<13} {:8.3f} s  {:6d} calls  {:8.3f} ms/call'.format(
+                phase, timing['total_s'], timing['calls'], 1000*timing['mean_s']))
+    if not args.no_save:
+        print('Results saved in {}'.format(save_results(results, args.output)))
+
+
+if __name__ == '__main__':
+    main()
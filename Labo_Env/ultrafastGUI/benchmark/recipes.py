@@ -0,0 +1,161 @@
+"""
+Representative inner loops of the experiments in Experiment_file.
+
+The recipes run the steps of the scans with the functions of Scan_Steps that
+the experiments call, without the tkinter widgets and graphics, so the time
+spent outside of the acquisition can be measured. Every recipe takes the
+LinearStage, the simulated spectrometer and lock-in, a PhaseTimer and the
+number of steps, and returns the number of steps done.
+"""
+import tempfile
+import time
+import numpy as np
+
+import Scan_Steps
+from Zurich_Instrument import SETTLING_FACTORS
+
+
+def frog(stage, spectro, zurich, timer, steps):
+    """Loop of FROG.start_experiment, positions in mm."""
+    move = np.linspace(0, 0.1, steps)
+    pos = np.zeros(steps)
+    Si = np.zeros(steps)
+    wl = spectro.spectro.wavelengths()
+    minwl, maxwl = 700, 900
+    trace = np.zeros((steps, wl[(wl > minwl) & (wl < maxwl)].shape[0]))
+    for i in range(steps):
+        pos[i], wl, S = Scan_Steps.spectrum_step(stage, spectro, move[i], timer)
+        trace[i], Si[i] = Scan_Steps.crop_spectrum(wl, S, minwl, maxwl, timer)
+    return steps
+
+
+def twodsi(stage, spectro, zurich, timer, steps):
+    """Loop of TwoDSI.start_experiment, positions in mm."""
+    move = np.linspace(0, 0.05, steps)
+    pos = np.zeros(steps)
+    Si = np.zeros(steps)
+    wl = spectro.spectro.wavelengths()
+    minwl, maxwl = 500, 1000
+    trace = np.zeros((steps, wl[(wl > minwl) & (wl < maxwl)].shape[0]))
+    for i in range(steps):
+        pos[i], wl, S = Scan_Steps.spectrum_step(stage, spectro, move[i], timer)
+        trace[i], Si[i] = Scan_Steps.crop_spectrum(wl, S, minwl, maxwl, timer)
+    return steps
+
+
+def pumpprobe(stage, spectro, zurich, timer, steps, int_period=0.03):
+    """Loop of PumpProbe.start_experiment with its velocity changes."""
+    move = np.linspace(0.001, 2, steps)
+    with timer.phase('velocity'):
+        stage.set_velocity(vel=20)
+    with timer.phase('move'):
+        stage.go_2position(move[0] - 0.001)
+    with timer.phase('velocity'):
+        stage.set_velocity(vel=2)
+    pos = np.zeros(steps)
+    data_dict = {}
+    for i in range(steps):
+        pos[i], spectra_pos = Scan_Steps.spectra_step(stage, spectro, move[i], int_period, timer)
+        data_dict['pos_{}'.format(i)] = spectra_pos[:, 670:1679]
+    return steps
+
+
+def _subscribed_acquire(zurich):
+    """
+    Zurich_acquire of Electro_Optic_Sampling before the demodulator stream:
+    settling wait, then subscribe, poll and unsubscribe at every step. Kept
+    as the reference of the eos_stream recipe.
+    """
+    daq = zurich.info['daq']
+    device = zurich.info['device']
+    path = '/{}/demods/0/sample'.format(device)
+    tc = daq.getDouble('/{}/demods/0/timeconstant'.format(device))
+    order = int(daq.getDouble('/{}/demods/0/order'.format(device)))
+    time.sleep(SETTLING_FACTORS[order]*tc)
+    daq.subscribe(path)
+    data_set = daq.poll(0.01, 100, 0, True)
+    daq.unsubscribe(path)
+    return data_set[path]['x']
+
+
+def _lockin_scan(stage, acquire, timer, steps):
+    """Loop of Electro_Optic_Sampling.start_experiment with acquire as Zurich_acquire."""
+    move = np.linspace(0, 2, steps)
+    pos = np.zeros(steps)
+    S = np.zeros(steps)
+    t = np.zeros(steps)
+    for i in range(steps):
+        pos[i], S[i] = Scan_Steps.lockin_step(stage, acquire, move[i], timer)
+        with timer.phase('process'):
+            t[i] = stage.stage_calibration.to_delay(pos[i], zero=pos[0])
+    return steps
+
+
+def eos(stage, spectro, zurich, timer, steps):
+    """
+    Loop of Electro_Optic_Sampling.start_experiment with the settling wait,
+    subscribing, polling and unsubscribing the demodulator at every step.
+    """
+    return _lockin_scan(stage, lambda: _subscribed_acquire(zurich), timer, steps)
+
+
+def eos_stream(stage, spectro, zurich, timer, steps):
+    """
+    Loop of Electro_Optic_Sampling.start_experiment with the settling wait,
+    run through Zurich_Instrument.Zurich on its persistent demodulator stream.
+    """
+    from Zurich_Instrument import Zurich
+    lockin = Zurich()
+    with timer.phase('lockin_setup'):
+        lockin.attach(zurich.info['daq'], zurich.info['device'], zurich.info['prop'])
+        lockin.demod_stream(0)
+    try:
+        return _lockin_scan(stage, lambda: Scan_Steps.lockin_acquire(lockin, stage, settle=True),
+                            timer, steps)
+    finally:
+        lockin.stop_stream(0)
+
+
+def eos_fly(stage, spectro, zurich, timer, steps, velocity=2.0):
+    """Fly scan of Electro_Optic_Sampling, steps is the number of grid points."""
+    from Zurich_Instrument import Zurich, FlyScan
+    lockin = Zurich()
+    with timer.phase('lockin_setup'):
+        lockin.attach(zurich.info['daq'], zurich.info['device'], zurich.info['prop'])
+        recorder = FlyScan(lockin)
+    try:
+        with timer.phase('acquire'):
+            pos, S, _ = recorder.sweep(stage, 0, 2, velocity, steps)
+    finally:
+        recorder.close()
+    with timer.phase('process'):
+        order = np.argsort(pos)
+        t = stage.stage_calibration.to_delay(pos[order], zero=pos[order][0])
+        S = S[order]*1000
+    return steps
+
+
+def batch_spectra(stage, spectro, zurich, timer, steps, spectra_per_file=50):
+    """Loop of batchSpectra.start_experiment, steps is the number of spectra."""
+    wl = spectro.spectro.wavelengths()
+    with tempfile.TemporaryDirectory() as folder:
+        done = 0
+        file_number = 0
+        while done < steps:
+            shape = (min(spectra_per_file, steps - done), len(wl))
+            Scan_Steps.save_spectra(spectro, shape, '{}/spectra - {}.npy'.format(folder, file_number),
+                                    timer)
+            done += shape[0]
+            file_number += 1
+    return steps
+
+
+RECIPES = {
+    'frog': frog,
+    'twodsi': twodsi,
+    'pumpprobe': pumpprobe,
+    'eos': eos,
+    'eos_stream': eos_stream,
+    'eos_fly': eos_fly,
+    'batchspectra': batch_spectra,
+}
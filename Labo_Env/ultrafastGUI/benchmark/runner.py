@@ -0,0 +1,144 @@
+"""
+Timing helpers and result bookkeeping for the benchmark recipes.
+"""
+import json
+import platform
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from benchmark.simulated import (DEFAULT_LATENCIES, SimulatedSpectrometer, SimulatedZurich,
+                                 close_stage, connect_stage)
+
+
+# Phases counted as useful acquisition time for the dead-time fraction
+ACQUISITION_PHASES = ('acquire',)
+
+
+class PhaseTimer:
+    """
+    Accumulates the wall time spent in the different phases of a scan.
+
+    Attributes:
+        phases : Dictionary of {phase: [total time, number of calls]}.
+    """
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = self.phases.setdefault(name, [0.0, 0])
+            total[0] += time.perf_counter() - start
+            total[1] += 1
+
+    def summary(self):
+        """Return the phases as a dictionary that can be saved in json."""
+        return {name: {'total_s': value[0], 'calls': value[1],
+                       'mean_s': value[0]/value[1] if value[1] else 0.0}
+                for name, value in self.phases.items()}
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the process in bytes, or None when
+    it cannot be measured on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak if platform.system() == 'Darwin' else peak*1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss)
+
+
+def git_commit():
+    """Return the hash of the commit checked out, or '' outside of git."""
+    try:
+        return (subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                               cwd=Path(__file__).resolve().parent)
+                .stdout.strip().decode())
+    except OSError:
+        return ''
+
+
+def run_recipe(name, steps=100, latencies=None, repeat=1):
+    """
+    Run one of the recipes against new simulated instruments, the stage
+    being a LinearStage connected to a simulated controller.
+
+    Parameters:
+        name : Key of the recipe in benchmark.recipes.RECIPES.
+        steps : Number of scan points (or spectra) of the recipe.
+        latencies : Dictionary overriding some of DEFAULT_LATENCIES.
+        repeat : Number of times the recipe is repeated.
+
+    Returns:
+        Dictionary with the throughput, dead-time fraction, peak RSS and
+        per-phase timings of the run.
+    """
+    from benchmark.recipes import RECIPES
+    latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+    timer = PhaseTimer()
+    done = 0
+    elapsed = 0.0
+    for _ in range(repeat):
+        stage = connect_stage(latencies)
+        spectro = SimulatedSpectrometer(latencies)
+        zurich = SimulatedZurich(latencies)
+        # The connection of the stage is not counted in the scan time
+        start = time.perf_counter()
+        try:
+            done += RECIPES[name](stage, spectro, zurich, timer, steps)
+        finally:
+            elapsed += time.perf_counter() - start
+            close_stage(stage)
+    acquiring = sum(timer.phases.get(phase, [0.0])[0] for phase in ACQUISITION_PHASES)
+    return {'recipe': name,
+            'steps': done,
+            'elapsed_s': elapsed,
+            'steps_per_s': done/elapsed if elapsed else 0.0,
+            'dead_time_fraction': 1 - acquiring/elapsed if elapsed else 0.0,
+            'peak_rss_bytes': peak_rss(),
+            'phases': timer.summary(),
+            'latencies': latencies}
+
+
+def save_results(results, path=None):
+    """
+    Save the results of a benchmark session as json along with the commit
+    and the platform so runs can be compared across commits.
+
+    Parameters:
+        results : List of dictionaries returned by run_recipe.
+        path : File to write, by default benchmark_<commit>_<time>.json in
+        the current folder.
+
+    Returns:
+        Path of the file written.
+    """
+    commit = git_commit()
+    if path is None:
+        path = 'benchmark_{}_{}.json'.format(commit[:8] or 'nogit',
+                                             time.strftime('%Y%m%d-%H%M%S'))
+    document = {'commit': commit,
+                'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'results': results}
+    path = Path(path)
+    with open(path, 'w') as file:
+        json.dump(document, file, indent=2)
+    return path
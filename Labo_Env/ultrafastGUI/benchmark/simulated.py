@@ -0,0 +1,148 @@
+"""
+Simulated instruments used by the benchmark recipes.
+
+The stage is the real Physics_Instrument.LinearStage connected to the
+simulated controller of Stage_Simulation. The other classes mimic the part of
+the interface of the real wrapper that the experiments use
+(Spectrometer.Spectro and Zurich_Instrument.Zurich) and sleep for a
+configurable amount of time to reproduce the communication and acquisition
+latencies of the hardware. The lock-in uses the data server of
+Zurich_Simulation.
+"""
+import time
+import numpy as np
+
+
+# Latencies are in seconds, velocity in mm/s and rates in Sa/s
+DEFAULT_LATENCIES = {
+    'command': 0.0005,          # Answer time of the stage controller to every command
+    'velocity': 10.0,           # Stage velocity
+    'acceleration': 500.0,      # Stage acceleration and deceleration in mm/s^2
+    'settle_time': 0.005,       # Settling of the stage at the end of a move
+    'integration_time': 0.010,  # Spectrometer integration time
+    'spectro_readout': 0.002,   # USB transfer of one spectrum
+    'node_access': 0.001,       # Data server getDouble/getInt/set round trip
+    'subscribe': 0.005,         # Data server subscribe/unsubscribe
+    'poll_overhead': 0.002,     # Data server poll round trip
+    'demod_rate': 1717.0,       # Demodulator sample rate
+}
+
+
+def _sleep(duration):
+    """Sleep for duration seconds, ignoring non positive durations."""
+    if duration > 0:
+        time.sleep(duration)
+
+
+def connect_stage(latencies=None):
+    """
+    Return a Physics_Instrument.LinearStage connected to a simulated PI
+    controller served by Stage_Simulation, so the moves go through pipython
+    and the socket like with the real controllers.
+
+    Parameters:
+        latencies : Dictionary overriding some of DEFAULT_LATENCIES.
+    """
+    from Physics_Instrument import LinearStage
+    from Stage_Simulation import StageModel, SimulatedPIController
+    latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+    model = StageModel(velocity=latencies['velocity'], acceleration=latencies['acceleration'],
+                       settle_time=latencies['settle_time'])
+    stage = LinearStage()
+    stage.connect_simulation('SIM-PI', SimulatedPIController(model, latency=latencies['command']))
+    return stage
+
+
+def close_stage(stage):
+    """Close the connection, the mover thread and the server of connect_stage."""
+    if stage.mover is not None:
+        stage.mover.shutdown()
+    stage.device.close()
+    stage.simulation.close()
+
+
+class _SeabreezeDevice:
+    """Minimal stand-in for the seabreeze Spectrometer object."""
+    def __init__(self, parent, pixels):
+        self.parent = parent
+        self._wavelengths = np.linspace(200, 1100, pixels)
+        self._integration = parent.latencies['integration_time']
+
+    def wavelengths(self):
+        return self._wavelengths
+
+    def integration_time_micros(self, time_micros):
+        self._integration = time_micros*1e-6
+
+    def trigger_mode(self, mode):
+        self.parent.trigger = mode
+
+    def intensities(self):
+        _sleep(self._integration + self.parent.latencies['spectro_readout'])
+        center = 800 + 10*np.random.randn()
+        signal = np.exp(-((self._wavelengths - center)/30)**2)
+        return 1000*signal + np.random.randn(self._wavelengths.size)
+
+
+class SimulatedSpectrometer:
+    """
+    Stand-in for Spectrometer.Spectro. Every spectrum takes the integration
+    time plus the readout time to be returned.
+
+    Attributes:
+        spectro : Object with the seabreeze Spectrometer methods used.
+        trigger : Trigger mode last set on the device.
+        acquisitions : Number of spectra returned since the creation.
+    """
+    def __init__(self, latencies=None, pixels=2048):
+        """
+        Constructor for the SimulatedSpectrometer class.
+
+        Parameters:
+            latencies : Dictionary overriding some of DEFAULT_LATENCIES.
+            pixels : Number of pixels of the simulated detector.
+        """
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.spectro = _SeabreezeDevice(self, pixels)
+        self.trigger = 0
+        self.acquisitions = 0
+
+    def set_trigger(self, mode=0):
+        self.spectro.trigger_mode(mode)
+
+    def adjust_integration_time(self, variable=None):
+        """Set the integration time in ms from a number or a tkinter variable."""
+        if variable is None:
+            return
+        if type(variable) not in (int, float):
+            variable = variable.get()
+        self.spectro.integration_time_micros(variable*1000)
+
+    def get_intensities(self):
+        self.acquisitions += 1
+        return self.spectro.intensities()
+
+
+class SimulatedZurich:
+    """
+    Stand-in for Zurich_Instrument.Zurich exposing the info dictionary that
+    the experiments read the daq object and the device name from. The daq is
+    a Zurich_Simulation.SimulatedDAQServer, it can also be given to
+    Zurich.attach to run the real wrapper.
+    """
+    def __init__(self, latencies=None, device='dev0000', noise=1e-3):
+        """
+        Constructor for the SimulatedZurich class.
+
+        Parameters:
+            latencies : Dictionary overriding some of DEFAULT_LATENCIES.
+            device : Name of the simulated device used in the node paths.
+            noise : Standard deviation of the demodulator noise in V.
+        """
+        from Zurich_Simulation import SimulatedDAQServer
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        daq = SimulatedDAQServer(device, sample_rate=self.latencies['demod_rate'], noise=noise,
+                                 latency=self.latencies['node_access'],
+                                 subscribe_latency=self.latencies['subscribe'],
+                                 poll_overhead=self.latencies['poll_overhead'])
+        self.info = {'daq': daq, 'device': daq.device, 'prop': daq.props}
@@ -12,6 +12,7 @@ from ...version import __version__
 from .gcscommands_helpers import *
 from .. import gcserror
 from ..gcserror import GCSError
+from ..gcsbatch import GCSBatch
 from ..gcs21.gcs21commands_helpers import getparamerterdictfromstring, parseblockanswertodict, \
     get_status_dict_for_containerunits
 from .gcscommands_helpers import GCS1DEVICES, GCS2DEVICES
@@ -132,6 +133,17 @@ class GCSBaseCommands(object):
         if error:
             raise GCSError(error)
 
+    def deferrederrcheck(self):
+        """Check the controller error only at synchronization points, use "with self.deferrederrcheck():".
+        The points are calls of syncerror(), the end of batches and the end of the "with" block.
+        @return : Context manager, see pipython.pidevice.gcsmessages.GCSMessages.deferrederrcheck.
+        """
+        return self._msgs.deferrederrcheck()
+
+    def syncerror(self):
+        """Query error from controller if errcheck is enabled and raise it with the commands sent before."""
+        self._msgs.syncerror()
+
     @property
     def floatformat(self):
         """Get format specifier that formats float arguments into command strings."""
@@ -261,6 +273,14 @@ class GCSBaseCommands(object):
         cmdstr = '%s %s' % (cmd, ''.join(items))
         return cmdstr.strip()
 
+    def batch(self):
+        """Queue commands and send them to the device in one write when the returned batch is flushed.
+        Use "with self.batch() as batch:" and call the commands on "batch", they return futures that
+        get the results at the end of the "with" block, e.g. "pos = batch.qPOS()" and "pos.result()".
+        @return : Instance of pipython.pidevice.gcsbatch.GCSBatch.
+        """
+        return GCSBatch(self)
+
     def SetErrorCheck(self, value):
         """Set error check property to 'value' and return current value.
         DEPRECATED: Use GCSMessages.errcheck instead.
@@ -9,8 +9,17 @@ from time import sleep, time
 from ..common.gcscommands_helpers import isdeviceavailable
 from .gcs2commands import GCS2Commands
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 __signature__ = 0x34b50792a0c61f3d4953a7248186832
 
+# Bounds in seconds of the period to poll the number of recorded values
+MIN_POLL_PERIOD = 0.001
+MAX_POLL_PERIOD = 0.1
+
 # Invalid class attribute name pylint: disable=C0103
 # Too few public methods pylint: disable=R0903
 # Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
@@ -617,14 +626,66 @@ class GCS2Datarecorder(object):
         numvalues = self.numvalues or self.maxnumvalues
         if self._gcs.HasqDRL():
             maxtime = time() + timeout
-            while min([self._gcs.qDRL(table)[table] for table in self.rectables]) < numvalues:
+            while True:
+                recorded = self._recorded()
+                if recorded >= numvalues:
+                    break
                 if timeout and time() > maxtime:
                     raise SystemError('timeout after %.1f secs while waiting on data recorder' % timeout)
+                sleep(self._pollperiod(numvalues - recorded))
         else:
             waittime = 1.2 * self.rectime
             debug('Datarecorder.wait: wait %.2f secs for data recording', waittime)
             sleep(waittime)
 
+    def _recorded(self):
+        """Return the number of values recorded in all record tables as integer."""
+        answer = self._gcs.qDRL(self.rectables)
+        return min([answer[table] for table in self.rectables])
+
+    def _pollperiod(self, numvalues):
+        """Return the time in seconds to record 'numvalues' values, within the bounds of the poll period.
+        @param numvalues : Number of values as integer.
+        """
+        return min(max(numvalues * self.sampletime, MIN_POLL_PERIOD), MAX_POLL_PERIOD)
+
+    def stream(self, chunksize=1, timeout=0, callback=None):
+        """Read out the data while it is being recorded and yield it in chunks.
+        Each chunk is a NumPy array of shape (tables, values), or a list of columns if NumPy is
+        not installed, with at least 'chunksize' values per table except for the last one.
+        @param chunksize : Minimum number of values per table to read at once as integer.
+        @param timeout : Timeout in seconds while no new value is recorded, is disabled by default.
+        @param callback : Optional function that is called with each chunk before it is yielded.
+        @return : Generator of the chunks.
+        """
+        if not self.rectables:
+            raise SystemError('rectables are not set')
+        if not self._gcs.HasqDRL():
+            raise SystemError('device %r does not support the DRL? command' % self._gcs.devname)
+        self._header = None
+        offset = self.offset
+        end = offset + (self.numvalues or self.maxnumvalues)
+        chunksize = max(1, int(chunksize))
+        maxtime = time() + timeout
+        while offset < end:
+            recorded = self._recorded()
+            numvalues = min(recorded, end - 1) - offset + 1
+            if numvalues < min(chunksize, end - offset):
+                if timeout and time() > maxtime:
+                    raise SystemError('timeout after %.1f secs while streaming data recorder' % timeout)
+                sleep(self._pollperiod(min(chunksize, end - offset) - max(0, numvalues)))
+                continue
+            header, data = self.read(offset, numvalues)
+            if self._header is None:
+                self._header = header
+            chunk = np.array(data) if np is not None else [list(column) for column in data]
+            debug('Datarecorder.stream: read %d values from index %d', numvalues, offset)
+            offset += numvalues
+            maxtime = time() + timeout
+            if callback:
+                callback(chunk)
+            yield chunk
+
     def read(self, offset=None, numvalues=None, verbose=False):
         """Read out the data and return it.
         @param offset : Start point in the table as integer, starts with index 1, overwrites self.offset.
@@ -4,7 +4,6 @@
 # Trailing newlines pylint: disable=C0305
 
 from logging import debug, warning
-from time import sleep
 from ..common.gcsbasecommands import GCSBaseCommands
 from .gcs21commands_helpers import PIAxisStatusKeys, PIValueDataTypes, PIBlockKeys, PIBlockNames, PIContainerUnitKeys, \
     get_subdict_form_umfblockcommnaddict
@@ -282,28 +281,7 @@ class GCS21Commands(GCSBaseCommands):
             blocksize = read_block_size
 
         while self._msgs._databuffer['index'] > 0:
-
-            # Lock the access to the databuffer
-            while self._msgs._databuffer['lock']:
-                sleep(0.05)
-            self._msgs._databuffer['lock'] = True
-
-            # The blocksize cannot be larger than the number of values in the array
-            if blocksize > self._msgs._databuffer['index']:
-                blocksize = self._msgs._databuffer['index']
-
-            yield [x[0:blocksize] for x in self._msgs.bufdata]
-            self._msgs._databuffer['data'] = [x[blocksize:] for x in self._msgs.bufdata]
-            self._msgs._databuffer['index'] -= blocksize
-            self._msgs._databuffer['lastindex'] -= blocksize
-
-            if self._msgs._databuffer['index'] < 0:
-                self._msgs._databuffer['index'] = 0
-
-            if self._msgs._databuffer['lastindex'] < 0:
-                self._msgs._databuffer['lastindex'] = 0
-
-            self._msgs._databuffer['lock'] = False
+            yield self._msgs.popbufdata(blocksize)
 
     # Unused argument 'noraise' pylint: disable=W0613
     def StopAll(self, noraise=False):
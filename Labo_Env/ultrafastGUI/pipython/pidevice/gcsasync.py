@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Provide GCS functions to control a PI device with asyncio."""
+
+import asyncio
+from copy import copy, deepcopy
+from logging import debug
+
+from . import GCSError, gcserror
+from .gcs2.gcs2commands import GCS2Commands
+from .gcs21.gcs21commands import GCS21Commands
+from .gcs21.gcs21commands_helpers import isgcs21
+from .gcs21.gcs21error import GCS21Error
+from .gcsbatch import _Deferred
+from .gcsmessages import GCSMessages
+from .pierror_base import PIErrorBase
+
+__signature__ = 0x1c7e2a94b05d68f3a2b1c0d9e8f7a6b5
+
+
+# Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
+class _ScriptMessages(object):
+    """Stand-in for GCSMessages that runs a synchronous command up to its next unanswered read."""
+
+    def __init__(self, msgs, answers):
+        """Replay 'answers' to the reads of the command and record what it sends.
+        @type msgs : AsyncGCSMessages
+        @param answers : Answers of the device to the reads done so far as list of strings or of
+        the GCS errors to raise instead.
+        """
+        self._msgs = msgs
+        self._answers = answers
+        self.errcheck = msgs.errcheck
+        self.sent = []  # Tuples of (string, True if read, errcheck)
+
+    def __getattr__(self, name):
+        return getattr(self._msgs, name)
+
+    def send(self, tosend):
+        """Record 'tosend'.
+        @param tosend : String to send to device.
+        """
+        self.sent.append((tosend, False, self.errcheck))
+
+    def read(self, tosend, gcsdata=0):
+        """Record 'tosend' and return its answer if it is known, else stop the command.
+        @param tosend : String to send to device.
+        @param gcsdata : Number of lines of GCS data, must be 0.
+        @return : Device answer as string.
+        """
+        if gcsdata != 0:
+            raise TypeError('commands that read GCS data are not supported with asyncio')
+        self.sent.append((tosend, True, self.errcheck))
+        numreads = len([item for item in self.sent if item[1]])
+        if numreads > len(self._answers):
+            raise _Deferred()
+        answer = self._answers[numreads - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+# Too many instance attributes pylint: disable=R0902
+# Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
+class AsyncGCSMessages(object):
+    """Provide a GCS communication layer for asyncio."""
+
+    def __init__(self, interface):
+        """Provide a GCS communication layer for asyncio.
+        @type interface : pipython.pidevice.interfaces.piasync.PIAsyncSocket
+        """
+        debug('create an instance of AsyncGCSMessages(interface=%s)', interface)
+        self._interface = interface
+        self._lock = None
+        self._pending = u''  # Received data following the last answer read
+        self.logfile = ''
+        self.errcheck = True
+        self.embederr = True  # The error is always queried in the same write as the command
+        self.gcs_error_class = GCSError
+
+    def __str__(self):
+        return 'AsyncGCSMessages(interface=%s)' % self._interface
+
+    @property
+    def connectionid(self):
+        """Get ID of current connection as integer."""
+        return self._interface.connectionid
+
+    @property
+    def connected(self):
+        """Get the connection state as bool."""
+        return self._interface.connected
+
+    @property
+    def timeout(self):
+        """Get current timeout setting in milliseconds."""
+        return self._interface.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        """Set timeout.
+        @param value : Timeout in milliseconds as integer.
+        """
+        self._interface.settimeout(int(value))
+
+    @property
+    def lock(self):
+        """Lock held during an exchange with the device, created in the running event loop."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def send(self, tosend):
+        """Send 'tosend' to device and check for error, both in one exchange.
+        @param tosend : String to send to device, with or without trailing linefeed.
+        """
+        _, exc = await self.pipeline([tosend], 0)
+        if exc is not None:
+            raise exc
+
+    async def read(self, tosend):
+        """Send 'tosend' to device, read answer and check for error, all in one exchange.
+        @param tosend : String to send to device.
+        @return : Device answer as string.
+        """
+        answers, exc = await self.pipeline([tosend], 1)
+        if exc is not None:
+            raise exc
+        return answers[0]
+
+    async def pipeline(self, commands, numanswers, errcheck=None):
+        """Send 'commands' in one write, followed by "ERR?" if errcheck is enabled, and read the answers.
+        @param commands : List of strings to send to device, with or without trailing linefeed.
+        @param numanswers : Number of answers to read as integer.
+        @param errcheck : Overrides self.errcheck if not None.
+        @return : Tuple of the answers as list of strings and the GCS error of the device or None.
+        """
+        errcheck = self.errcheck if errcheck is None else errcheck
+        tosend = u''.join(cmd if len(cmd) < 2 or cmd.endswith('\n') else cmd + '\n' for cmd in commands)
+        if errcheck:
+            tosend += 'ERR?\n'
+        async with self.lock:
+            await self._interface.send(tosend)
+            answers = [await self._read() for _ in range(numanswers)]
+            exc = await self._checkerror() if errcheck else None
+        return answers, exc
+
+    async def _read(self):
+        """Read answer from device until this ends with linefeed with no preceeding space.
+        @return : Received data as string.
+        """
+        chunks = []
+        received, self._pending = self._pending, u''
+        prev = u''
+        while True:
+            if received:
+                # Answers are split as in GCSMessages._read
+                # Access to a protected member of a client class pylint: disable=W0212
+                end = GCSMessages._answerend(received, prev, first=not chunks)
+                if end:
+                    chunks.append(received[:end])
+                    self._pending = received[end:]
+                    break
+                chunks.append(received)
+                prev = received[-1]
+            received = await self._interface.read_until('\n', self.timeout / 1000.)
+            if not received:
+                raise GCSError(gcserror.E_7_COM_TIMEOUT, '@ AsyncGCSMessages._read')
+        return u''.join(chunks)
+
+    async def _checkerror(self):
+        """Read the answer to "ERR?" and return the GCS error or None."""
+        answer = await self._read()
+        try:
+            err = int(answer)
+        except ValueError:
+            return GCSError(gcserror.E_1004_PI_UNEXPECTED_RESPONSE, 'invalid answer on "ERR?": %r' % answer)
+        return self.gcs_error_class(err) if err else None
+
+
+# Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
+class AsyncGCSDevice(object):
+    """Provide the GCS commands of a PI device as coroutines, e.g. "await device.MOV('1', 1.0)".
+    Can be used as asynchronous context manager.
+    The commands of GCS2Commands or GCS21Commands are run on an answer-replaying stand-in of
+    GCSMessages. At each read that is not answered yet, the strings sent so far are sent in one
+    write with the read command and "ERR?", and the command is run again with the answer.
+    Commands that read GCS data, e.g. qDRR(), are not supported.
+    """
+
+    def __init__(self, gateway):
+        """Provide the GCS commands of the device connected via 'gateway'.
+        @type gateway : pipython.pidevice.interfaces.piasync.PIAsyncSocket
+        """
+        debug('create an instance of AsyncGCSDevice(gateway=%s)', gateway)
+        self.gateway = gateway
+        self._msgs = AsyncGCSMessages(gateway)
+        self._commands = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __str__(self):
+        return 'AsyncGCSDevice(gateway=%s)' % self.gateway
+
+    @property
+    def errcheck(self):
+        """Get current error check setting."""
+        return self._msgs.errcheck
+
+    @errcheck.setter
+    def errcheck(self, value):
+        """Set error check property.
+        @param value : True means that the error is queried with each command.
+        """
+        self._msgs.errcheck = bool(value)
+
+    @property
+    def timeout(self):
+        """Get current timeout setting in milliseconds."""
+        return self._msgs.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        """Set timeout in milliseconds."""
+        self._msgs.timeout = value
+
+    async def open(self):
+        """Open the gateway if necessary and choose the GCS commands of the connected device."""
+        if not self.gateway.connected:
+            await self.gateway.open()
+        self._commands = GCS2Commands(self._msgs)
+        # Access to a protected member of a client class pylint: disable=W0212
+        if await self._run(lambda commands: isgcs21(commands._msgs)):
+            self._msgs.gcs_error_class = GCS21Error
+            self._commands = GCS21Commands(self._msgs)
+        debug('AsyncGCSDevice.open: use %s', type(self._commands).__name__)
+        await self._run(lambda commands: (commands.devname, commands.axes))
+
+    async def close(self):
+        """Close the gateway."""
+        await self.gateway.close()
+
+    def __getattr__(self, name):
+        if name.startswith('_') or self._commands is None:
+            raise AttributeError(name)
+        if not callable(getattr(self._commands, name)):
+            raise AttributeError('%r is not a GCS command, use the "commands" attribute' % name)
+
+        async def coroutine(*args, **kwargs):
+            """Run the command and return its result."""
+            return await self._run(lambda commands: getattr(commands, name)(*args, **kwargs))
+
+        return coroutine
+
+    @property
+    def commands(self):
+        """Synchronous GCS commands, to access the properties cached by open(), i.e. "devname" and "axes"."""
+        return self._commands
+
+    def _snapshot(self, msgs):
+        """Return a copy of the synchronous commands that uses 'msgs' as messages.
+        Its cached values, e.g. "devname" or "funcs", are copied too, so that every run of a
+        command starts from the same state and does the same reads.
+        @type msgs : _ScriptMessages
+        @return : Copy of self._commands.
+        """
+        commands = copy(self._commands)
+        commands.__dict__ = dict((key, value if key == '_msgs' else deepcopy(value))
+                                 for key, value in self._commands.__dict__.items())
+        commands._msgs = msgs  # Access to a protected member of a client class pylint: disable=W0212
+        return commands
+
+    async def _run(self, func):
+        """Run 'func' on a snapshot of the commands until it returns and send what it sends.
+        The snapshot replaces the commands when 'func' returns, with the values it cached.
+        @param func : Function that is called with the synchronous commands and runs GCS commands.
+        @return : Result of 'func'.
+        """
+        answers = []
+        transmitted = []
+        while True:
+            msgs = _ScriptMessages(self._msgs, answers)
+            commands = self._snapshot(msgs)
+            try:
+                result = func(commands)
+                deferred = False
+            except _Deferred:
+                deferred = True
+            sent = [item[0] for item in msgs.sent]
+            if sent[:len(transmitted)] != transmitted:
+                raise TypeError('command sent %r instead of %r when run again' % (sent, transmitted))
+            tosend = msgs.sent[len(transmitted):]
+            transmitted = sent
+            if not deferred:
+                await self._exchange(tosend)
+                commands._msgs = self._msgs  # Access to a protected member pylint: disable=W0212
+                self._commands = commands
+                return result
+            try:
+                answer = await self._exchange(tosend)
+            except PIErrorBase as exc:
+                answer = exc  # Raised at the read, the command may handle it
+            answers.append(answer)
+
+    async def _exchange(self, tosend):
+        """Send the strings of 'tosend' in one write and return the answer of the last one if it reads.
+        @param tosend : List of tuples (string, True if read, errcheck) as recorded by _ScriptMessages.
+        @return : Answer as string or None.
+        """
+        if not tosend:
+            return None
+        isread = tosend[-1][1]
+        answers, exc = await self._msgs.pipeline([item[0] for item in tosend], 1 if isread else 0,
+                                                 errcheck=any(item[2] for item in tosend))
+        if exc is not None:
+            raise exc
+        return answers[0] if isread else None
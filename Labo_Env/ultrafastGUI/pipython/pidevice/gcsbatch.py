@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Queue GCS commands and send them to a PI device in one write."""
+
+from concurrent.futures import Future
+from copy import copy
+from logging import debug
+
+__signature__ = 0x3d0a1e5b8c6f4e27a9b1d2c3e4f50617
+
+
+class _Deferred(Exception):
+    """Stop a command at its first read while it is queued."""
+
+
+# Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
+class _BatchMessages(object):
+    """Stand-in for GCSMessages that records the strings a command sends or replays its answer."""
+
+    def __init__(self, msgs, sent=None, answer=None):
+        """Record the strings sent by a command or, if 'sent' is given, replay 'answer' to it.
+        @type msgs : pipython.pidevice.gcsmessages.GCSMessages
+        @param sent : List of strings recorded for the command or None to record them.
+        @param answer : Answer of the device to the read command as string or None.
+        """
+        self._msgs = msgs
+        self._replay = sent is not None
+        self.sent = list(sent or [])
+        self.answer = answer
+        self.isread = answer is not None
+        self._index = 0
+
+    def __getattr__(self, name):
+        return getattr(self._msgs, name)
+
+    def send(self, tosend):
+        """Record or verify 'tosend'.
+        @param tosend : String to send to device.
+        """
+        self._record(tosend)
+
+    def read(self, tosend, gcsdata=0):
+        """Record or verify 'tosend' and return the answer of the device when replaying.
+        @param tosend : String to send to device.
+        @param gcsdata : Number of lines of GCS data, must be 0.
+        @return : Device answer as string.
+        """
+        if gcsdata != 0:
+            raise TypeError('commands that read GCS data cannot be batched')
+        self._record(tosend)
+        if not self._replay:
+            self.isread = True
+            raise _Deferred()
+        return self.answer
+
+    def _record(self, tosend):
+        """Append 'tosend' to the recorded strings or verify it against them.
+        @param tosend : String to send to device.
+        """
+        if not self._replay:
+            if self.isread:
+                raise TypeError('commands that send after reading cannot be batched')
+            self.sent.append(tosend)
+            return
+        if self._index >= len(self.sent) or self.sent[self._index] != tosend:
+            raise TypeError('command sent %r which was not queued, it cannot be batched' % tosend)
+        self._index += 1
+
+
+# Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
+class GCSBatch(object):
+    """Queue GCS commands of a device and send them in one write, can be used as context manager.
+    Commands are called on the batch with the same arguments as on the device and return a
+    concurrent.futures.Future. They are sent by flush(), i.e. at the end of the "with" block,
+    followed by a single "ERR?" if error checking is enabled. Then the answers are read and
+    converted into the results of the futures.
+    Commands that read GCS data or that send depending on an answer cannot be batched, a
+    TypeError is raised when they are queued or set on their future.
+    """
+
+    def __init__(self, device):
+        """Queue GCS commands of 'device'.
+        @type device : pipython.pidevice.common.gcsbasecommands.GCSBaseCommands
+        """
+        debug('create an instance of GCSBatch(device=%s)', device)
+        self._device = device
+        self._queue = []
+        # Query the cached properties now so that the commands do not query them while queued
+        _ = device.devname, device.funcs, device.axes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.cancel()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __getattr__(self, name):
+        command = getattr(self._device, name)
+        if not callable(command):
+            raise AttributeError('%r is not a GCS command' % name)
+
+        def queue(*args, **kwargs):
+            """Queue the command and return its future."""
+            return self.queue(name, *args, **kwargs)
+
+        return queue
+
+    def _call(self, msgs, name, args, kwargs):
+        """Call command 'name' on a copy of the device that uses 'msgs'.
+        @type msgs : _BatchMessages
+        @param name : Name of the command as string.
+        @param args : Positional arguments of the command as tuple.
+        @param kwargs : Keyword arguments of the command as dictionary.
+        @return : Result of the command.
+        """
+        device = copy(self._device)
+        device._msgs = msgs  # Access to a protected member of a client class pylint: disable=W0212
+        return getattr(device, name)(*args, **kwargs)
+
+    def queue(self, name, *args, **kwargs):
+        """Queue command 'name' with its arguments.
+        @param name : Name of the command as string, e.g. "MOV" or "qPOS".
+        @return : Future that gets the result of the command.
+        """
+        msgs = _BatchMessages(self._device._msgs)  # Access to a protected member pylint: disable=W0212
+        try:
+            self._call(msgs, name, args, kwargs)
+        except _Deferred:
+            pass
+        future = Future()
+        self._queue.append((name, args, kwargs, msgs, future))
+        debug('GCSBatch.queue: %r', msgs.sent)
+        return future
+
+    def cancel(self):
+        """Cancel all queued commands without sending them."""
+        for _, _, _, _, future in self._queue:
+            future.cancel()
+        self._queue = []
+
+    def flush(self):
+        """Send the queued commands, read their answers and set the results of their futures.
+        Raise the GCS error of the device after setting it on the futures of the commands that do
+        not read an answer, the query commands get their results anyway.
+        """
+        queue, self._queue = self._queue, []
+        if not queue:
+            return
+        msgs = self._device._msgs  # Access to a protected member of a client class pylint: disable=W0212
+        sent = [text for item in queue for text in item[3].sent]
+        answers, exc = msgs.pipeline(sent, len([item for item in queue if item[3].isread]))
+        answers.reverse()
+        for name, args, kwargs, recorder, future in queue:
+            replay = _BatchMessages(msgs, recorder.sent, answers.pop() if recorder.isread else None)
+            if not future.set_running_or_notify_cancel():
+                continue
+            if exc is not None and not recorder.isread:
+                future.set_exception(exc)
+                continue
+            try:
+                future.set_result(self._call(replay, name, args, kwargs))
+            except Exception as err:  # Catching too general exception pylint: disable=W0703
+                future.set_exception(err)
+        if exc is not None:
+            raise exc
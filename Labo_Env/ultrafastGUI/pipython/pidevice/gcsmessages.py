@@ -2,14 +2,28 @@
 # -*- coding: utf-8 -*-
 """Process messages between GCSCommands and an interface."""
 
+from collections import deque
+from contextlib import contextmanager
 from logging import debug, error
-from threading import RLock, Thread
+import re
+from threading import Lock, RLock, Thread
 import sys
-from time import time, sleep
+from time import time
 from . import GCSError, gcserror
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 __signature__ = 0x202fc9d6fc175b91dc2b9b26aa26eb01
 
+# Linefeed without a preceeding space, i.e. the end of a GCS answer
+ANSWER_END = re.compile(r'(?<! )\n')
+
+# Number of commands kept to report a deferred error
+HISTORY_LENGTH = 100
+
 
 def eol(rcvbuf):
     """Return True if 'rcvbuf' is complete in terms of GCS syntax.
@@ -39,12 +53,17 @@ class GCSMessages(object):
         debug('create an instance of GCSMessages(interface=%s)', interface)
         self._lock = RLock()
         self._interface = interface
+        # 'data' is a list of columns, or with NumPy an array of shape (columns, capacity) whose
+        # columns are filled from 'start' to 'count', 'lock' protects it against the reading thread
         self._databuffer = {'size': 0, 'index': 0, 'lastindex': 0, 'lastupdate': None, 'data': [], 'error': None,
-                            'lock': False}
+                            'lock': Lock(), 'start': 0, 'count': 0}
         self._stopthread = False
         self.logfile = ''  # Full path to file where communication to/from controller is logged.
         self.errcheck = True
         self.embederr = False
+        self._pending = u''  # Received data following the last answer read
+        self._deferred = 0  # Depth of nested deferrederrcheck() blocks
+        self._history = deque(maxlen=HISTORY_LENGTH)  # Commands sent since the last deferred error check
         self._gcs_error_class = GCSError
 
     def __str__(self):
@@ -118,14 +137,125 @@ class GCSMessages(object):
 
     @property
     def bufdata(self):
-        """Get buffered data as 2-dimensional list of float values."""
+        """Get buffered data as 2-dimensional list of float values, or as NumPy array of shape
+        (columns, values) if NumPy is installed. The array is a view on the buffer.
+        """
         debug('GCSMessages.bufdata: %d datasets', self._databuffer['index'])
-        return self._databuffer['data']
+        with self._databuffer['lock']:
+            data = self._databuffer['data']
+            if np is not None and isinstance(data, np.ndarray):
+                return data[:, self._databuffer['start']:self._databuffer['count']]
+            return data
+
+    def popbufdata(self, numvalues):
+        """Remove the first 'numvalues' values of each column from the buffer and return them.
+        @param numvalues : Number of values per column as integer.
+        @return : Removed data, see bufdata.
+        """
+        with self._databuffer['lock']:
+            data = self._databuffer['data']
+            if np is not None and isinstance(data, np.ndarray):
+                start = self._databuffer['start']
+                stop = min(start + numvalues, self._databuffer['count'])
+                values = data[:, start:stop].copy()
+                self._databuffer['start'] = stop
+            else:
+                values = [column[:numvalues] for column in data]
+                self._databuffer['data'] = [column[numvalues:] for column in data]
+            self._databuffer['index'] = max(0, self._databuffer['index'] - numvalues)
+            self._databuffer['lastindex'] = max(0, self._databuffer['lastindex'] - numvalues)
+        return values
+
+    def _initbuffer(self, numcolumns):
+        """Empty the data buffer and prepare it for 'numcolumns' columns.
+        @param numcolumns : Number of columns of the GCS data as integer.
+        """
+        with self._databuffer['lock']:
+            if np is not None:
+                size = self._databuffer['size']
+                capacity = size if isinstance(size, int) and not isinstance(size, bool) and size > 0 else 1024
+                self._databuffer['data'] = np.empty((numcolumns, capacity))
+            else:
+                self._databuffer['data'] = [[] for _ in range(numcolumns)]
+            self._databuffer['start'] = 0
+            self._databuffer['count'] = 0
+
+    def _appendrows(self, rows):
+        """Append 'rows' to the columns of the data buffer.
+        @param rows : Array of shape (lines, columns) or list of lines as lists of floats.
+        """
+        with self._databuffer['lock']:
+            data = self._databuffer['data']
+            if np is not None and isinstance(data, np.ndarray):
+                rows = np.asarray(rows, dtype=float)
+                count = self._databuffer['count']
+                if count + rows.shape[0] > data.shape[1]:
+                    grown = np.empty((data.shape[0], max(2 * data.shape[1], count + rows.shape[0])))
+                    grown[:, :count] = data[:, :count]
+                    data = self._databuffer['data'] = grown
+                data[:, count:count + rows.shape[0]] = rows.T
+                self._databuffer['count'] = count + rows.shape[0]
+            else:
+                for values in rows:
+                    for i, value in enumerate(values):
+                        data[i].append(value)
+
+    @property
+    def deferred(self):
+        """True if the error is only checked at synchronization points, see deferrederrcheck()."""
+        return self._deferred > 0 and self.errcheck
+
+    @contextmanager
+    def deferrederrcheck(self):
+        """Check the error of the device only at synchronization points within the "with" block,
+        i.e. at calls of syncerror() and at the end of batches, and at the end of the block. The
+        raised GCS error lists the commands sent since the last check in its 'history' attribute.
+        If the block is left by an exception, the error of the device is queried when the
+        outermost block ends, logged and attached as 'deferrederror' to the exception, which
+        is raised unchanged.
+        """
+        self._deferred += 1
+        try:
+            yield self
+        except:  # No exception type(s) specified pylint: disable=W0702
+            self._deferred -= 1
+            if not self._deferred:
+                self._attachdeferrederror(sys.exc_info()[1])
+            raise
+        self._deferred -= 1
+        self.syncerror()
+
+    def _attachdeferrederror(self, exc):
+        """Query the error of the device and attach it to 'exc' as 'deferrederror'.
+        @param exc : Exception that left a deferrederrcheck() block.
+        """
+        try:
+            with self._lock:
+                deferred = self._checkerror(doraise=False)
+        except GCSError as err:
+            deferred = err
+        if not deferred:
+            return
+        error('GCSMessages: deferred error %s while handling %r', deferred, exc)
+        try:
+            exc.deferrederror = deferred
+        except AttributeError:
+            pass
+
+    def syncerror(self):
+        """Query the error of the device now, if errcheck is enabled, and raise it."""
+        with self._lock:
+            self._checkerror()
 
     def send(self, tosend):
         """Send 'tosend' to device and check for error.
         @param tosend : String to send to device, with or without trailing linefeed.
         """
+        if self.deferred:
+            with self._lock:
+                self._send(tosend)
+                self._history.append(tosend)
+            return
         if self.embederr and self.errcheck:
             if len(tosend) > 1 and not tosend.endswith('\n'):
                 tosend += '\n'
@@ -145,7 +275,7 @@ class GCSMessages(object):
         stopon = None
         if gcsdata != 0:
             stopon = '# END_HEADER'
-            self._databuffer['data'] = []
+            self._initbuffer(0)
             self._databuffer['index'] = 0
             self._databuffer['error'] = None
         with self._lock:
@@ -167,10 +297,30 @@ class GCSMessages(object):
                     self._readgcsdata(strbuf)
                 else:
                     self._databuffer['size'] = True
+            elif self.deferred:
+                self._history.append(tosend)
             else:
                 self._checkerror()
         return answer
 
+    def pipeline(self, commands, numanswers):
+        """Send 'commands' in one write, followed by "ERR?" if errcheck is enabled, and read the answers.
+        @param commands : List of strings to send to device, with or without trailing linefeed.
+        @param numanswers : Number of answers to read as integer.
+        @return : Tuple of the answers as list of strings and the GCS error of the device or None.
+        """
+        tosend = u''.join(cmd if len(cmd) < 2 or cmd.endswith('\n') else cmd + '\n' for cmd in commands)
+        if self.errcheck:
+            tosend += 'ERR?\n'
+        with self._lock:
+            if self.deferred:
+                self._history.extend(commands)
+            self._interface.send(tosend)
+            self._savelog(tosend)
+            answers = [self._read(stopon=None) for _ in range(numanswers)]
+            exc = self._checkerror(senderr=False, doraise=False)
+        return answers, exc or None
+
     def _savelog(self, msg):
         """Save (i.e. append) 'msg' to self.logfile.
         @param msg : Message to save with or without trailing linefeed.
@@ -194,24 +344,51 @@ class GCSMessages(object):
 
     def _read(self, stopon):
         """Read answer from device until this ends with linefeed with no preceeding space.
+        The interface blocks until a line is received, so no CPU time is spent while waiting.
+        Data received after the end of the answer, i.e. the next answers of pipelined commands,
+        is kept and returned by the next calls.
         @param stopon: Addditional uppercase string that stops reading, too.
         @return : Received data as string.
         """
-        rcvbuf = u''
-        timeout = time() + self.timeout / 1000.
-        while not eol(rcvbuf):
-            received = self._interface.read()
+        chunks = []
+        received, self._pending = self._pending, u''
+        # End of the data received, long enough to find 'stopon' when it is split between two chunks
+        tail = u''
+        keep = max(1, len(stopon or ''))
+        while True:
             if received:
-                rcvbuf += received
-                timeout = time() + self.timeout / 1000.
-            if time() > timeout:
+                end = self._answerend(received, tail[-1:], first=not chunks)
+                if end:
+                    chunks.append(received[:end])
+                    self._pending = received[end:]
+                    break
+                chunks.append(received)
+                window = tail + received
+                if stopon and stopon in window.upper():
+                    break
+                tail = window[-keep:]
+            received = self._interface.read_until('\n', self.timeout / 1000.)
+            if not received:
                 raise GCSError(gcserror.E_7_COM_TIMEOUT, '@ GCSMessages._read')
-            if stopon and stopon in rcvbuf.upper():
-                break
+        rcvbuf = u''.join(chunks)
         self._savelog('  ' + rcvbuf)
         self._check_no_eol(rcvbuf)
         return rcvbuf
 
+    @staticmethod
+    def _answerend(data, prev, first):
+        """Return the position after the end of the answer in 'data' or 0 if the answer is not complete.
+        @param data : Received data as string.
+        @param prev : Character received before 'data' as string, empty if 'data' starts the answer.
+        @param first : True if 'data' starts the answer.
+        @return : Index as integer.
+        """
+        if first and len(data) == 1 and ord(data) < 32:
+            return 1
+        pos = 1 if prev == ' ' and data[0] == '\n' else 0
+        match = ANSWER_END.search(data, pos)
+        return match.end() if match else 0
+
     @staticmethod
     def _check_no_eol(answer):
         """Check that 'answer' does not contain a LF without a preceeding SPACE except at the end.
@@ -231,7 +408,7 @@ class GCSMessages(object):
         if not eol(strbuf):
             strbuf += self._read(stopon=' \n')
         numcolumns = len(strbuf.split('\n')[0].split())
-        self._databuffer['data'] = [[] for _ in range(numcolumns)]
+        self._initbuffer(numcolumns)
         debug('GCSMessages: start background task to query GCS data')
         self._stopthread = False
         thread = Thread(target=self._fillbuffer, args=(strbuf, lambda: self._stopthread))
@@ -239,20 +416,19 @@ class GCSMessages(object):
 
     def _fillbuffer(self, answer, stop):
         """Read answers and save them as float values into the data buffer.
+        The complete lines received are converted at once.
         An answerline with invalid data (non-number, missing column) will be skipped and error flag is set.
         @param answer : String of already readout answer.
         @param stop : Callback function that stops the loop if True.
         """
         with self._lock:
             while True:
-                lines = answer.splitlines(True)  # keep line endings
-                answer = ''
-                for line in lines:
-                    if '\n' not in line:
-                        answer = line
-                        break
-                    self._convertfloats(line)
-                    if self._endofdata(line):
+                end = answer.rfind('\n') + 1
+                block, answer = answer[:end], answer[end:]
+                if block:
+                    self._convertblock(block)
+                    lastline = block[block.rfind('\n', 0, -1) + 1:]
+                    if self._endofdata(lastline):
                         debug('GCSMessages: end background task to query GCS data')
                         if not self._databuffer['error']:
                             self._databuffer['error'] = self._checkerror(doraise=False)
@@ -271,6 +447,25 @@ class GCSMessages(object):
                     error('GCSMessages: stop background task to query GCS data')
                     return
 
+    def _convertblock(self, block):
+        """Convert the lines in 'block' to float and append them to 'self._databuffer'.
+        With NumPy the whole block is converted at once, the lines are converted one by one
+        otherwise or to find the invalid ones.
+        @param block : Complete lines of qDRR answer with data values as string.
+        """
+        if np is not None:
+            numlines = block.count('\n')
+            try:
+                values = np.array(block.split(), dtype=float)
+            except ValueError:
+                values = None
+            if values is not None and values.size == numlines * len(self._databuffer['data']):
+                self._appendrows(values.reshape(numlines, -1))
+                self._databuffer['index'] += numlines
+                return
+        for line in block.splitlines(True):
+            self._convertfloats(line)
+
     def _convertfloats(self, line):
         """Convert items in 'line' to float and append them to 'self._databuffer'.
         @param line : One line in qDRR answer with data values as string.
@@ -287,15 +482,7 @@ class GCSMessages(object):
             self._databuffer['error'] = exc
             error('GCSMessages: GCSError: %s', exc)
         else:
-            while self._databuffer['lock']:
-                sleep(0.05)
-
-            try:
-                self._databuffer['lock'] = True
-                for i in range(numcolumns):
-                    self._databuffer['data'][i].append(values[i])
-            finally:
-                self._databuffer['lock'] = False
+            self._appendrows([values])
 
         self._databuffer['index'] += 1
 
@@ -327,6 +514,8 @@ class GCSMessages(object):
         if senderr:
             self._send('ERR?\n')
         answer = self._read(stopon=None)
+        history = [cmd.strip() for cmd in self._history]
+        self._history.clear()
         exc = None
         try:
             err = int(answer)
@@ -335,6 +524,9 @@ class GCSMessages(object):
         else:
             if err:
                 exc = self.gcs_error_class(err)
+                if history:
+                    exc.history = history
+                    exc.msg += ' after %s' % ', '.join('%r' % cmd for cmd in history)
         if exc and doraise:
             raise exc  # Raising NoneType while only classes or instances are allowed pylint: disable=E0702
         return exc
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Provide interfaces to use with asyncio, see pipython.pidevice.gcsasync."""
+
+import asyncio
+from logging import debug
+import socket
+
+from .. import GCSError, gcserror
+from ..interfaces.pigateway import PI_CONTROLLER_CODEPAGE
+
+__signature__ = 0x6b2f0c93d41e57a8b9c0d1e2f3a4b5c6
+
+
+class PIAsyncSocket(object):
+    """Provide a socket for asyncio, can be used as asynchronous context manager."""
+
+    def __init__(self, host='localhost', port=50000):
+        """Provide a socket, it is connected by open().
+        @param host : IP address as string, defaults to "localhost".
+        @param port : IP port to use as integer, defaults to 50000.
+        """
+        debug('create an instance of PIAsyncSocket(host=%s, port=%s)', host, port)
+        self._timeout = 7000  # milliseconds
+        self._host = host
+        self._port = port
+        self._reader = None
+        self._writer = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __str__(self):
+        return 'PIAsyncSocket(host=%s, port=%s)' % (self._host, self._port)
+
+    @property
+    def timeout(self):
+        """Return timeout in milliseconds."""
+        return self._timeout
+
+    def settimeout(self, value):
+        """Set timeout to 'value' in milliseconds."""
+        self._timeout = value
+
+    @property
+    def connected(self):
+        """Return True if a device is connected."""
+        return self._writer is not None
+
+    @property
+    def connectionid(self):
+        """Return 0 as ID of current connection."""
+        return 0
+
+    async def open(self):
+        """Open the connection to the device."""
+        debug('PIAsyncSocket.open: open connection to %s:%s', self._host, self._port)
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # disable Nagle algorithm
+
+    async def send(self, msg):
+        """Send 'msg' to the socket.
+        @param msg : String to send.
+        """
+        debug('PIAsyncSocket.send: %r', msg)
+        try:
+            self._writer.write(msg.encode(PI_CONTROLLER_CODEPAGE))
+            await self._writer.drain()
+        except (ConnectionError, AttributeError):
+            raise GCSError(gcserror.E_2_SEND_ERROR)
+
+    async def read_until(self, terminator, timeout):
+        """Return the answer received until it contains 'terminator' or 'timeout' expires.
+        @param terminator : String that ends the reading, e.g. a line feed.
+        @param timeout : Maximum time to wait in seconds as float.
+        @return : Answer as string, it may continue after 'terminator' and is incomplete on timeout.
+        """
+        terminator = terminator.encode(PI_CONTROLLER_CODEPAGE)
+        received = bytearray()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while terminator not in received:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(self._reader.read(4096), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:  # connection closed by the device
+                break
+            received += chunk
+        debug('PIAsyncSocket.read_until: %r', received)
+        return received.decode(encoding=PI_CONTROLLER_CODEPAGE, errors='ignore')
+
+    async def close(self):
+        """Close socket."""
+        debug('PIAsyncSocket.close: close connection to %s:%s', self._host, self._port)
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+        self._reader = self._writer = None
+
+
+class PIAsyncGateway(object):
+    """Run a synchronous gateway, e.g. PISerial or PIUSB, in a worker thread for asyncio.
+    Can be used as asynchronous context manager.
+    """
+
+    def __init__(self, gateway):
+        """Provide 'gateway' for asyncio, its blocking calls are run in the default executor.
+        @type gateway : pipython.pidevice.interfaces.pigateway.PIGateway
+        """
+        debug('create an instance of PIAsyncGateway(gateway=%s)', gateway)
+        self._gateway = gateway
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __str__(self):
+        return 'PIAsyncGateway(gateway=%s)' % self._gateway
+
+    @property
+    def timeout(self):
+        """Return timeout in milliseconds."""
+        return self._gateway.timeout
+
+    def settimeout(self, value):
+        """Set timeout to 'value' in milliseconds."""
+        self._gateway.settimeout(value)
+
+    @property
+    def connected(self):
+        """Return True if a device is connected."""
+        return self._gateway.connected
+
+    @property
+    def connectionid(self):
+        """Return ID of current connection as integer."""
+        return self._gateway.connectionid
+
+    async def _run(self, func, *args):
+        """Call 'func' with 'args' in the default executor and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def open(self):
+        """The gateway is connected when it is created."""
+
+    async def send(self, msg):
+        """Send 'msg' to the gateway.
+        @param msg : String to send.
+        """
+        await self._run(self._gateway.send, msg)
+
+    async def read_until(self, terminator, timeout):
+        """Return the answer received until it contains 'terminator' or 'timeout' expires.
+        @param terminator : String that ends the reading, e.g. a line feed.
+        @param timeout : Maximum time to wait in seconds as float.
+        @return : Answer as string, it may continue after 'terminator' and is incomplete on timeout.
+        """
+        return await self._run(self._gateway.read_until, terminator, timeout)
+
+    async def close(self):
+        """Close the gateway."""
+        await self._run(self._gateway.close)
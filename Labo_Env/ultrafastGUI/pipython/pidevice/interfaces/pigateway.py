@@ -3,6 +3,7 @@
 """Interface class to communicate with a PI device."""
 
 from abc import ABCMeta, abstractmethod, abstractproperty
+from time import sleep, time
 
 __signature__ = 0x50f5b2b52033500d605fcc1edae4b0b9
 
@@ -60,6 +61,26 @@ class PIGateway(object):
         """
         raise NotImplementedError()
 
+    def read_until(self, terminator, timeout):
+        """Return the answer received until it contains 'terminator' or 'timeout' expires.
+        This default implementation polls read() every millisecond, interfaces that can wait
+        for incoming data without polling override it.
+        @param terminator : String that ends the reading, e.g. a line feed.
+        @param timeout : Maximum time to wait in seconds as float.
+        @return : Answer as string, it may continue after 'terminator' and is incomplete on timeout.
+        """
+        received = u''
+        deadline = time() + timeout
+        while terminator not in received:
+            chunk = self.read()
+            if chunk:
+                received += chunk
+                continue
+            if time() > deadline:
+                break
+            sleep(0.001)
+        return received
+
     @abstractmethod
     def flush(self):
         """Flush input buffer. Should be called once after connect."""
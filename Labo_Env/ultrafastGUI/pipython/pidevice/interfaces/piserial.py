@@ -74,6 +74,29 @@ class PISerial(PIGateway):
             debug('PISerial.read: %r', received)
         return received.decode(encoding=PI_CONTROLLER_CODEPAGE, errors='ignore')
 
+    def read_until(self, terminator, timeout):
+        """Return the answer received until it contains 'terminator' or 'timeout' expires.
+        Blocks in the serial driver for the first byte, then reads all waiting bytes at once.
+        @param terminator : String that ends the reading, e.g. a line feed.
+        @param timeout : Maximum time to wait in seconds as float.
+        @return : Answer as string, it may continue after 'terminator' and is incomplete on timeout.
+        """
+        if self._ser.timeout != timeout:
+            self._ser.timeout = timeout
+        terminator = terminator.encode(PI_CONTROLLER_CODEPAGE)
+        received = bytearray()
+        start = 0
+        while received.find(terminator, start) < 0:
+            # Only the new bytes can complete the terminator
+            start = max(0, len(received) - len(terminator) + 1)
+            chunk = self._ser.read(max(1, self._ser.in_waiting))
+            if not chunk:  # timeout
+                break
+            received += chunk
+        if received:
+            debug('PISerial.read_until: %r', received)
+        return received.decode(encoding=PI_CONTROLLER_CODEPAGE, errors='ignore')
+
     def flush(self):
         """Flush input buffer."""
         debug('PISerial.flush()')
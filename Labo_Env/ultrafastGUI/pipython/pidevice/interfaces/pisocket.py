@@ -3,7 +3,9 @@
 """Provide a socket."""
 
 from logging import debug
+import select
 import socket
+from time import time
 
 from .. import GCSError, gcserror
 from ..interfaces.pigateway import PIGateway, PI_CONTROLLER_CODEPAGE
@@ -76,6 +78,33 @@ class PISocket(PIGateway):
             return u''
         return received.decode(encoding=PI_CONTROLLER_CODEPAGE, errors='ignore')
 
+    def read_until(self, terminator, timeout):
+        """Return the answer received until it contains 'terminator' or 'timeout' expires.
+        Waits on the socket with select() instead of polling recv().
+        @param terminator : String that ends the reading, e.g. a line feed.
+        @param timeout : Maximum time to wait in seconds as float.
+        @return : Answer as string, it may continue after 'terminator' and is incomplete on timeout.
+        """
+        terminator = terminator.encode(PI_CONTROLLER_CODEPAGE)
+        received = bytearray()
+        deadline = time() + timeout
+        start = 0
+        while received.find(terminator, start) < 0:
+            # Only the new bytes can complete the terminator
+            start = max(0, len(received) - len(terminator) + 1)
+            remaining = deadline - time()
+            if remaining <= 0 or not select.select([self._socket], [], [], remaining)[0]:
+                break
+            try:
+                chunk = self._socket.recv(4096)
+            except IOError:
+                continue
+            if not chunk:  # connection closed by the device
+                break
+            received += chunk
+        debug('PISocket.read_until: %r', received)
+        return received.decode(encoding=PI_CONTROLLER_CODEPAGE, errors='ignore')
+
     def flush(self):
         """Flush input buffer."""
         debug('PISocket.flush()')
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 """Collection of helpers for using a PI device."""
+import os
 import sys
 import numbers
 from abc import abstractmethod
@@ -8,8 +9,14 @@ from collections import OrderedDict
 from io import open  # Redefining built-in 'open' pylint: disable=W0622
 from logging import debug
 from time import sleep, time
+from weakref import WeakKeyDictionary
 from future.utils import raise_from
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from pipython.pidevice.common.gcscommands_helpers import isdeviceavailable
 from pipython.pidevice.gcs2.gcs2commands import GCS2Commands
 from pipython.pidevice.gcs21.gcs21commands import GCS21Commands
@@ -21,6 +28,16 @@ from pipython.pidevice.common.gcscommands_helpers import getgcsheader, getitemsv
 
 __signature__ = 0x140be928458e8e786db43234bbf5056
 
+# Motion profiles {axis: (velocity, acceleration, deceleration)} of the devices, queried once per device
+# and axis by GCSBaseTools.getmotionprofile(). Cleared with GCSBaseTools.clearmotionprofile().
+MOTIONPROFILES = WeakKeyDictionary()
+
+# Closed loop velocity, acceleration and deceleration parameters of GCS 2.0 controllers
+SPA_VELOCITY = 0x49
+SPA_ACCELERATION = 0x0B
+SPA_DECELERATION = 0x0C
+
+
 # Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
 class GCSBaseDeviceStartup(object):  # Too many instance attributes pylint: disable=R0902
     """Provide a "ready to use" PI device."""
@@ -280,6 +297,111 @@ class GCSBaseTools(object):
             sleep(polldelay)
         sleep(postdelay)
 
+    def getmotionprofile(self, axis):
+        """Return the motion profile of 'axis', queried from the controller the first time only.
+        @param axis : Axis as string.
+        @return : Tuple (velocity, acceleration, deceleration) as floats or None if unknown.
+        """
+        profiles = MOTIONPROFILES.setdefault(self._pidevice, {})
+        if axis not in profiles:
+            profiles[axis] = self._query_motion_profile(axis)
+            debug('GCSBaseTools.getmotionprofile(axis=%r) = %r', axis, profiles[axis])
+        return profiles[axis]
+
+    def clearmotionprofile(self, axes=None):
+        """Forget the cached motion profiles, call it after changing velocity or acceleration.
+        @param axes : Axis or list/tuple of axes or None for all axes.
+        """
+        profiles = MOTIONPROFILES.get(self._pidevice, {})
+        for axis in (list(profiles) if axes is None else self.getaxeslist(axes)):
+            profiles.pop(axis, None)
+
+    def predictmove(self, axes=None, targets=None):
+        """Return the time in seconds needed by 'axes' to reach 'targets' from their current position
+        with a trapezoidal velocity profile.
+        @param axes : Axis or list/tuple of axes or None for all axes.
+        @param targets : Dictionary {axis: target} or None to use the targets of qMOV.
+        @return : Duration in seconds as float, 0 if it cannot be predicted.
+        """
+        axes = self.getaxeslist(axes)
+        if not axes or not self._pidevice.HasqPOS():
+            return 0.
+        profiles = [self.getmotionprofile(axis) for axis in axes]
+        if None in profiles:
+            return 0.
+        if targets is None:
+            if not self._pidevice.HasqMOV():
+                return 0.
+            targets = self._pidevice.qMOV(axes)
+        positions = self._pidevice.qPOS(axes)
+        duration = 0.
+        for axis, (velocity, acceleration, deceleration) in zip(axes, profiles):
+            distance = abs(targets[axis] - positions[axis])
+            # Distances needed to reach the velocity and to stop
+            accdistance = velocity ** 2 / (2. * acceleration)
+            decdistance = velocity ** 2 / (2. * deceleration)
+            if distance >= accdistance + decdistance:
+                axisduration = velocity / acceleration + velocity / deceleration + \
+                               (distance - accdistance - decdistance) / velocity
+            else:  # triangular profile, the velocity is never reached
+                peak = (2. * distance * acceleration * deceleration / (acceleration + deceleration)) ** 0.5
+                axisduration = peak / acceleration + peak / deceleration
+            duration = max(duration, axisduration)
+        debug('GCSBaseTools.predictmove(axes=%r) = %.4f s', axes, duration)
+        return duration
+
+    # Too many arguments pylint: disable=R0913
+    def waitontargetpredicted(self, axes=None, timeout=300, postdelay=0, mindelay=0.001, maxdelay=0.1,
+                              earliness=0.9):
+        """Wait until all closedloop 'axes' are on target like waitontarget() but sleep until shortly
+        before the end of the move predicted from its distance and the motion profile, then poll with
+        a delay growing from 'mindelay' to 'maxdelay'.
+        @param axes : Axes to wait for as string or list/tuple, or None to wait for all axes.
+        @param timeout : Timeout in seconds as float.
+        @param postdelay : Additional delay time in seconds as float after reaching desired state.
+        @param mindelay : First delay time between polls in seconds as float.
+        @param maxdelay : Longest delay time between polls in seconds as float.
+        @param earliness : Fraction of the predicted duration slept before polling.
+        """
+        axes = self.getaxeslist(axes)
+        if not axes:
+            return
+        start = time()
+        maxtime = start + timeout
+        if not self._pidevice.HasqONT():
+            self.waitonready(timeout=timeout, polldelay=mindelay)
+            return
+        servo = self.getservo(axes)
+        axes = [x for x in axes if servo[x]]
+        if axes:
+            sleep(max(0., start + earliness * self.predictmove(axes) - time()))
+        self.waitonready(timeout=timeout, polldelay=mindelay)
+        delay = mindelay
+        while axes and not all(list(self._get_closed_loop_on_target(axes, throwonaxiserror=True).values())):
+            if time() > maxtime:
+                raise SystemError('waitontargetpredicted() timed out after %.1f seconds' % timeout)
+            sleep(delay)
+            delay = min(2 * delay, maxdelay)
+        sleep(postdelay)
+
+    def _query_motion_profile(self, axis):
+        """Return (velocity, acceleration, deceleration) of 'axis' or None if not available."""
+        values = []
+        for query, param in (('qVEL', SPA_VELOCITY), ('qACC', SPA_ACCELERATION), ('qDEC', SPA_DECELERATION)):
+            value = None
+            try:
+                if getattr(self._pidevice, 'Has' + query)():
+                    value = getattr(self._pidevice, query)(axis)[axis]
+                elif isdeviceavailable([GCS2Commands, ], self._pidevice) and self._pidevice.HasqSPA():
+                    value = self._pidevice.qSPA(axis, param)[axis][param]
+            except (GCSError, GCS21Error) as exc:
+                debug('could not query %s of axis %r: %s', query, axis, exc)
+            values.append(value)
+        velocity, acceleration, deceleration = values
+        if not velocity or not acceleration:
+            return None
+        return float(velocity), float(acceleration), float(deceleration or acceleration)
+
     # Too many arguments pylint: disable=R0913
     def waitonreferencing(self, axes=None, timeout=300, predelay=0, postdelay=0, polldelay=0.1):
         """Wait until referencing of 'axes' is finished or timeout.
@@ -390,38 +512,51 @@ class GCSBaseTools(object):
         @param data : Datarecorder data as one or two dimensional list of floats or NumPy array.
         """
         debug('save %r', filepath)
-        try:
-            data = data.tolist()  # convert numpy array to list
-        except AttributeError:
-            pass  # data already is a list
-        if not isinstance(data[0], list):  # data must be multi dimensional
-            data = [data]
+        if np is not None:
+            data = np.asarray(data, dtype=float)
+            if data.ndim == 1:  # data must be multi dimensional
+                data = data[np.newaxis]
+            numcolumns, numvalues = data.shape
+        else:
+            if not isinstance(data[0], list):  # data must be multi dimensional
+                data = [data]
+            numcolumns, numvalues = len(data), len(data[0])
         if header is None:
-            header = OrderedDict([('VERSION', 1), ('TYPE', 1), ('SEPARATOR', 32), ('DIM', len(data)),
-                                  ('NDATA', len(data[0]))])
+            header = OrderedDict([('VERSION', 1), ('TYPE', 1), ('SEPARATOR', 32), ('DIM', numcolumns),
+                                  ('NDATA', numvalues)])
         sep = chr(header['SEPARATOR'])
-        out = ''
-        for key, value in header.items():
-            out += '# %s = %s \n' % (key, value)
-        out += '# \n# END_HEADER \n'
-        for values in map(list, zip(*data)):  # transpose data
-            out += sep.join(['%f' % value for value in values]) + ' \n'
-        out = out[:-2] + '\n'
-        GCSBaseTools.piwrite(filepath, out)
-
+        out = ['# %s = %s \n' % (key, value) for key, value in header.items()]
+        out.append('# \n# END_HEADER \n')
+        if np is None:
+            for values in zip(*data):  # transpose data
+                out.append(sep.join(['%f' % value for value in values]) + ' \n')
+            out[-1] = out[-1][:-2] + '\n'
+            GCSBaseTools.piwrite(filepath, out)
+            return
+        with open(filepath, 'w', encoding='utf-8', newline='\n') as fobj:
+            fobj.write(u''.join(out))
+            if numvalues:
+                # Every line but the last one ends with a space
+                np.savetxt(fobj, data[:, :-1].T, fmt='%f', delimiter=sep, newline=' \n')
+                fobj.write(sep.join(['%f' % value for value in data[:, -1]]) + '\n')
 
     @staticmethod
-    def readgcsarray(filepath):
+    def readgcsarray(filepath, mmap=False):
         """Read a GCSArray file and return header and data.
         Scans the file until the start of the data is found
         to account additional information at the start of the file
         @param filepath : Full path to file as string.
+        @param mmap : If True the data are converted once into the NumPy file 'filepath'.npy
+        which is memory-mapped, later calls only read the header. Requires NumPy.
         @return header : Header information from qDRR() as dictionary.
-        @return data : Datarecorder data as two columns list of floats.
+        @return data : Datarecorder data as list of columns of floats, or as NumPy array
+        of shape (columns, values) if NumPy is installed.
         """
         debug('read %r', filepath)
-        headerstr, datastr = [], []
+        headerstr = []
         gcsarray_found = False
+        datastr = ''
+        cachepath = filepath + '.npy'
 
         with open(filepath, 'r', encoding='utf-8', newline='\n') as fobj:
             for line in fobj:
@@ -438,18 +573,37 @@ class GCSBaseTools(object):
                 if line.startswith('#'):
                     headerstr.append(line)
                 else:
-                    datastr.append(line)
+                    datastr = line
+                    break
+
+            header = getgcsheader(''.join(headerstr))
+            if mmap and np is not None and os.path.isfile(cachepath) and \
+                    os.path.getmtime(cachepath) >= os.path.getmtime(filepath):
+                return header, np.load(cachepath, mmap_mode='r')
+            datastr += fobj.read()
 
-        header = getgcsheader('\n'.join(headerstr))
         sep = chr(header['SEPARATOR'])
         numcolumns = header['DIM']
-        data = [[] for _ in range(numcolumns)]
-        for line in datastr:
-            if not line.strip():
-                continue
-            values = [float(x) for x in line.strip().split(sep)]
-            for i in range(numcolumns):
-                data[i].append(values[i])
+        data = None
+        if np is not None:
+            try:
+                values = np.array(datastr.replace(sep, ' ').split(), dtype=float)
+                data = np.ascontiguousarray(values.reshape(-1, numcolumns).T)
+            except ValueError:
+                debug('readgcsarray: irregular data, read line by line')
+        if data is None:
+            data = [[] for _ in range(numcolumns)]
+            for line in datastr.splitlines():
+                if not line.strip():
+                    continue
+                values = [float(x) for x in line.strip().split(sep)]
+                for i in range(numcolumns):
+                    data[i].append(values[i])
+            if np is not None:
+                data = np.array(data)
+        if mmap and np is not None:
+            np.save(cachepath, data)
+            data = np.load(cachepath, mmap_mode='r')
         return header, data
 
 
@@ -561,3 +715,76 @@ class GCSBaseTools(object):
         """Move 'axes' to its middle positions but do not wait "on target".
         @param axes : List/tuple of strings of axes to get values for or None to query all axes.
         """
+
+
+# Class inherits from object, can be safely removed from bases in python3 pylint: disable=R0205
+class GCSArrayWriter(object):
+    """Write data to a GCSArray file while it is recorded, can be used as context manager.
+    The header is written first with a placeholder for NDATA which is set by close().
+    """
+
+    NDATA_WIDTH = 20
+
+    def __init__(self, filepath, header=None, numcolumns=None):
+        """Create the GCSArray file and write the header.
+        @param filepath : Full path to target file as string, existing file will be replaced.
+        @param header : Header information from qDRR() as dictionary or None.
+        @param numcolumns : Number of columns as integer, used if 'header' is None.
+        """
+        debug('create GCSArrayWriter(%r)', filepath)
+        if header is None:
+            header = OrderedDict([('VERSION', 1), ('TYPE', 1), ('SEPARATOR', 32), ('DIM', numcolumns)])
+        header = OrderedDict(header)
+        header['NDATA'] = 0
+        self.filepath = filepath
+        self.numcolumns = header['DIM']
+        self.numvalues = 0
+        self._sep = chr(header['SEPARATOR'])
+        self._fobj = open(filepath, 'wb')
+        for key, value in header.items():
+            if key == 'NDATA':
+                self._fobj.write(b'# NDATA = ')
+                self._ndatapos = self._fobj.tell()
+                value = str(value).ljust(self.NDATA_WIDTH)
+                self._fobj.write((value + ' \n').encode('utf-8'))
+            else:
+                self._fobj.write(('# %s = %s \n' % (key, value)).encode('utf-8'))
+        self._fobj.write(b'# \n# END_HEADER \n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        """Append values to the file.
+        @param data : Values as list of columns or NumPy array of shape (columns, values),
+        or one dimensional for a single column.
+        """
+        if np is not None:
+            data = np.asarray(data, dtype=float)
+            if data.ndim == 1:
+                data = data[np.newaxis]
+            np.savetxt(self._fobj, data.T, fmt='%f', delimiter=self._sep, newline=' \n')
+            self.numvalues += data.shape[1]
+        else:
+            if not isinstance(data[0], (list, tuple)):
+                data = [data]
+            lines = [self._sep.join(['%f' % value for value in values]) + ' \n' for values in zip(*data)]
+            self._fobj.write(''.join(lines).encode('utf-8'))
+            self.numvalues += len(lines)
+
+    def close(self):
+        """Terminate the last line, write NDATA and close the file."""
+        if self._fobj is None:
+            return
+        if self.numvalues:
+            # The last line ends without a space
+            self._fobj.seek(-2, os.SEEK_END)
+            self._fobj.write(b'\n')
+            self._fobj.truncate()
+        self._fobj.seek(self._ndatapos)
+        self._fobj.write(str(self.numvalues).ljust(self.NDATA_WIDTH).encode('utf-8'))
+        self._fobj.close()
+        self._fobj = None
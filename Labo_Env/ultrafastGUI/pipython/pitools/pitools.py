@@ -8,7 +8,7 @@ from ..pidevice.gcs2.gcs2commands import GCS2Commands
 from ..pidevice.gcs21.gcs21commands import GCS21Commands
 from .gcs2.gcs2pitools import GCS2Tools, GCS2DeviceStartup
 from .gcs21.gcs21pitools import GCS21Tools, GCS21DeviceStartup
-from .common.gcsbasepitools import GCSBaseTools
+from .common.gcsbasepitools import GCSBaseTools, GCSArrayWriter
 
 
 __signature__ = 0x84a1dd4ea97fe22f5271064ca9115f0
@@ -245,6 +245,49 @@ def waitontarget(pidevice, axes=None, timeout=300, predelay=0, postdelay=0, poll
                           (type(pidevice).__name__, inspect.stack()[0].function))
 
 
+# Too many arguments pylint: disable=R0913
+def waitontargetpredicted(pidevice, axes=None, timeout=300, postdelay=0, mindelay=0.001, maxdelay=0.1,
+                          earliness=0.9):
+    """Wait until all closedloop 'axes' are on target, sleeping during the predicted duration of the move
+    and then polling with an exponential backoff.
+    @type pidevice : pipython.gcscommands.GCSCommands
+    @param axes : Axes to wait for as string or list/tuple, or None to wait for all axes.
+    @param timeout : Timeout in seconds as float.
+    @param postdelay : Additional delay time in seconds as float after reaching desired state.
+    @param mindelay : First delay time between polls in seconds as float.
+    @param maxdelay : Longest delay time between polls in seconds as float.
+    @param earliness : Fraction of the predicted duration slept before polling.
+    """
+    if isdeviceavailable([GCS2Commands, ], pidevice):
+        GCS2Tools(pidevice).waitontargetpredicted(axes, timeout, postdelay, mindelay, maxdelay, earliness)
+        return
+
+    if isdeviceavailable([GCS21Commands, ], pidevice):
+        GCS21Tools(pidevice).waitontargetpredicted(axes, timeout, postdelay, mindelay, maxdelay, earliness)
+        return
+
+    raise PIInvalidDevice("Type %s of pidevice is not supported for '%s'!" %
+                          (type(pidevice).__name__, inspect.stack()[0].function))
+
+
+def clearmotionprofile(pidevice, axes=None):
+    """Forget the cached motion profiles used by waitontargetpredicted(), call it after changing
+    velocity or acceleration.
+    @type pidevice : pipython.gcscommands.GCSCommands
+    @param axes : Axis or list/tuple of axes or None for all axes.
+    """
+    if isdeviceavailable([GCS2Commands, ], pidevice):
+        GCS2Tools(pidevice).clearmotionprofile(axes)
+        return
+
+    if isdeviceavailable([GCS21Commands, ], pidevice):
+        GCS21Tools(pidevice).clearmotionprofile(axes)
+        return
+
+    raise PIInvalidDevice("Type %s of pidevice is not supported for '%s'!" %
+                          (type(pidevice).__name__, inspect.stack()[0].function))
+
+
 # Too many arguments pylint: disable=R0913
 def waitonreferencing(pidevice, axes=None, timeout=300, predelay=0, postdelay=0, polldelay=0.1):
     """Wait until referencing of 'axes' is finished or timeout.
@@ -429,15 +472,18 @@ def savegcsarray(filepath, header, data):
     GCSBaseTools.savegcsarray(filepath, header, data)
 
 
-def readgcsarray(filepath):
+def readgcsarray(filepath, mmap=False):
     """Read a GCSArray file and return header and data.
     Scans the file until the start of the data is found
     to account additional information at the start of the file
     @param filepath : Full path to file as string.
+    @param mmap : If True the data are converted once into the NumPy file 'filepath'.npy
+    which is memory-mapped, later calls only read the header. Requires NumPy.
     @return header : Header information from qDRR() as dictionary.
-    @return data : Datarecorder data as two columns list of floats.
+    @return data : Datarecorder data as list of columns of floats, or as NumPy array
+    of shape (columns, values) if NumPy is installed.
     """
-    return GCSBaseTools.readgcsarray(filepath)
+    return GCSBaseTools.readgcsarray(filepath, mmap)
 
 
 def itemstostr(data):
@@ -0,0 +1,62 @@
+"""
+Check AsyncGCSDevice against the simulated PI controller of Stage_Simulation,
+the answers must be the same as with the synchronous GCSDevice. Run with
+"python -m unittest discover -s tests" from the ultrafastGUI directory.
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Stage_Simulation import StageModel, SimulatedPIController, SimulationServer
+from pipython.pidevice.gcsasync import AsyncGCSDevice
+from pipython.pidevice.gcsdevice import GCSDevice
+from pipython.pidevice.interfaces.piasync import PIAsyncSocket
+from pipython.pidevice.interfaces.pisocket import PISocket
+
+
+class TestAsyncGCSDevice(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimulationServer(SimulatedPIController({'1': StageModel(0.0)}))
+        self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def run_async(self, func):
+        async def main():
+            async with AsyncGCSDevice(PIAsyncSocket(self.server.host, self.server.port)) as device:
+                return await func(device)
+        return asyncio.run(main())
+
+    def test_cached_properties(self):
+        async def func(device):
+            return device.commands.devname, device.commands.axes
+        gcs = GCSDevice(gateway=PISocket(self.server.host, self.server.port))
+        try:
+            expected = gcs.devname, gcs.axes
+        finally:
+            gcs.close()
+        self.assertEqual(self.run_async(func), expected)
+        self.assertEqual(expected[1], ['1'])
+
+    def test_has_command(self):
+        async def func(device):
+            return await device.HasqPOS(), await device.HasqDRR(), await device.qSAI(), device.commands.axes
+        self.assertEqual(self.run_async(func), (True, False, ['1'], ['1']))
+
+    def test_move(self):
+        async def func(device):
+            await device.SVO('1', True)
+            await device.MOV('1', 1.0)
+            while not (await device.qONT('1'))['1']:
+                await asyncio.sleep(0.01)
+            return await device.qPOS('1')
+        self.assertAlmostEqual(self.run_async(func)['1'], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()